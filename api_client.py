@@ -0,0 +1,122 @@
+import random
+import time
+from threading import Lock
+from typing import Optional, Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import API_BASE_URL
+from metrics import LatencyHistogram
+from utils import strip_html
+
+# Status codes that are worth retrying, the request never reached the bot or it was overloaded
+RETRY_STATUS_CODES = (502, 503, 504)
+
+
+class ApiClient:
+    """
+    Client for the Spoofy bot API.
+
+    Uses one pooled `requests.Session` so connections are kept alive between calls, applies connect/read
+    timeouts and retries failed requests with exponential backoff and jitter. Every call returns a
+    `(ok, msg, short_msg)` style tuple like the rest of the client expects.
+    """
+    _instance: Optional['ApiClient'] = None
+    _instance_lock: Lock = Lock()
+
+    def __init__(self, base_url: str = API_BASE_URL, connect_timeout: float = 3.05, read_timeout: float = 10.0,
+                 retries: int = 3, backoff: float = 0.25, backoff_max: float = 4.0, pool_size: int = 10):
+        self.base_url: str = base_url
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.retries: int = retries
+        self.backoff: float = backoff
+        self.backoff_max: float = backoff_max
+        self.session: requests.Session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.latency: Dict[str, LatencyHistogram] = {}
+        self.latency_lock: Lock = Lock()
+
+    @classmethod
+    def get_instance(cls) -> 'ApiClient':
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = ApiClient()
+            return cls._instance
+
+    def histogram(self, endpoint: str) -> LatencyHistogram:
+        with self.latency_lock:
+            if endpoint not in self.latency:
+                self.latency[endpoint] = LatencyHistogram()
+            return self.latency[endpoint]
+
+    def backoff_delay(self, attempt: int) -> float:
+        # Full jitter: a random delay up to the exponential backoff for this attempt
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def get(self, endpoint: str, params: Dict) -> requests.Response:
+        # GET an endpoint, retrying connection errors, timeouts and gateway errors
+        histogram = self.histogram(endpoint)
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                res = self.session.get(self.base_url + endpoint, params=params, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                histogram.observe(time.monotonic() - started)
+                if attempt >= self.retries:
+                    raise
+            else:
+                histogram.observe(time.monotonic() - started)
+                if res.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                    return res
+            time.sleep(self.backoff_delay(attempt))
+            attempt += 1
+
+    @staticmethod
+    def http_error(res: requests.Response) -> Tuple[bool, str, str]:
+        content = strip_html(res.content.decode("utf-8"))
+        return False, f"HTTP error {res.status_code} - {content}", "Connection error."
+
+    def check(self, username):
+        # Connects to the API and checks if everything is good to go
+        try:
+            res = self.get("check/", params={"user": username})
+        except requests.exceptions.RequestException as e:
+            return False, f"Connection error: {e}", "Connection error."
+
+        if res.status_code == 200:
+            data = res.json()
+            return data['linked'], "", ""
+        return self.http_error(res)
+
+    def connect(self, username, link_code):
+        try:
+            res = self.get("connect/", params={"user": username, "link_code": link_code})
+        except requests.exceptions.RequestException as e:
+            return False, f"Connection error: {e}", "Connection error."
+        if res.status_code == 200:
+            data = res.json()
+            if data.get("error", False):
+                return False, data['msg'], data['short_msg']
+            else:
+                return True, data['address'], data['port']
+        return self.http_error(res)
+
+    def start(self, link_code):
+        try:
+            res = self.get("start/", params={"link_code": link_code})
+        except requests.exceptions.RequestException as e:
+            return False, f"Connection error: {e}", "Connection error."
+        if res.status_code == 200:
+            data = res.json()
+            if data.get("error", False):
+                return False, data['msg'], data['short_msg']
+            else:
+                return True, "", ""
+        return self.http_error(res)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,70 @@
+"""
+Measures restarting librespot with the credential cache cold and warm.
+
+Every login starts a new process (benchmarks/fake_librespot.py by default, or whatever SPOOFY_LIBRESPOT points to
+together with SPOOFY_USERNAME and SPOOFY_PASSWORD for a real account) and waits until it logged in. Cold logins
+start from an empty cache and use the password, warm ones log in with the credentials cached by the first login.
+The fake librespot takes --auth-delay seconds for a password login and --cached-auth-delay for a cached one.
+
+    python -m benchmarks.bench_cache --logins 5 --auth-delay 1.5 --cached-auth-delay 0.5
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_sessions import BenchClient
+from credential_cache import CredentialCache
+from librespot_pool import LibrespotPool
+
+FAKE_LIBRESPOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_librespot.py")
+
+
+def login(pool: LibrespotPool, username: str, password: str) -> float:
+    # Seconds from starting librespot until it is logged in, then stops it again
+    started = time.perf_counter()
+    controller = pool.acquire(BenchClient(), username, password)
+    try:
+        if not controller.pooled.logged_in.result(timeout=60):
+            raise RuntimeError("Login failed")
+        duration = time.perf_counter() - started
+        # The cache target writes the password hash right after the login, give it a moment
+        time.sleep(0.1)
+    finally:
+        controller.stop()
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=5, help="Logins per measurement")
+    parser.add_argument("--auth-delay", type=float, default=1.5, help="Seconds a password login takes (fake only)")
+    parser.add_argument("--cached-auth-delay", type=float, default=0.5,
+                        help="Seconds a login with cached credentials takes (fake only)")
+    args = parser.parse_args()
+    if "SPOOFY_LIBRESPOT" not in os.environ:
+        os.environ["SPOOFY_LIBRESPOT"] = (f'"{sys.executable}" "{FAKE_LIBRESPOT}" --auth-delay {args.auth_delay} '
+                                          f'--cached-auth-delay {args.cached_auth_delay}')
+    username = os.environ.get("SPOOFY_USERNAME", "bench")
+    password = os.environ.get("SPOOFY_PASSWORD", "password")
+
+    cold = []
+    for _ in range(args.logins):
+        with tempfile.TemporaryDirectory() as root:
+            cold.append(login(LibrespotPool(max_idle=0, cache=CredentialCache(root)), username, password))
+
+    with tempfile.TemporaryDirectory() as root:
+        pool = LibrespotPool(max_idle=0, cache=CredentialCache(root))
+        login(pool, username, password)
+        warm_args, _ = pool.cache.librespot_args(username, password)
+        warm = [login(pool, username, password) for _ in range(args.logins)]
+
+    print(f"Cold cache: {statistics.median(cold) * 1000:>8.1f} ms (median of {len(cold)})")
+    print(f"Warm cache: {statistics.median(warm) * 1000:>8.1f} ms (median of {len(warm)})")
+    print(f"Password on the command line with a warm cache: {'--password' in warm_args}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Streams to a stand-in bot without and with a capture, and compares the send latency, how far the bot's audio
+drifted from real time and the CPU used, with the time every capture write took. The capture budget is smaller
+than the stream, so the ring wraps. Then replays the capture faster than real time to another stand-in bot and
+checks that it got exactly the end of what the first bot received. The same is checked for a lossless stream at
+48 kHz in mono with gain and limiter, where the capture holds the audio after the DSP stage and the resampler.
+Exits with 1 if a capture differs from what its bot got, or from what its replay sent.
+
+    python -m benchmarks.bench_capture --duration 8 --capture-size 1 --speed 4
+"""
+import argparse
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+from benchmarks.bench_sessions import BenchClient, cpu_seconds, fake_args
+from benchmarks.replay_capture import replay, stalls
+from benchmarks.stand_in_bot import StandInBot
+from capture import capture_dir, read_capture
+from dsp import DspStage
+from spotify_controller import SpotifyController
+from stream_codec import LOSSLESS
+
+
+def stream(root: Optional[str], args, processed: bool = False) -> dict:
+    bot = StandInBot(keep_audio=True)
+    controller = SpotifyController.spawn(BenchClient(), fake_args("bench", "password", 160))
+    if processed:
+        controller.codec = LOSSLESS
+        controller.resample_quality = "medium"
+        controller.dsp = DspStage(gain_db=6.0, limiter=True, mono=True)
+    controller.capture_dir = root
+    controller.capture_budget = int(args.capture_size * 1024 * 1024)
+    controller.address, controller.port = bot.address, bot.port
+    own_start, _ = cpu_seconds()
+    controller.setup_output()
+    time.sleep(args.duration)
+    own_end, _ = cpu_seconds()
+    controller.stop()
+    time.sleep(0.2)
+    bot.close()
+    final, worst = bot.drift(2 * bot.channels * bot.sample_rate)
+    latency = controller.metrics.send_latency
+    return {
+        "name": ("capture" if root is not None else "no capture") + (" dsp" if processed else ""),
+        "bot": bot,
+        "session": controller.metrics.session,
+        "stream_id": controller.metrics.stream_id,
+        "send_mean_ms": latency.mean() * 1000,
+        "send_p99_ms": latency.percentile(99) * 1000,
+        "drift_ms": final * 1000,
+        "worst_drift_ms": worst * 1000,
+        "cpu_percent": (own_end - own_start) / args.duration * 100,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=8.0, help="Seconds to stream")
+    parser.add_argument("--capture-size", type=float, default=1.0, help="Disk space of the capture in MiB")
+    parser.add_argument("--speed", type=float, default=4.0, help="Replay speed")
+    args = parser.parse_args()
+
+    results = [stream(None, args)]
+    failures = []
+    for processed in (False, True):
+        root = tempfile.mkdtemp(prefix="spoofy-capture-")
+        results.append(stream(root, args, processed))
+        directory = capture_dir(root, results[-1]["session"], results[-1]["stream_id"])
+        failures += [f"{results[-1]['name']}: {f}" for f in check(directory, results[-1]["bot"], args.speed)]
+    print(f"{'':>15} {'send ms':>8} {'p99 ms':>7} {'drift ms':>9} {'worst ms':>9} {'CPU %':>6}")
+    for r in results:
+        print(f"{r['name']:>15} {r['send_mean_ms']:>8.3f} {r['send_p99_ms']:>7.2f} {r['drift_ms']:>+9.0f} "
+              f"{r['worst_drift_ms']:>+9.0f} {r['cpu_percent']:>6.1f}")
+    for failure in failures:
+        print(f"[FAIL] {failure}")
+    if failures:
+        sys.exit(1)
+
+
+def check(directory: str, sent_to: StandInBot, speed: float) -> List[str]:
+    chunks = list(read_capture(directory))
+    if not chunks:
+        return [f"nothing was captured to {directory}"]
+    audio = b"".join(chunk.data for chunk in chunks)
+    last = chunks[-1]
+    span = last.time - chunks[0].time + len(last.data) / last.byte_rate
+    received = sent_to.audio
+    start = chunks[0].position
+    captured = received[start:start + len(audio)] == audio
+    print(f"capture kept {len(audio) / last.byte_rate:.2f} s of {len(received) / last.byte_rate:.2f} s sent at "
+          f"{last.sample_rate} Hz with {last.channels} channel(s) (bot: {sent_to.sample_rate} Hz, "
+          f"{sent_to.channels}), from {start / last.byte_rate:.2f} s on, "
+          f"{'matches' if captured else 'DIFFERS FROM'} what the bot got")
+    for event in stalls(chunks):
+        print(f"  {event}")
+
+    bot = StandInBot(keep_audio=True)
+    elapsed = replay(chunks, bot.address, bot.port, speed)
+    time.sleep(0.2)
+    bot.close()
+    replayed = bytes(bot.audio) == audio
+    print(f"replayed {span:.2f} s in {elapsed:.2f} s ({span / elapsed:.1f}x), "
+          f"bot got {'the same audio' if replayed else 'DIFFERENT AUDIO'}")
+    failures = []
+    if not captured:
+        failures.append("the capture differs from what the bot got")
+    if not replayed:
+        failures.append("the replay differs from the capture")
+    return failures
+
+
+if __name__ == "__main__":
+    main()
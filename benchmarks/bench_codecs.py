@@ -0,0 +1,79 @@
+"""
+Streams benchmarks/fake_librespot.py through every stream codec to a stand-in bot, and reports the bandwidth
+used and the encoding cost. The stand-in bot negotiates the codec like the real bot would and decodes the stream,
+lossless streams are checked against the audio fake librespot generated. Every codec is also offered to a bot that
+only takes PCM, which has to get the plain stream. Exits with 1 if any of these checks fails.
+
+    python -m benchmarks.bench_codecs --duration 5
+"""
+import argparse
+import sys
+import time
+
+from benchmarks.bench_sessions import BenchClient, cpu_seconds, fake_args
+from benchmarks.fake_librespot import tone
+from benchmarks.stand_in_bot import StandInBot
+from spotify_controller import SpotifyController, SAMPLE_SIZE
+from stream_codec import CODECS, LOSSLESS, OPUS, OPUS_SUPPORTED, PCM
+
+
+def run(codec: str, duration: float, bitrate: int, accept=CODECS) -> dict:
+    bot = StandInBot(accept=accept, keep_audio=True)
+    controller = SpotifyController.spawn(BenchClient(), fake_args("bench", "password", bitrate))
+    controller.codec = codec
+    controller.bitrate = bitrate
+    controller.address, controller.port = bot.address, bot.port
+    own_start, _ = cpu_seconds()
+    controller.setup_output()
+    time.sleep(duration)
+    own_end, _ = cpu_seconds()
+    controller.stop()
+    bot.close()
+
+    sent = controller.metrics.bytes_sent
+    result = {
+        "codec": f"{codec} ({bot.codec})",
+        "negotiated": bot.codec,
+        "audio_seconds": sent / SAMPLE_SIZE,
+        "wire_rate": bot.wire_bytes / max(sent / SAMPLE_SIZE, 1e-9),
+        "ratio": sent / max(bot.wire_bytes, 1),
+        "cpu_percent": (own_end - own_start) / duration * 100,
+        "verified": "-",
+    }
+    if bot.codec in (PCM, LOSSLESS):
+        expected = tone() * (len(bot.audio) // len(tone()) + 1)
+        result["verified"] = "ok" if bot.audio and bot.audio == expected[:len(bot.audio)] else "MISMATCH"
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to stream with each codec")
+    parser.add_argument("--bitrate", type=int, default=96, help="Bitrate for Opus in kbps")
+    args = parser.parse_args()
+
+    codecs = [c for c in CODECS if c != OPUS or OPUS_SUPPORTED]
+    if not OPUS_SUPPORTED:
+        print("Opus is not available (needs opuslib and libopus), skipping it", file=sys.stderr)
+    print(f"{'codec':>20} {'audio s':>8} {'wire B/s':>10} {'ratio':>6} {'cpu %':>6} {'lossless':>9}")
+    failures = []
+    # Every codec to a bot that takes it, then the encoded ones to a bot that only takes plain PCM
+    runs = [(codec, CODECS) for codec in codecs] + [(codec, (PCM,)) for codec in codecs if codec != PCM]
+    for codec, accept in runs:
+        r = run(codec, args.duration, args.bitrate, accept)
+        print(f"{r['codec']:>20} {r['audio_seconds']:>8.1f} {r['wire_rate']:>10.0f} {r['ratio']:>6.1f} "
+              f"{r['cpu_percent']:>6.1f} {r['verified']:>9}")
+        expected = codec if codec in accept else PCM
+        if r["negotiated"] != expected:
+            failures.append(f"{codec} offered to a bot taking {', '.join(accept)} negotiated {r['negotiated']}, "
+                            f"not {expected}")
+        elif r["verified"] == "MISMATCH":
+            failures.append(f"{r['codec']}: the bot did not get exactly the audio librespot wrote")
+    for failure in failures:
+        print(f"[FAIL] {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Measures the DSP stage on 250 ms chunks: processing time per chunk against the 5% budget for gain alone, with
+the limiter, and with the limiter and mono downmix. Checks that the limiter keeps a tone pushed 12 dB over full
+scale below its threshold and that the output does not depend on the chunking. Then streams to a stand-in bot
+with every stage on, in stereo and mono, changing the gain halfway through. Exits with 1 if the limiter let a
+peak through or the chunking changed the output.
+
+    python -m benchmarks.bench_dsp --seconds 10
+"""
+import argparse
+import sys
+import time
+
+import numpy
+
+from benchmarks.bench_sessions import BenchClient, fake_args
+from benchmarks.stand_in_bot import StandInBot
+from dsp import DspStage
+from spotify_controller import SpotifyController, SAMPLE_SIZE
+from stream_codec import FRAME_SIZE, LOSSLESS, PCM, SAMPLE_RATE
+from stream_metrics import DSP_BUDGET
+
+# 250 ms of audio, about what librespot writes at once
+CHUNK = SAMPLE_SIZE // 4
+
+
+def music(seconds: float) -> bytes:
+    # Loud bass with a quieter melody on top, slightly different per channel
+    t = numpy.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    left = 0.7 * numpy.sin(2 * numpy.pi * 55 * t) + 0.25 * numpy.sin(2 * numpy.pi * 440 * t)
+    right = 0.7 * numpy.sin(2 * numpy.pi * 55 * t) + 0.25 * numpy.sin(2 * numpy.pi * 660 * t)
+    return numpy.rint(numpy.stack((left, right), axis=1) * 32767).astype("<i2").tobytes()
+
+
+def measure(name: str, dsp: DspStage, pcm: bytes) -> dict:
+    times = []
+    out = bytearray()
+    for i in range(0, len(pcm), CHUNK):
+        started = time.perf_counter()
+        out += dsp.process(memoryview(pcm)[i:i + CHUNK])
+        times.append(time.perf_counter() - started)
+    times.sort()
+    budget = CHUNK / SAMPLE_SIZE * DSP_BUDGET
+    return {
+        "name": name,
+        "mean_ms": sum(times) / len(times) * 1000,
+        "p99_ms": times[int(len(times) * 0.99)] * 1000,
+        "budget_percent": sum(times) / len(times) / budget * 100,
+        "peak": int(numpy.abs(numpy.frombuffer(bytes(out), dtype="<i2")).max()),
+        "bytes_ratio": len(out) / len(pcm),
+    }
+
+
+def stream(mono: bool, seconds: float) -> str:
+    bot = StandInBot()
+    controller = SpotifyController.spawn(BenchClient(), fake_args("bench", "password", 160))
+    controller.codec = PCM if not mono else LOSSLESS
+    controller.dsp = DspStage(gain_db=6.0, limiter=True, mono=mono)
+    controller.address, controller.port = bot.address, bot.port
+    controller.setup_output()
+    time.sleep(seconds / 2)
+    controller.dsp.gain_db = -6.0
+    time.sleep(seconds / 2)
+    controller.stop()
+    time.sleep(0.2)
+    bot.close()
+    metrics = controller.metrics
+    audio_seconds = bot.audio_bytes / (2 * bot.channels * bot.sample_rate)
+    return (f"{controller.codec} {'mono' if mono else 'stereo'}: bot got {audio_seconds:.2f} s in "
+            f"{bot.channels} channel(s), {bot.wire_bytes / max(audio_seconds, 1e-9):.0f} B/s on the wire, "
+            f"dsp mean {metrics.dsp_time.mean() * 1000:.2f} ms/chunk, {metrics.dsp_over_budget} over budget")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10.0, help="Seconds of audio to process")
+    parser.add_argument("--stream-seconds", type=float, default=3.0, help="Seconds to stream to the bot, 0 to skip")
+    args = parser.parse_args()
+
+    pcm = music(args.seconds)
+    results = [
+        measure("gain", DspStage(gain_db=-6.0, limiter=False), pcm),
+        measure("gain+limiter", DspStage(gain_db=12.0), pcm),
+        measure("limiter+mono", DspStage(gain_db=12.0, mono=True), pcm),
+    ]
+    print(f"{'stage':>14} {'ms/chunk':>9} {'p99 ms':>7} {'budget %':>9} {'peak':>6} {'bytes':>6}")
+    for r in results:
+        print(f"{r['name']:>14} {r['mean_ms']:>9.3f} {r['p99_ms']:>7.3f} {r['budget_percent']:>9.1f} "
+              f"{r['peak']:>6} {r['bytes_ratio']:>6.2f}")
+    failures = []
+    threshold = DspStage().threshold
+    held = results[1]["peak"] <= threshold + 1
+    print(f"limiter threshold {threshold:.0f}, {'held' if held else 'EXCEEDED'}")
+    if not held:
+        failures.append(f"the limiter let a peak of {results[1]['peak']} through")
+
+    dsp = DspStage(gain_db=12.0, mono=True)
+    whole = dsp.process(pcm)
+    dsp.reset()
+    step = FRAME_SIZE * 1009
+    pieces = b"".join(dsp.process(pcm[i:i + step]) for i in range(0, len(pcm), step))
+    print(f"chunked output {'matches' if whole == pieces else 'DIFFERS FROM'} one-shot output")
+    if whole != pieces:
+        failures.append("the output depends on the chunking")
+
+    if args.stream_seconds > 0:
+        for mono in (False, True):
+            print(stream(mono, args.stream_seconds))
+
+    for failure in failures:
+        print(f"[FAIL] {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+End-to-end streaming benchmark against local stand-ins for the bot API, the bot's audio receiver and librespot.
+
+Drives either a SpotifyController in this process (--mode controller) or cli.py as its own process (--mode cli)
+through the whole handshake, streams for a while and reports throughput, drift, time to first audio, CPU and
+RSS. Results can be saved and compared against an earlier run to catch regressions before a release:
+
+    python -m benchmarks.bench_e2e --duration 10 --json before.json
+    python -m benchmarks.bench_e2e --duration 10 --baseline before.json
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from api_client import ApiClient
+from benchmarks.bench_sessions import BenchClient, cpu_seconds, rss_kb
+from benchmarks.fake_api import FakeApi
+from benchmarks.stand_in_bot import StandInBot
+from handshake import Handshake
+from spotify_controller import SpotifyController, SAMPLE_SIZE, librespot_args
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_LIBRESPOT = os.path.join(ROOT, "benchmarks", "fake_librespot.py")
+# Metrics where lower is better, and how much worse than the baseline they may get
+REGRESSION_CHECKS = ("time_to_first_audio_ms", "max_drift_ms", "cpu_percent", "rss_mib")
+# Throughput may not deviate more than this from real time
+THROUGHPUT_TOLERANCE = 0.02
+# Throughput and drift are measured after this warm-up, so the pre-roll burst does not count
+WARM_UP = 1.0
+
+
+def fake_librespot_command(realtime: bool) -> str:
+    command = f'"{sys.executable}" "{FAKE_LIBRESPOT}"'
+    return command + " --realtime --track-seconds 5" if realtime else command
+
+
+def proc_stat(pid: int) -> Optional[dict]:
+    # CPU seconds and RSS of a process and its direct children, from /proc
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(c) for c in f.read().split()]
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    except (OSError, StopIteration):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    stat = {"cpu": (int(fields[11]) + int(fields[12])) / ticks, "rss_kb": rss}
+    for child in children:
+        child_stat = proc_stat(child)
+        if child_stat is not None:
+            stat["cpu"] += child_stat["cpu"]
+            stat["rss_kb"] += child_stat["rss_kb"]
+    return stat
+
+
+def measure(bot: StandInBot, started_at: float) -> Dict[str, float]:
+    # Receiver side numbers, the same for both modes
+    steady_since = (bot.first_byte_at or started_at) + WARM_UP
+    end_drift, max_drift = bot.drift()
+    return {
+        "time_to_first_audio_ms": ((bot.first_byte_at or float("nan")) - started_at) * 1000,
+        "throughput": bot.throughput(since=steady_since),
+        "end_drift_ms": end_drift * 1000,
+        "max_drift_ms": abs(max_drift) * 1000,
+        "connections": bot.connections,
+    }
+
+
+def run_controller(args, bot: StandInBot, api: FakeApi) -> Dict[str, float]:
+    os.environ["SPOOFY_LIBRESPOT"] = fake_librespot_command(args.realtime)
+    started_at = time.monotonic()
+    controller = SpotifyController.spawn(BenchClient(), librespot_args("bench", "password", args.bitrate),
+                                         name="bench")
+    controller.api = ApiClient(base_url=api.url)
+    controller.codec = args.codec
+    controller.jitter_ms = args.jitter_ms or None
+    own_start, _ = cpu_seconds()
+    try:
+        res, msg, _ = Handshake(controller).run("bench", "link-code")
+        if not res:
+            raise RuntimeError(f"Handshake failed: {msg}")
+        time.sleep(args.duration)
+        child = proc_stat(controller.process.pid) or {"cpu": 0.0, "rss_kb": 0}
+        own_end, _ = cpu_seconds()
+        result = measure(bot, started_at)
+        result["client_time_to_first_audio_ms"] = (controller.timings.time_to_first_audio or float("nan")) * 1000
+        result["cpu_percent"] = (own_end - own_start + child["cpu"]) / (time.monotonic() - started_at) * 100
+        result["rss_mib"] = (rss_kb() + child["rss_kb"]) / 1024
+        return result
+    finally:
+        controller.stop()
+
+
+def run_cli(args, bot: StandInBot, api: FakeApi) -> Dict[str, float]:
+    env = dict(os.environ, SPOOFY_API_URL=api.url, SPOOFY_LIBRESPOT=fake_librespot_command(args.realtime),
+               PYTHONUNBUFFERED="1")
+    command = [sys.executable, os.path.join(ROOT, "cli.py"), "link-code", "-u", "bench", "-p", "password",
+               "-b", str(args.bitrate), "--codec", args.codec, "--jitter-ms", str(args.jitter_ms),
+               "--metrics-port", "0"]
+    started_at = time.monotonic()
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(args.duration)
+        stat = proc_stat(process.pid)
+        if stat is None:
+            raise RuntimeError(f"cli.py exited early with code {process.poll()}")
+        result = measure(bot, started_at)
+        result["cpu_percent"] = stat["cpu"] / (time.monotonic() - started_at) * 100
+        result["rss_mib"] = stat["rss_kb"] / 1024
+        return result
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def compare(result: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    regressions = []
+    for key in REGRESSION_CHECKS:
+        if key in baseline and result[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key}: {result[key]:.1f} (baseline {baseline[key]:.1f})")
+    if abs(result["throughput"] / SAMPLE_SIZE - 1) > THROUGHPUT_TOLERANCE:
+        regressions.append(f"throughput: {result['throughput']:.0f} B/s (real time is {SAMPLE_SIZE} B/s)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("controller", "cli"), default="controller")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to stream")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="Seconds every API call takes")
+    parser.add_argument("--realtime", action="store_true", help="Fake librespot writes at playback speed")
+    parser.add_argument("--bitrate", type=int, default=160)
+    parser.add_argument("--codec", default="pcm")
+    parser.add_argument("--jitter-ms", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare against results written with --json earlier")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    bot = StandInBot()
+    api = FakeApi(bot.address, bot.port, latency=args.api_latency)
+    try:
+        result = run_controller(args, bot, api) if args.mode == "controller" else run_cli(args, bot, api)
+    finally:
+        api.close()
+        bot.close()
+    result["api_requests"] = sum(api.requests.values())
+
+    print(f"End-to-end benchmark ({args.mode}, {args.duration:.0f} s, codec {args.codec})")
+    for key, value in result.items():
+        print(f"{key:>30} {value:>12.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"[REGRESSION] {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Streams one session to several stand-in bots at once, one of them reading slower than its codec needs, and reports
+what every bot received, its drift from real time and whether the slow one was evicted without holding up the
+others. Then compares the CPU used by the client with running a separate session per bot, which also runs a
+librespot per bot. Exits with 1 unless every fast bot got exactly the fake librespot's tone at real time and the
+slow one was evicted.
+
+    python -m benchmarks.bench_fanout --bots 4 --duration 8
+"""
+import argparse
+import sys
+import time
+from typing import List
+
+from benchmarks.bench_sessions import BenchClient, cpu_seconds, fake_args
+from benchmarks.fake_librespot import tone
+from benchmarks.stand_in_bot import StandInBot
+from fanout import EVICTED
+from spotify_controller import SpotifyController, SAMPLE_SIZE
+from stream_codec import LOSSLESS, PCM
+
+# Read rate of the slow bot (bytes per second), well below what its codec needs for this tone
+SLOW_READ_RATE = {PCM: SAMPLE_SIZE / 2, LOSSLESS: SAMPLE_SIZE / 1000}
+# The slow bot only counts as behind once the kernel buffers are full, with the tone compressed that is over 10 s of
+# audio, so it gets this long after the measurement to be evicted (seconds)
+EVICT_TIMEOUT = 30.0
+# A fast bot must get at least this share of real time, and never stall for longer than this (seconds)
+MIN_REAL_TIME = 0.95
+MAX_BEHIND = 0.25
+
+
+class FanOutClient(BenchClient):
+    def __init__(self):
+        self.lost = []
+
+    def on_output_lost(self, address, port, reason):
+        self.lost.append((port, reason))
+
+
+def is_source(audio: bytes, source: bytes) -> bool:
+    # The audio has to be an unbroken run of the looped source, from wherever the bot joined
+    if not audio:
+        return False
+    offset = (source * 2).find(audio[:len(source) // 4])
+    if offset < 0:
+        return False
+    looped = source * ((offset + len(audio)) // len(source) + 1)
+    return looped[offset:offset + len(audio)] == audio
+
+
+def fanned_out(bots: int, codec: str, args, failures: List[str]) -> float:
+    fast = [StandInBot(keep_audio=True) for _ in range(bots)]
+    slow = StandInBot(read_rate=SLOW_READ_RATE[codec])
+    client = FanOutClient()
+    controller = SpotifyController.spawn(client, fake_args("bench", "password", 160))
+    controller.codec = codec
+    controller.fanout_max_lag = args.max_lag
+    own_start, _ = cpu_seconds()
+    started = time.monotonic()
+    for bot in fast + [slow]:
+        controller.add_output(bot.address, bot.port)
+    time.sleep(args.duration)
+    own_end, _ = cpu_seconds()
+    deadline = time.monotonic() + EVICT_TIMEOUT
+    while not any(port == slow.port for port, _ in client.lost) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    controller.stop()
+    time.sleep(0.2)
+    for bot in fast + [slow]:
+        bot.close()
+
+    print(f"{codec}, {bots} bots + 1 reading {SLOW_READ_RATE[codec] / 1000:.1f} kB/s, max lag {args.max_lag:.1f} s:")
+    source = tone()
+    for bot in fast + [slow]:
+        final, worst = bot.drift()
+        real_time = bot.throughput(started + 1) / SAMPLE_SIZE
+        lost = next((reason for port, reason in client.lost if port == bot.port), "-")
+        print(f"  {'slow' if bot is slow else 'fast'} :{bot.port} got {bot.audio_bytes / SAMPLE_SIZE:5.2f} s, "
+              f"{real_time * 100:5.1f}% of real time, "
+              f"drift {final * 1000:+.0f} ms (worst {worst * 1000:+.0f} ms), lost: {lost}")
+        if bot is slow:
+            if lost != EVICTED:
+                failures.append(f"{codec}: the slow bot was not evicted (lost: {lost})")
+            continue
+        if not is_source(bot.audio, source):
+            failures.append(f"{codec}: fast bot :{bot.port} did not get the same audio librespot wrote")
+        if real_time < MIN_REAL_TIME:
+            failures.append(f"{codec}: fast bot :{bot.port} got {real_time * 100:.1f}% of real time")
+        if bot.behind() > MAX_BEHIND:
+            failures.append(f"{codec}: fast bot :{bot.port} stalled for {bot.behind() * 1000:.0f} ms")
+        if lost != "-":
+            failures.append(f"{codec}: fast bot :{bot.port} was lost ({lost})")
+    return (own_end - own_start) / args.duration * 100
+
+
+def separate(bots: int, codec: str, args) -> float:
+    sinks = [StandInBot() for _ in range(bots)]
+    controllers = []
+    own_start, _ = cpu_seconds()
+    for bot in sinks:
+        controller = SpotifyController.spawn(BenchClient(), fake_args("bench", "password", 160))
+        controller.codec = codec
+        controller.address, controller.port = bot.address, bot.port
+        controller.setup_output()
+        controllers.append(controller)
+    time.sleep(args.duration)
+    own_end, _ = cpu_seconds()
+    for controller in controllers:
+        controller.stop()
+    time.sleep(0.2)
+    for bot in sinks:
+        bot.close()
+    return (own_end - own_start) / args.duration * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bots", type=int, default=4, help="Bots that keep up")
+    parser.add_argument("--duration", type=float, default=8.0, help="Seconds to stream")
+    parser.add_argument("--max-lag", type=float, default=2.0, help="Seconds a bot may fall behind")
+    args = parser.parse_args()
+
+    failures = []
+    for codec in (PCM, LOSSLESS):
+        fanout_cpu = fanned_out(args.bots, codec, args, failures)
+        separate_cpu = separate(args.bots + 1, codec, args)
+        print(f"  client CPU: {fanout_cpu:.1f}% fanned out with 1 librespot, {separate_cpu:.1f}% with a session "
+              f"and librespot per bot")
+    for failure in failures:
+        print(f"[FAIL] {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Compares the single-pass librespot line parser against running each log target's own regexes on every line.
+
+    python -m benchmarks.bench_log_parser --repeat 2000
+"""
+import argparse
+import os
+import re
+import time
+
+from librespot_events import parse_line
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "librespot_log_corpus.txt")
+
+# The per-target regexes the GUI used before there was a shared parser
+LOG_MSG_FORMAT = re.compile(r"\[.*?] (.*)")
+AUTH_ERROR_RE = re.compile(r"\[.*?] Could not connect to server: Authentication failed with error: (.*)")
+AUTH_SUCCESS_RE = re.compile(r"\[.*?] Authenticated as \"(.*)\" !")
+
+
+def legacy(line: str):
+    m = LOG_MSG_FORMAT.match(line)
+    message = m.group(1) if m else line
+    if m := AUTH_ERROR_RE.match(line):
+        return message, m.group(1)
+    elif m := AUTH_SUCCESS_RE.match(line):
+        return message, m.group(1)
+    return message, None
+
+
+def measure(func, lines, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for line in lines:
+            func(line)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000, help="Number of passes over the corpus")
+    parser.add_argument("--corpus", default=CORPUS, help="librespot stderr log to parse")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    total = len(lines) * args.repeat
+
+    for name, func in (("legacy (tags + auth only)", legacy), ("parse_line (all events)", parse_line)):
+        elapsed = measure(func, lines, args.repeat)
+        print(f"{name:>26}: {total / elapsed:>10.0f} lines/s, {elapsed / total * 1e6:.2f} us/line")
+
+
+if __name__ == "__main__":
+    main()
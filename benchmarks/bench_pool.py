@@ -0,0 +1,112 @@
+"""
+Measures logging in with and without the warm librespot pool.
+
+Every login runs benchmarks/fake_librespot.py, which takes --auth-delay seconds to log in like librespot talking
+to Spotify. A cold login starts a new process and waits until it logged in, a warm one takes it from the pool
+after the previous logout. Also measures switching to another bitrate that was pre-warmed. Then checks the pool:
+a warm login gets the same process back, one with another password does not, and idle processes that timed out
+or died are stopped. Exits with 1 if any check fails.
+
+    python -m benchmarks.bench_pool --logins 5 --auth-delay 1.5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+from benchmarks.bench_sessions import BenchClient
+from librespot_pool import LibrespotPool
+
+FAKE_LIBRESPOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_librespot.py")
+
+
+def login(pool: LibrespotPool, bitrate: int) -> float:
+    # Seconds until librespot is logged in, then logs out again
+    started = time.perf_counter()
+    controller = pool.acquire(BenchClient(), "bench", "password", bitrate)
+    if not controller.pooled.logged_in.result(timeout=30):
+        raise RuntimeError("Login failed")
+    duration = time.perf_counter() - started
+    controller.release()
+    return duration
+
+
+def check(auth_delay: float) -> List[str]:
+    failures = []
+    pool = LibrespotPool(idle_timeout=auth_delay + 1.0)
+    try:
+        controller = pool.acquire(BenchClient(), "bench", "password", 160)
+        controller.pooled.logged_in.result(timeout=30)
+        pid = controller.process.pid
+        controller.release()
+        controller = pool.acquire(BenchClient(), "bench", "password", 160)
+        if not controller.reused or controller.process.pid != pid:
+            failures.append("a warm login did not get the same librespot back")
+
+        # Another password must never get the logged in process
+        controller.release()
+        controller = pool.acquire(BenchClient(), "bench", "other password", 160)
+        if controller.reused or controller.process.pid == pid:
+            failures.append("a login with another password got the warm librespot")
+        controller.pooled.logged_in.result(timeout=30)
+        controller.release()
+
+        # The check runs every few seconds on its own, here it is called once the idle process timed out
+        idle = pool.idle[0]
+        time.sleep(pool.idle_timeout + 0.1)
+        pool.check()
+        if len(pool) or idle.controller.process.returncode is None:
+            failures.append("an idle librespot was not stopped after the idle timeout")
+
+        controller = pool.acquire(BenchClient(), "bench", "password", 320)
+        controller.pooled.logged_in.result(timeout=30)
+        controller.release()
+        idle = pool.idle[0]
+        idle.controller.process.kill()
+        time.sleep(0.5)
+        pool.check()
+        if len(pool):
+            failures.append("a librespot that exited while idle was kept in the pool")
+    finally:
+        pool.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=5, help="Logins per measurement")
+    parser.add_argument("--auth-delay", type=float, default=1.5, help="Seconds the fake librespot takes to log in")
+    args = parser.parse_args()
+    os.environ["SPOOFY_LIBRESPOT"] = f'"{sys.executable}" "{FAKE_LIBRESPOT}" --auth-delay {args.auth_delay}'
+
+    cold_pool = LibrespotPool(max_idle=0)
+    warm_pool = LibrespotPool()
+    try:
+        cold = [login(cold_pool, 160) for _ in range(args.logins)]
+        login(warm_pool, 160)
+        warm = [login(warm_pool, 160) for _ in range(args.logins)]
+        # As if the user kept streaming at 160 kbps for a while after the other bitrate was pre-warmed
+        warm_pool.prewarm("bench", "password", 320)
+        time.sleep(args.auth_delay + 0.5)
+        switch = login(warm_pool, 320)
+    finally:
+        cold_pool.close()
+        warm_pool.close()
+
+    print(f"Cold login:      {statistics.median(cold) * 1000:>8.1f} ms (median of {len(cold)})")
+    print(f"Warm login:      {statistics.median(warm) * 1000:>8.1f} ms (median of {len(warm)}), "
+          f"{warm_pool.hits} hits, {warm_pool.misses} misses")
+    print(f"Bitrate switch:  {switch * 1000:>8.1f} ms (pre-warmed)")
+
+    failures = check(args.auth_delay)
+    for failure in failures:
+        print(f"[FAIL] {failure}")
+    if failures:
+        sys.exit(1)
+    print("Reuse, password mismatch, idle timeout and health checks passed")
+
+
+if __name__ == "__main__":
+    main()
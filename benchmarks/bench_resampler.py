@@ -0,0 +1,137 @@
+"""
+Measures the 44.1 kHz -> 48 kHz resampler: how many times faster than real time every quality runs on 250 ms
+chunks, how clean a 1 kHz and a 15 kHz tone come out (SNR against the exact tone at 48 kHz), and whether
+resampling chunk by chunk gives the same output as resampling in one go. audioop is measured too if it is there.
+Then streams to a stand-in bot at 48 kHz, lossless, to check the whole path. Exits with 1 if the chunking changed
+the output of any quality.
+
+    python -m benchmarks.bench_resampler --seconds 10
+"""
+import argparse
+import sys
+import time
+import warnings
+
+import numpy
+
+from benchmarks.bench_sessions import BenchClient, fake_args
+from benchmarks.stand_in_bot import StandInBot
+from resampler import Resampler, QUALITIES
+from spotify_controller import SpotifyController, SAMPLE_SIZE
+from stream_codec import DISCORD_SAMPLE_RATE, FRAME_SIZE, LOSSLESS, SAMPLE_RATE
+
+# 250 ms of audio, about what librespot writes at once
+CHUNK = SAMPLE_SIZE // 4
+
+
+def sine(frequency: float, rate: int, seconds: float, amplitude: float = 0.5) -> numpy.ndarray:
+    t = numpy.arange(int(rate * seconds)) / rate
+    return amplitude * 32767 * numpy.sin(2 * numpy.pi * frequency * t)
+
+
+def stereo(samples: numpy.ndarray) -> bytes:
+    return numpy.repeat(numpy.rint(samples), 2).astype("<i2").tobytes()
+
+
+def snr(output: bytes, frequency: float, delay: float) -> float:
+    # Compares the left channel against the ideal tone, shifted by the filter's delay. The edges are left out.
+    left = numpy.frombuffer(output, dtype="<i2")[::2].astype(numpy.float64)
+    t = (numpy.arange(len(left)) / DISCORD_SAMPLE_RATE) - delay
+    ideal = 0.5 * 32767 * numpy.sin(2 * numpy.pi * frequency * t)
+    edge = DISCORD_SAMPLE_RATE // 10
+    signal, noise = ideal[edge:-edge], left[edge:-edge] - ideal[edge:-edge]
+    return 10 * numpy.log10(numpy.sum(signal ** 2) / max(numpy.sum(noise ** 2), 1e-9))
+
+
+def chunked(process, pcm: bytes) -> bytes:
+    return b"".join(process(pcm[i:i + CHUNK]) for i in range(0, len(pcm), CHUNK))
+
+
+def measure(name: str, process, reset, delay: float, seconds: float) -> dict:
+    pcm = stereo(sine(1000, SAMPLE_RATE, seconds))
+    start = time.perf_counter()
+    output = chunked(process, pcm)
+    elapsed = time.perf_counter() - start
+    reset()
+    high = chunked(process, stereo(sine(15000, SAMPLE_RATE, 2)))
+    reset()
+    return {
+        "name": name,
+        "realtime": seconds / elapsed,
+        "chunk_ms": elapsed / (len(pcm) / CHUNK) * 1000,
+        "snr_1k": snr(output, 1000, delay),
+        "snr_15k": snr(high, 15000, delay),
+    }
+
+
+def stream(seconds: float) -> str:
+    bot = StandInBot(keep_audio=True)
+    controller = SpotifyController.spawn(BenchClient(), fake_args("bench", "password", 160))
+    controller.codec = LOSSLESS
+    controller.resample_quality = "medium"
+    controller.address, controller.port = bot.address, bot.port
+    controller.setup_output()
+    time.sleep(seconds)
+    controller.stop()
+    time.sleep(0.2)
+    bot.close()
+    received = len(bot.audio) / FRAME_SIZE / DISCORD_SAMPLE_RATE
+    sent = controller.metrics.bytes_sent / SAMPLE_SIZE
+    return f"bot got {received:.2f} s at {bot.sample_rate} Hz for {sent:.2f} s sent"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10.0, help="Seconds of audio to resample")
+    parser.add_argument("--stream-seconds", type=float, default=3.0, help="Seconds to stream to the bot, 0 to skip")
+    args = parser.parse_args()
+
+    results = []
+    failures = []
+    for quality in QUALITIES:
+        resampler = Resampler(SAMPLE_RATE, DISCORD_SAMPLE_RATE, quality)
+        # The filter is symmetric, its delay is half its length at the upsampled rate
+        delay = (resampler.up * resampler.taps - 1) / 2 / (resampler.up * SAMPLE_RATE)
+        results.append(measure(quality, resampler.process, resampler.reset, delay, args.seconds))
+
+        pcm = stereo(sine(440, SAMPLE_RATE, 3)) + b"\x01\x00\x02\x00"
+        whole = resampler.process(pcm[:len(pcm) - len(pcm) % FRAME_SIZE])
+        resampler.reset()
+        pieces = b"".join(resampler.process(pcm[i:i + 4 * 997]) for i in range(0, len(pcm), 4 * 997))
+        resampler.reset()
+        print(f"{quality}: chunked output {'matches' if whole == pieces else 'DIFFERS FROM'} one-shot output")
+        if whole != pieces:
+            failures.append(f"{quality}: the output depends on the chunking")
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            import audioop
+        state = [None]
+
+        def process(pcm):
+            out, state[0] = audioop.ratecv(pcm, 2, 2, SAMPLE_RATE, DISCORD_SAMPLE_RATE, state[0])
+            return out
+
+        def reset():
+            state[0] = None
+
+        results.append(measure("audioop", process, reset, 0.0, args.seconds))
+    except ImportError:
+        print("audioop is not available")
+
+    print(f"{'resampler':>10} {'x realtime':>11} {'ms/chunk':>9} {'SNR 1k dB':>10} {'SNR 15k dB':>11}")
+    for r in results:
+        print(f"{r['name']:>10} {r['realtime']:>11.0f} {r['chunk_ms']:>9.2f} {r['snr_1k']:>10.1f} "
+              f"{r['snr_15k']:>11.1f}")
+    if args.stream_seconds > 0:
+        print(stream(args.stream_seconds))
+
+    for failure in failures:
+        print(f"[FAIL] {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
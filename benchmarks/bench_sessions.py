@@ -0,0 +1,133 @@
+"""
+Measures how CPU and memory scale with the number of concurrent sessions in one SessionManager.
+
+Every session runs benchmarks/fake_librespot.py and streams to a local TCP sink.
+
+    python -m benchmarks.bench_sessions --sessions 1,5,10,25,50 --duration 5
+"""
+import argparse
+import os
+import resource
+import selectors
+import socket
+import sys
+import time
+from threading import Thread
+
+from session_manager import SessionManager, SessionLimits
+
+FAKE_LIBRESPOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_librespot.py")
+
+
+class Sink:
+    # TCP server that accepts any number of connections and throws away what it receives
+    def __init__(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(128)
+        self.server.setblocking(False)
+        self.address, self.port = self.server.getsockname()
+        self.received = 0
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.server, selectors.EVENT_READ)
+        buffer = bytearray(65536)
+        while self.running:
+            for key, _ in selector.select(timeout=0.1):
+                if key.fileobj is self.server:
+                    conn, _ = self.server.accept()
+                    conn.setblocking(False)
+                    selector.register(conn, selectors.EVENT_READ)
+                    continue
+                try:
+                    n = key.fileobj.recv_into(buffer)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    n = 0
+                if n == 0:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                self.received += n
+        selector.close()
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.server.close()
+
+
+class BenchClient:
+    def on_bot_disconnect(self):
+        print("Unexpected bot disconnect", file=sys.stderr)
+
+    def on_bot_reconnecting(self, attempt):
+        print(f"Unexpected bot reconnect (attempt {attempt})", file=sys.stderr)
+
+    def on_bot_reconnected(self, recovery):
+        pass
+
+
+def rss_kb() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+
+def fake_args(username: str, password: str, bitrate: int):
+    return [sys.executable, FAKE_LIBRESPOT, "--username", username, "--bitrate", str(bitrate)]
+
+
+def run(count: int, duration: float, sink: Sink) -> dict:
+    manager = SessionManager(max_sessions=count, limits=SessionLimits(), args_factory=fake_args)
+    for i in range(count):
+        controller = manager.create(BenchClient(), f"user{i}", "password", f"code{i}")
+        controller.address, controller.port = sink.address, sink.port
+        controller.setup_output()
+
+    received = sink.received
+    own_start, _ = cpu_seconds()
+    started = time.monotonic()
+    time.sleep(duration)
+    elapsed = time.monotonic() - started
+    own_end, _ = cpu_seconds()
+    result = {
+        "sessions": count,
+        "cpu_percent": (own_end - own_start) / elapsed * 100,
+        "rss_kb": rss_kb(),
+        "throughput": (sink.received - received) / elapsed / count,
+    }
+    manager.stop_all()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", default="1,5,10,25,50", help="Comma separated session counts")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to measure for each count")
+    args = parser.parse_args()
+
+    sink = Sink()
+    print(f"{'sessions':>8} {'cpu %':>8} {'rss MiB':>8} {'B/s per session':>16}")
+    try:
+        for count in (int(c) for c in args.sessions.split(",")):
+            r = run(count, args.duration, sink)
+            print(f"{r['sessions']:>8} {r['cpu_percent']:>8.1f} {r['rss_kb'] / 1024:>8.1f} {r['throughput']:>16.0f}")
+    finally:
+        sink.close()
+
+
+if __name__ == "__main__":
+    main()
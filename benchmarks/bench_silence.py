@@ -0,0 +1,85 @@
+"""
+Streams audio with silent gaps (like paused playback or the gap between tracks) to a stand-in bot, with and
+without silence packets, and reports the bandwidth and CPU used. The bot fills the silence back in, the lossless
+streams are checked against what fake librespot generated, so the timing must come out exactly the same. Exits
+with 1 if any of them does not.
+
+    python -m benchmarks.bench_silence --duration 8 --track-seconds 2 --gap-seconds 2
+"""
+import argparse
+import sys
+import time
+
+from benchmarks.bench_sessions import BenchClient, cpu_seconds, fake_args
+from benchmarks.fake_librespot import tone
+from benchmarks.stand_in_bot import StandInBot
+from silence import NUMPY_SUPPORTED, SILENCE_THRESHOLD_DB
+from spotify_controller import SpotifyController, SAMPLE_SIZE
+from stream_codec import LOSSLESS, OPUS, OPUS_SUPPORTED, PCM
+
+
+def expected_audio(size: int, track_seconds: float, gap_seconds: float) -> bytes:
+    # What fake librespot writes: a second of tone over and over, with silence instead during the gaps
+    track, gap = int(track_seconds) * SAMPLE_SIZE, int(gap_seconds) * SAMPLE_SIZE
+    second = tone()
+    cycle = second * int(track_seconds) + bytes(gap)
+    return (cycle * (size // (track + gap) + 1))[:size]
+
+
+def run(codec: str, dtx: bool, args) -> dict:
+    bot = StandInBot(keep_audio=True)
+    extra = ["--track-seconds", str(args.track_seconds), "--gap-seconds", str(args.gap_seconds)]
+    controller = SpotifyController.spawn(BenchClient(), fake_args("bench", "password", 160) + extra)
+    controller.codec = codec
+    controller.silence_threshold_db = SILENCE_THRESHOLD_DB if dtx else None
+    controller.address, controller.port = bot.address, bot.port
+    own_start, _ = cpu_seconds()
+    controller.setup_output()
+    time.sleep(args.duration)
+    own_end, _ = cpu_seconds()
+    controller.stop()
+    # Let the bot read what is still in flight
+    time.sleep(0.2)
+    bot.close()
+
+    sent = controller.metrics.bytes_sent
+    audio_seconds = sent / SAMPLE_SIZE
+    result = {
+        "name": f"{codec}{' + dtx' if dtx else ''}",
+        "audio_seconds": audio_seconds,
+        "wire_rate": bot.wire_bytes / max(audio_seconds, 1e-9),
+        "cpu_percent": (own_end - own_start) / args.duration * 100,
+        "silence_packets": bot.silence_packets,
+        "verified": "-",
+    }
+    if codec in (PCM, LOSSLESS):
+        ok = bot.audio == expected_audio(len(bot.audio), args.track_seconds, args.gap_seconds)
+        result["verified"] = "ok" if ok and len(bot.audio) == sent else "MISMATCH"
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=8.0, help="Seconds to stream in every run")
+    parser.add_argument("--track-seconds", type=int, default=2)
+    parser.add_argument("--gap-seconds", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"RMS with {'numpy' if NUMPY_SUPPORTED else 'the array module'}")
+    print(f"{'stream':>16} {'audio s':>8} {'wire B/s':>10} {'cpu %':>6} {'silence':>8} {'exact':>6}")
+    failures = []
+    for codec in (PCM, LOSSLESS, OPUS) if OPUS_SUPPORTED else (PCM, LOSSLESS):
+        for dtx in (False, True):
+            r = run(codec, dtx, args)
+            print(f"{r['name']:>16} {r['audio_seconds']:>8.1f} {r['wire_rate']:>10.0f} {r['cpu_percent']:>6.1f} "
+                  f"{r['silence_packets']:>8} {r['verified']:>6}")
+            if r["verified"] == "MISMATCH":
+                failures.append(f"{r['name']}: the bot did not get exactly the audio librespot wrote")
+    for failure in failures:
+        print(f"[FAIL] {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
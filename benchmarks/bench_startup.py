@@ -0,0 +1,77 @@
+"""
+Measures how long the client's entry points take to start.
+
+For every module, `python -X importtime -c "import <module>"` is run in a fresh interpreter and the time spent
+importing it (and everything it pulls in) is reported together with its most expensive imports. The wall clock
+time of `cli.py --help` is measured against an empty interpreter start.
+
+    python -m benchmarks.bench_startup --runs 10
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Tuple, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ("main", "cli", "gui_controller", "spotify_controller", "api_client")
+IMPORT_TIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(module: str) -> Optional[List[Tuple[str, int, int, int]]]:
+    # (name, depth, self us, cumulative us) for the module and everything imported because of it, None if the
+    # module can not be imported here (e.g. wx is missing)
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                         capture_output=True, text=True)
+    if res.returncode != 0:
+        return None
+    entries = []
+    for line in res.stderr.splitlines():
+        if m := IMPORT_TIME_RE.match(line):
+            self_us, cumulative_us, indent, name = m.groups()
+            entries.append((name, (len(indent) - 1) // 2, int(self_us), int(cumulative_us)))
+    # Imports are listed children first, the module's own imports are the ones right before it at depth 0
+    end = max(i for i, entry in enumerate(entries) if entry[0] == module and entry[1] == 0)
+    start = end
+    while start > 0 and entries[start - 1][1] > 0:
+        start -= 1
+    return entries[start:end + 1]
+
+
+def wall_clock(args: List[str], runs: int) -> float:
+    durations = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="Runs for the wall clock measurements")
+    parser.add_argument("--top", type=int, default=8, help="Most expensive imports to show per module")
+    args = parser.parse_args()
+
+    for module in MODULES:
+        entries = import_times(module)
+        if entries is None:
+            print(f"{module}: can not be imported here, skipped")
+            continue
+        total = entries[-1][3]
+        print(f"{module}: {total / 1000:.1f} ms, {len(entries)} modules")
+        heaviest = sorted(entries[:-1], key=lambda e: e[3], reverse=True)[:args.top]
+        for name, depth, self_us, cumulative_us in heaviest:
+            print(f"    {cumulative_us / 1000:>7.1f} ms  {name}")
+
+    empty = wall_clock(["-c", "pass"], args.runs)
+    cli_help = wall_clock([os.path.join(ROOT, "cli.py"), "--help"], args.runs)
+    print(f"Interpreter start: {empty * 1000:.0f} ms, cli.py --help: {cli_help * 1000:.0f} ms "
+          f"({(cli_help - empty) * 1000:.0f} ms for the client)")
+
+
+if __name__ == "__main__":
+    main()
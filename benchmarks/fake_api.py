@@ -0,0 +1,96 @@
+"""
+Local stand-in for the Spoofy bot API, serving check/, connect/ and start/ like the production service.
+
+connect/ hands out the address of a stand-in bot receiver. Every response can be delayed to simulate the round
+trip to the real service. Run it on its own to point a manually started client at it:
+
+    python -m benchmarks.fake_api --port 8080 --bot-port 9000
+"""
+import argparse
+import json
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from typing import Dict, Optional
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeApi:
+    def __init__(self, bot_address: str, bot_port: int, latency: float = 0.0, port: int = 0,
+                 link_codes: Optional[set] = None):
+        self.bot_address: str = bot_address
+        self.bot_port: int = bot_port
+        self.latency: float = latency
+        # Link codes that are accepted, None accepts every link code
+        self.link_codes: Optional[set] = link_codes
+        self.requests: Dict[str, int] = {}
+        self.lock: Lock = Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+        self.server.daemon_threads = True
+        self.port: int = self.server.server_address[1]
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/"
+
+    def handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                status, body = api.respond(url.path.strip("/"), params)
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def respond(self, endpoint: str, params: Dict[str, str]):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if endpoint == "check":
+            return 200, {"linked": True}
+        if endpoint in ("connect", "start"):
+            if self.link_codes is not None and params.get("link_code") not in self.link_codes:
+                return 200, {"error": True, "msg": "Unknown link code.", "short_msg": "Invalid link code."}
+            if endpoint == "connect":
+                return 200, {"address": self.bot_address, "port": self.bot_port}
+            return 200, {}
+        return 404, {"error": True, "msg": "Not found", "short_msg": "Not found"}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--bot-address", default="127.0.0.1")
+    parser.add_argument("--bot-port", type=int, required=True)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to delay every response")
+    args = parser.parse_args()
+
+    api = FakeApi(args.bot_address, args.bot_port, latency=args.latency, port=args.port)
+    print(f"Fake API running on {api.url}")
+    try:
+        api.thread.join()
+    except KeyboardInterrupt:
+        api.close()
+
+
+if __name__ == "__main__":
+    main()
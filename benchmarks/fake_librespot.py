@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Stand-in for the librespot binary, for benchmarks.
+
+Accepts the same command line as librespot (unknown options are ignored), logs on stderr like librespot does and
+writes 16 bit stereo PCM to stdout, like librespot's pipe backend. By default the audio is written as fast as it
+is read, with --realtime it is written at playback speed the way librespot's player does. With --system-cache it
+stores credentials after logging in with a password and logs in with them when no password is given.
+"""
+import argparse
+import math
+import os
+import struct
+import sys
+import time
+from datetime import datetime, timezone
+
+SAMPLE_RATE = 44100
+FRAME_SIZE = 4
+# Librespot's player writes the decoded audio in packets of this many frames
+PACKET_FRAMES = 1024
+
+TRACKS = (
+    ("Never Gonna Give You Up", "spotify:track:4uLU6hMCjMI75M1A2tKUQC"),
+    ("Take On Me", "spotify:track:2WfaOiMkCvy7F5fcp2zZ8L"),
+)
+
+
+def tone(frequency: float = 440.0, seconds: float = 1.0, volume: float = 0.3) -> bytes:
+    frames = int(SAMPLE_RATE * seconds)
+    samples = (int(volume * 32767 * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE)) for i in range(frames))
+    return b"".join(struct.pack("<hh", s, s) for s in samples)
+
+
+def log(level: str, module: str, message: str):
+    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    sys.stderr.write(f"[{timestamp} {level:<5} {module}] {message}\n")
+    sys.stderr.flush()
+
+
+def load_track(number: int):
+    name, uri = TRACKS[number % len(TRACKS)]
+    log("DEBUG", "librespot_connect::spirc", 'kMessageTypeLoad "Web Player (Chrome)" 6f0a0c6e')
+    log("INFO", "librespot_playback::player", f"Loading <{name}> with Spotify URI <{uri}>")
+    log("INFO", "librespot_playback::player", f"<{name}> (213573 ms) loaded")
+    log("DEBUG", "librespot_connect::spirc", 'kMessageTypePlay "Web Player (Chrome)" 6f0a0c6e')
+
+
+def main():
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--username", default="fake_user")
+    parser.add_argument("--password")
+    parser.add_argument("--system-cache", help="Credentials are stored here after logging in with a password")
+    parser.add_argument("--cached-auth-delay", type=float, help="Seconds the login with cached credentials takes")
+    parser.add_argument("--frequency", type=float, default=440.0)
+    parser.add_argument("--realtime", action="store_true", help="Write the audio at playback speed")
+    parser.add_argument("--auth-delay", type=float, default=0.0, help="Seconds the login takes")
+    parser.add_argument("--bad-credentials", action="store_true", help="Fail the login like librespot does")
+    parser.add_argument("--track-seconds", type=float, default=0.0, help="Log a track change this often")
+    parser.add_argument("--gap-seconds", type=float, default=0.0, help="Seconds of silence after every track")
+    args, _ = parser.parse_known_args()
+
+    log("INFO", "librespot", "librespot 0.1.6 (fake)")
+    log("INFO", "librespot_core::session", 'Connecting to AP "gew1-accesspoint-a-8k1s.ap.spotify.com:4070"')
+    credentials = os.path.join(args.system_cache, "credentials.json") if args.system_cache else None
+    cached = args.password is None and credentials is not None and os.path.exists(credentials)
+    if cached:
+        time.sleep(args.cached_auth_delay if args.cached_auth_delay is not None else args.auth_delay)
+    else:
+        time.sleep(args.auth_delay)
+    if args.bad_credentials or (args.password is None and credentials is not None and not cached):
+        log("ERROR", "librespot", "Could not connect to server: Authentication failed with error: BadCredentials")
+        sys.exit(1)
+    log("INFO", "librespot_core::session", f'Authenticated as "{args.username}" !')
+    if credentials is not None and not cached:
+        with open(credentials, "w") as f:
+            f.write('{"username": "%s", "auth_type": 1, "auth_data": "ZmFrZQ=="}' % args.username)
+    log("INFO", "librespot_core::session", 'Country: "NL"')
+    log("INFO", "librespot_playback::audio_backend::pipe", "Using pipe sink")
+
+    data = tone(args.frequency)
+    packet = PACKET_FRAMES * FRAME_SIZE
+    out = sys.stdout.buffer
+    started = time.monotonic()
+    written = 0
+    track = 0
+    track_size = int(args.track_seconds * SAMPLE_RATE) * FRAME_SIZE
+    gap_size = int(args.gap_seconds * SAMPLE_RATE) * FRAME_SIZE
+    try:
+        while True:
+            if track_size and written >= (track + 1) * (track_size + gap_size):
+                track += 1
+                load_track(track)
+            if args.realtime:
+                delay = started + written / (SAMPLE_RATE * FRAME_SIZE) - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                offset = written % len(data)
+                chunk = data[offset:offset + packet]
+            else:
+                chunk = data
+            if gap_size and written % (track_size + gap_size) >= track_size:
+                # Between tracks, librespot's pipe backend writes silence
+                chunk = bytes(len(chunk))
+            out.write(chunk)
+            out.flush()
+            written += len(chunk)
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+
+
+if __name__ == "__main__":
+    main()
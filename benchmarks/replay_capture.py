@@ -0,0 +1,142 @@
+"""
+Replays a capture made with --capture: sends the captured audio to a stand-in bot (or any receiver) with the
+timing it was originally sent with, at real time or faster, and lists where the original stream stalled or
+reconnected. The audio is offered in the sample rate and channels it was captured in. Optionally writes the
+captured audio to a WAV file as well.
+
+    python -m benchmarks.replay_capture ~/captures/username-1 --speed 4 --wav replay.wav
+"""
+import argparse
+import socket
+import time
+import wave
+from datetime import datetime
+from typing import List, Optional
+
+from benchmarks.stand_in_bot import StandInBot
+from capture import CaptureChunk, RECONNECTED, STREAM_START, read_capture
+from stream_codec import CHANNELS, CHANNELS_ACCEPTED, CODEC_IDS, PCM, RATE_ACCEPTED, SAMPLE_RATE, STREAM_HEADER, \
+    STREAM_MAGIC, STREAM_VERSION_FLAGS
+
+# The stream is stalled while it is this far behind the furthest ahead of real time it has been
+STALL_MS = 50
+
+
+def stalls(chunks: List[CaptureChunk], threshold: float = STALL_MS / 1000) -> List[str]:
+    # Where the stream started, reconnected or fell behind real time, from the timestamp index
+    events = []
+    ahead, stall = None, None
+    for chunk in chunks:
+        at = datetime.fromtimestamp(chunk.time).strftime("%H:%M:%S.%f")[:-3]
+        if chunk.flags & (STREAM_START | RECONNECTED):
+            events.append(f"{at} {'stream started' if chunk.flags & STREAM_START else 'reconnected'}")
+            ahead = None
+        # Seconds of audio sent ahead of the wall clock, up to a constant. A chunk is sent once all of it is.
+        lead = (chunk.position + len(chunk.data)) / chunk.byte_rate - chunk.time
+        ahead = lead if ahead is None else max(ahead, lead)
+        behind = ahead - lead
+        if stall is None and behind > threshold:
+            stall = [at, chunk.position / chunk.byte_rate, behind]
+        elif stall is not None:
+            stall[2] = max(stall[2], behind)
+            if behind < threshold / 2:
+                events.append(f"{stall[0]} fell {stall[2] * 1000:.0f} ms behind real time at {stall[1]:.2f} s")
+                stall = None
+    if stall is not None:
+        events.append(f"{stall[0]} fell {stall[2] * 1000:.0f} ms behind real time at {stall[1]:.2f} s, until the end")
+    return events
+
+
+def connect(address: str, port: int, sample_rate: int, channels: int) -> socket.socket:
+    # Plain PCM like librespot's needs no header, anything else has to be accepted by the receiver
+    sock = socket.create_connection((address, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if (sample_rate, channels) == (SAMPLE_RATE, CHANNELS):
+        return sock
+    sock.sendall(STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION_FLAGS, CODEC_IDS[PCM], sample_rate, channels, 0))
+    answer = sock.recv(1)
+    needed = (RATE_ACCEPTED if sample_rate != SAMPLE_RATE else 0) | (CHANNELS_ACCEPTED if channels != CHANNELS else 0)
+    if not answer or answer[0] & needed != needed:
+        sock.close()
+        raise ValueError(f"The receiver does not accept {sample_rate} Hz with {channels} channel(s).")
+    return sock
+
+
+def replay(chunks: List[CaptureChunk], address: str, port: int, speed: float = 1.0) -> float:
+    # Sends the chunks as PCM with their original spacing divided by `speed` (0 for as fast as possible), on a new
+    # connection whenever the format changes. Returns how long it took.
+    sock, stream = None, None
+    started = time.monotonic()
+    try:
+        for chunk in chunks:
+            if (chunk.sample_rate, chunk.channels) != stream:
+                if sock is not None:
+                    sock.close()
+                stream = chunk.sample_rate, chunk.channels
+                sock = connect(address, port, *stream)
+            if speed > 0:
+                delay = started + (chunk.time - chunks[0].time) / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            sock.sendall(chunk.data)
+    finally:
+        if sock is not None:
+            sock.close()
+    return time.monotonic() - started
+
+
+def write_wav(chunks: List[CaptureChunk], path: str) -> int:
+    # A WAV file has a single format, writes the chunks in the format of the last one and returns how many
+    last = chunks[-1]
+    chunks = [c for c in chunks if (c.sample_rate, c.channels) == (last.sample_rate, last.channels)]
+    with wave.open(path, "wb") as f:
+        f.setnchannels(last.channels)
+        f.setsampwidth(2)
+        f.setframerate(last.sample_rate)
+        for chunk in chunks:
+            f.writeframes(chunk.data)
+    return len(chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Capture directory of a stream")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, 1 for real time, 0 for unpaced")
+    parser.add_argument("--address", default=None, help="Send to this receiver instead of a stand-in bot")
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--wav", default=None, help="Also write the captured audio to this WAV file")
+    args = parser.parse_args()
+
+    chunks = list(read_capture(args.directory))
+    if not chunks:
+        print(f"No capture in {args.directory}")
+        return
+    audio = sum(len(c.data) for c in chunks)
+    seconds = sum(len(c.data) / c.byte_rate for c in chunks)
+    span = chunks[-1].time - chunks[0].time + len(chunks[-1].data) / chunks[-1].byte_rate
+    print(f"{len(chunks)} chunks, {seconds:.2f} s of audio sent over {span:.2f} s, "
+          f"from {datetime.fromtimestamp(chunks[0].time)}, last {chunks[-1].sample_rate} Hz with "
+          f"{chunks[-1].channels} channel(s)")
+    for event in stalls(chunks):
+        print(f"  {event}")
+
+    if args.wav is not None:
+        written = write_wav(chunks, args.wav)
+        print(f"Wrote {written} of {len(chunks)} chunks to {args.wav}")
+
+    bot: Optional[StandInBot] = None
+    address, port = args.address, args.port
+    if address is None:
+        bot = StandInBot()
+        address, port = bot.address, bot.port
+    elapsed = replay(chunks, address, port, args.speed)
+    print(f"Replayed to {address}:{port} in {elapsed:.2f} s ({span / max(elapsed, 1e-9):.1f}x)")
+    if bot is not None:
+        time.sleep(0.2)
+        bot.close()
+        print(f"Stand-in bot got {bot.audio_bytes} of {audio} bytes of audio"
+              f"{'' if bot.audio_bytes == audio else ', some are MISSING'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Local stand-in for the bot's audio receiver.
+
+Accepts stream connections one after the other (so reconnects work), negotiates the codec like the real bot and
+decodes what it receives. With `read_rate` it reads no faster than that (bytes per second), like a bot on a slow
+link. It keeps the timing of everything it received, for throughput and drift measurements.
+"""
+import socket
+import time
+from threading import Thread, Lock
+from typing import Optional, List, Tuple
+
+from spotify_controller import SAMPLE_SIZE
+from stream_codec import CHANNELS, CHANNELS_ACCEPTED, CODECS, CODEC_IDS, CODEC_ID_MASK, DTX_ACCEPTED, LOSSLESS, \
+    OPUS, PCM, PACKET_HEADER, RATE_ACCEPTED, SAMPLE_RATE, STREAM_HEADER, STREAM_MAGIC, STREAM_VERSION_FLAGS, decode_lossless, \
+    parse_packet_header
+
+
+class StandInBot:
+    def __init__(self, accept=CODECS, keep_audio: bool = False, dtx: bool = True, accept_rates=(SAMPLE_RATE, 48000),
+                 accept_mono: bool = True, read_rate: Optional[float] = None):
+        self.accept = accept
+        self.dtx: bool = dtx
+        self.accept_rates = accept_rates
+        self.accept_mono: bool = accept_mono
+        self.sample_rate: int = SAMPLE_RATE
+        self.channels: int = CHANNELS
+        self.silence_packets: int = 0
+        self.keep_audio: bool = keep_audio
+        self.read_rate: Optional[float] = read_rate
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if read_rate is not None:
+            # A small receive buffer, so the sender notices the slow reads soon
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(4)
+        self.address, self.port = self.server.getsockname()
+        self.codec: Optional[str] = None
+        self.connections: int = 0
+        self.wire_bytes: int = 0
+        self.audio_bytes: int = 0
+        self.audio = bytearray()
+        self.first_byte_at: Optional[float] = None
+        self.connected_at: float = 0.0
+        # (time.monotonic, audio bytes received so far), one sample per receive
+        self.samples: List[Tuple[float, int]] = []
+        self.lock: Lock = Lock()
+        self.running: bool = True
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        self.server.settimeout(0.1)
+        while self.running:
+            try:
+                conn, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.connections += 1
+            self.connected_at = time.monotonic()
+            conn.settimeout(None)
+            try:
+                self.receive(conn)
+            except (EOFError, OSError):
+                pass
+            finally:
+                conn.close()
+
+    def read_exactly(self, conn: socket.socket, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        self.wire_bytes += len(data)
+        self.throttle()
+        return data
+
+    def throttle(self):
+        if self.read_rate is not None:
+            time.sleep(max(self.connected_at + self.wire_bytes / self.read_rate - time.monotonic(), 0))
+
+    def on_audio(self, data: bytes):
+        now = time.monotonic()
+        with self.lock:
+            if self.first_byte_at is None:
+                self.first_byte_at = now
+            self.audio_bytes += len(data)
+            self.samples.append((now, self.audio_bytes))
+            if self.keep_audio:
+                self.audio += data
+
+    def receive(self, conn: socket.socket):
+        header = self.read_exactly(conn, STREAM_HEADER.size)
+        magic, version, codec_id, sample_rate, channels, _ = STREAM_HEADER.unpack(header)
+        dtx = False
+        self.sample_rate, self.channels = SAMPLE_RATE, CHANNELS
+        if magic != STREAM_MAGIC:
+            # Plain PCM without a header, like the client has always sent
+            self.codec = PCM
+            self.on_audio(header)
+        else:
+            offered = codec_id & CODEC_ID_MASK if version >= STREAM_VERSION_FLAGS else codec_id
+            self.codec = next((c for c, i in CODEC_IDS.items() if i == offered and c in self.accept), PCM)
+            answer = CODEC_IDS[self.codec]
+            # The flags are for the offered codec, falling back to PCM means plain PCM
+            if version >= STREAM_VERSION_FLAGS and CODEC_IDS[self.codec] == offered:
+                dtx = self.dtx and bool(codec_id & DTX_ACCEPTED)
+                answer |= DTX_ACCEPTED if dtx else 0
+                if self.codec == OPUS or sample_rate in self.accept_rates:
+                    answer |= RATE_ACCEPTED
+                    self.sample_rate = sample_rate
+                if channels == 1 and self.accept_mono:
+                    answer |= CHANNELS_ACCEPTED
+                    self.channels = 1
+            if self.codec == OPUS:
+                self.sample_rate = 48000
+            conn.sendall(bytes([answer]))
+
+        decoder = None
+        if self.codec == OPUS:
+            import opuslib
+            decoder = opuslib.Decoder(48000, self.channels)
+        while self.running:
+            if self.codec == PCM and not dtx:
+                data = conn.recv(65536 if self.read_rate is None else 4096)
+                if not data:
+                    break
+                self.wire_bytes += len(data)
+                self.throttle()
+                self.on_audio(data)
+                continue
+            silence, size = parse_packet_header(self.read_exactly(conn, PACKET_HEADER.size))
+            if silence:
+                # Fill in the silence, so the timing stays the same
+                self.silence_packets += 1
+                self.on_audio(bytes(size * 2 * self.channels))
+                continue
+            payload = self.read_exactly(conn, size)
+            if self.codec == PCM:
+                self.on_audio(payload)
+            elif self.codec == LOSSLESS:
+                self.on_audio(decode_lossless(payload, 2 * self.channels))
+            else:
+                self.on_audio(decoder.decode(payload, 960))
+
+    def drift(self, sample_size: int = SAMPLE_SIZE) -> Tuple[float, float]:
+        # How far the received audio is ahead of real time (seconds), at the end and at the worst moment
+        with self.lock:
+            samples = list(self.samples)
+        if not samples:
+            return 0.0, 0.0
+        start = samples[0][0]
+        drifts = [received / sample_size - (at - start) for at, received in samples]
+        return drifts[-1], max(drifts, key=abs)
+
+    def behind(self, sample_size: int = SAMPLE_SIZE) -> float:
+        # Longest the received audio fell behind the furthest ahead of real time it had been (seconds), a stall
+        with self.lock:
+            samples = list(self.samples)
+        worst, ahead = 0.0, None
+        for at, received in samples:
+            lead = received / sample_size - at
+            ahead = lead if ahead is None else max(ahead, lead)
+            worst = max(worst, ahead - lead)
+        return worst
+
+    def throughput(self, since: float = 0.0) -> float:
+        # Audio bytes per second received after `since` (time.monotonic)
+        with self.lock:
+            samples = [s for s in self.samples if s[0] >= since]
+        if len(samples) < 2:
+            return 0.0
+        (first_at, first), (last_at, last) = samples[0], samples[-1]
+        return (last - first) / max(last_at - first_at, 1e-9)
+
+    def close(self):
+        self.running = False
+        self.server.close()
+        self.thread.join(timeout=5)
@@ -0,0 +1,240 @@
+import mmap
+import os
+import re
+import struct
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from jitter_buffer import FRAME_SIZE
+
+# Disk space of a capture (bytes), split into segments of this size that are overwritten oldest first
+CAPTURE_BUDGET = 64 * 1024 * 1024
+SEGMENT_SIZE = 8 * 1024 * 1024
+# At least this many segments, so overwriting the oldest one never throws away much of the budget
+MIN_SEGMENTS = 8
+SEGMENT_SUFFIX = ".spcap"
+
+# Segment: header, index of the chunks in it, then their audio. All little-endian, the files stay on this machine.
+# Header: magic, version, channels, sample rate, sequence number (to order the segments), chunks, index capacity
+SEGMENT_MAGIC = b"SPCP"
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct("<4sBBxxIQII4x")
+# Where the chunk count is in the header, it is updated on its own
+CHUNK_COUNT = struct.Struct("<I")
+CHUNK_COUNT_OFFSET = 20
+# Index entry: wall clock time it was sent, stream position (audio bytes before it), offset and size in the
+# segment, flags
+INDEX_ENTRY = struct.Struct("<dQIIH6x")
+# One index entry per this many bytes of audio, enough for chunks of a few ms
+INDEX_DENSITY = 2048
+
+# Chunk flags
+STREAM_START = 0x1
+RECONNECTED = 0x2
+
+
+class CaptureChunk:
+    __slots__ = ("time", "position", "flags", "data", "sample_rate", "channels")
+
+    def __init__(self, time: float, position: int, flags: int, data: bytes, sample_rate: int, channels: int):
+        self.time: float = time
+        self.position: int = position
+        self.flags: int = flags
+        self.data: bytes = data
+        self.sample_rate: int = sample_rate
+        self.channels: int = channels
+
+    @property
+    def byte_rate(self) -> int:
+        return 2 * self.channels * self.sample_rate
+
+
+def capture_dir(root: str, session: str, stream_id: int) -> str:
+    # Every stream captures to its own directory, named after its session and its id, so two streams of the same
+    # session name never write to the same segments
+    name = re.sub(r"[^\w.-]", "_", session) or "session"
+    return os.path.join(root, f"{name}-{stream_id}")
+
+
+class Capture:
+    """
+    Keeps the last `budget` bytes of the audio a stream sent on disk, for replaying it when something sounded off.
+    That is the PCM after the DSP stage and the resampler, in the sample rate and channels agreed with the bot.
+
+    The capture is a ring of fixed-size segment files, each memory-mapped once, so writing a chunk is a copy into
+    the page cache and never waits on the disk. Every chunk gets an index entry with the time it was sent and its
+    position in the stream. The header's chunk count is updated after the chunk is complete, so whatever was
+    written is readable even if the process dies. When a segment is full the oldest one is overwritten. A capture
+    opened on a directory that already has one continues after its newest segment.
+    """
+
+    def __init__(self, directory: str, budget: int = CAPTURE_BUDGET, segment_size: int = SEGMENT_SIZE,
+                 sample_rate: int = 44100, channels: int = 2):
+        self.directory: str = directory
+        self.sample_rate: int = sample_rate
+        self.channels: int = channels
+        # Small budgets get smaller segments
+        segment_size = min(segment_size, budget // MIN_SEGMENTS)
+        if segment_size < INDEX_DENSITY * 16:
+            raise ValueError("The capture budget is too small.")
+        self.segment_count: int = budget // segment_size
+        self.index_capacity: int = segment_size // INDEX_DENSITY
+        self.data_start: int = SEGMENT_HEADER.size + self.index_capacity * INDEX_ENTRY.size
+        # Audio of a segment, in whole frames
+        self.data_size: int = (segment_size - self.data_start) // FRAME_SIZE * FRAME_SIZE
+        self.segment_size: int = self.data_start + self.data_size
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        newest, sequence = self._scan()
+        self.maps: List[Optional[mmap.mmap]] = [None] * self.segment_count
+        self.segment: int = (newest + 1) % self.segment_count if newest is not None else 0
+        self.sequence: int = sequence
+        self.chunks: int = 0
+        self.used: int = 0
+        # Audio bytes captured since the stream (or its format) started, and the flags of the next chunk
+        self.position: int = 0
+        self.flags: int = STREAM_START
+        self.seconds: float = 0.0
+        self.write_time: float = 0.0
+        self.max_write_time: float = 0.0
+        self.chunks_written: int = 0
+        self.closed: bool = False
+        self._open_segment()
+
+    def path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:03d}{SEGMENT_SUFFIX}")
+
+    def _scan(self) -> Tuple[Optional[int], int]:
+        # Newest segment of an earlier capture and the sequence number after it, segments that no longer fit the
+        # budget are removed
+        newest, sequence = None, 0
+        for name in os.listdir(self.directory):
+            match = re.fullmatch(rf"segment-(\d+){re.escape(SEGMENT_SUFFIX)}", name)
+            if match is None:
+                continue
+            segment = int(match.group(1))
+            if segment >= self.segment_count:
+                os.remove(os.path.join(self.directory, name))
+                continue
+            header = read_header(os.path.join(self.directory, name))
+            if header is not None and header[2] >= sequence:
+                newest, sequence = segment, header[2] + 1
+        return newest, sequence
+
+    def _open_segment(self):
+        # Start writing the current segment from scratch, the file and its mapping are created on first use
+        mapped = self.maps[self.segment]
+        if mapped is None:
+            fd = os.open(self.path(self.segment), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                # Claim the disk space now, so the capture can not run out of it later
+                if hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(fd, 0, self.segment_size)
+                else:
+                    os.ftruncate(fd, self.segment_size)
+                mapped = self.maps[self.segment] = mmap.mmap(fd, self.segment_size)
+            finally:
+                os.close(fd)
+        SEGMENT_HEADER.pack_into(mapped, 0, SEGMENT_MAGIC, SEGMENT_VERSION, self.channels, self.sample_rate,
+                                 self.sequence, 0, self.index_capacity)
+        self.sequence += 1
+        self.chunks = self.used = 0
+
+    def set_format(self, sample_rate: int, channels: int):
+        # The stream was negotiated again with another sample rate or channel count, it starts over in a new segment
+        if (sample_rate, channels) == (self.sample_rate, self.channels) or self.closed:
+            return
+        self.sample_rate, self.channels = sample_rate, channels
+        self.position = 0
+        self.flags |= STREAM_START
+        if self.chunks:
+            self.segment = (self.segment + 1) % self.segment_count
+        self._open_segment()
+
+    def reconnected(self):
+        # The next chunk goes to a new connection
+        self.flags |= RECONNECTED
+
+    def write(self, data, sent_at: Optional[float] = None):
+        # Copies a chunk of audio (bytes or a memoryview) into the ring, `sent_at` is its wall clock time
+        if self.closed:
+            return
+        started = time.perf_counter()
+        sent_at = time.time() if sent_at is None else sent_at
+        view = memoryview(data).cast("B")
+        while len(view):
+            # A chunk is only split over segments if it is larger than one
+            if self.chunks == self.index_capacity or self.used + min(len(view), self.data_size) > self.data_size:
+                self.segment = (self.segment + 1) % self.segment_count
+                self._open_segment()
+            size = min(len(view), self.data_size - self.used)
+            mapped, offset = self.maps[self.segment], self.data_start + self.used
+            mapped[offset:offset + size] = view[:size]
+            INDEX_ENTRY.pack_into(mapped, SEGMENT_HEADER.size + self.chunks * INDEX_ENTRY.size, sent_at,
+                                  self.position, offset, size, self.flags)
+            self.chunks += 1
+            # Only now the chunk counts, a reader never sees a half-written one
+            CHUNK_COUNT.pack_into(mapped, CHUNK_COUNT_OFFSET, self.chunks)
+            self.used += size
+            self.position += size
+            self.seconds += size / (2 * self.channels * self.sample_rate)
+            self.flags = 0
+            view = view[size:]
+        elapsed = time.perf_counter() - started
+        self.write_time += elapsed
+        self.max_write_time = max(self.max_write_time, elapsed)
+        self.chunks_written += 1
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for mapped in self.maps:
+            if mapped is not None:
+                mapped.close()
+
+    def __str__(self):
+        mean = self.write_time / max(self.chunks_written, 1)
+        return (f"captured {self.seconds:.1f} s to {self.directory}, "
+                f"write mean {mean * 1e6:.0f} us, max {self.max_write_time * 1e6:.0f} us")
+
+
+def read_header(path: str) -> Optional[Tuple[int, int, int, int, int]]:
+    # (channels, sample rate, sequence, chunks, index capacity) of a segment, None if it is not one
+    try:
+        with open(path, "rb") as f:
+            data = f.read(SEGMENT_HEADER.size)
+    except OSError:
+        return None
+    if len(data) < SEGMENT_HEADER.size:
+        return None
+    magic, version, channels, sample_rate, sequence, chunks, capacity = SEGMENT_HEADER.unpack(data)
+    if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+        return None
+    return channels, sample_rate, sequence, chunks, capacity
+
+
+def segments(directory: str) -> List[Tuple[Tuple[int, int, int, int, int], str]]:
+    # (header, path) of every segment of a capture, oldest first
+    found = []
+    for name in os.listdir(directory):
+        if name.endswith(SEGMENT_SUFFIX):
+            path = os.path.join(directory, name)
+            header = read_header(path)
+            if header is not None:
+                found.append((header, path))
+    return sorted(found, key=lambda segment: segment[0][2])
+
+
+def read_capture(directory: str) -> Iterator[CaptureChunk]:
+    # Every chunk still in a capture, oldest first. Can be read while the capture is being written.
+    for _, path in segments(directory):
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            _, _, channels, sample_rate, _, chunks, capacity = SEGMENT_HEADER.unpack_from(mapped, 0)
+            for i in range(min(chunks, capacity)):
+                sent_at, position, offset, size, flags = INDEX_ENTRY.unpack_from(
+                    mapped, SEGMENT_HEADER.size + i * INDEX_ENTRY.size)
+                yield CaptureChunk(sent_at, position, flags, mapped[offset:offset + size], sample_rate, channels)
+        finally:
+            mapped.close()
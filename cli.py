@@ -1,73 +1,140 @@
-import socket
-import subprocess
-import time
-from threading import Thread
+from threading import Event
+from typing import Optional, Tuple
 
 import click
-import requests
 
-from utils import resource_path
+from capture import CAPTURE_BUDGET
+from config import CACHE_DIR, CACHE_SIZE_LIMIT, CODECS, PCM, MAX_BURST, MAX_LAG, METRICS_PORT
+from jitter_buffer import POLICIES, DROP_OLDEST
+from resampler import QUALITIES
+from silence import SILENCE_THRESHOLD_DB
 
-API_BASE_URL = "https://spoofy.baka.tokyo/"
-SPOTIFY_CONNECT_NAME = "Spoofy Bot"
-SAMPLE_RATE = 44100
-CHANNELS = 2
-BITS = 16
-SAMPLE_SIZE = (SAMPLE_RATE * BITS * CHANNELS) // 8
-CHUNK_SIZE = SAMPLE_SIZE // 4
+
+class CliClient:
+    def __init__(self):
+        self.done = Event()
+        # Bots streamed to when fanning out, done once all of them are gone
+        self.outputs: int = 0
+
+    def on_output_lost(self, address: str, port: int, reason: str):
+        print(f"Stopped streaming to the bot at {address}:{port} ({reason}).")
+        self.outputs -= 1
+        if self.outputs <= 0:
+            self.done.set()
+
+    def on_bot_disconnect(self):
+        print("Bot has disconnected from voice, or there are connection problems...")
+        self.done.set()
+
+    def on_bot_reconnecting(self, attempt: int):
+        print(f"Lost the connection to the bot, reconnecting (attempt {attempt})...")
+
+    def on_bot_reconnected(self, recovery: float):
+        print(f"Reconnected to the bot, audio resumed after {recovery:.1f} seconds.")
 
 
 @click.command()
-@click.argument('link_code')
+@click.argument('link_codes', nargs=-1, required=True)
 @click.option('--username', "-u", help="Your Spotify username or email address")
-@click.option('--password', '-p', help="The password for your Spotify account")
+@click.option('--password', '-p', help="The password for your Spotify account, not needed once it is cached")
 @click.option('--bitrate', "-b", default=320, help="The bitrate of the stream")
-def spoofy(username: str, password: str, bitrate: int, link_code: str):
+@click.option('--max-burst', default=MAX_BURST, help="Seconds of audio that may be sent at once to catch up after a stall")
+@click.option('--jitter-ms', default=0, help="Target latency of the jitter buffer in milliseconds, 0 to disable")
+@click.option('--jitter-policy', default=DROP_OLDEST, type=click.Choice(POLICIES),
+              help="What to do when the jitter buffer is full")
+@click.option('--codec', default=PCM, type=click.Choice(CODECS),
+              help="Codec offered to the bot, it falls back to PCM if the bot does not support it")
+@click.option('--dtx', is_flag=True, help="Replace silence with silence packets, if the bot supports them")
+@click.option('--silence-threshold', default=SILENCE_THRESHOLD_DB, help="Level in dBFS below which audio is silence")
+@click.option('--resample', default=None, type=click.Choice(QUALITIES),
+              help="Send 48 kHz like Discord uses, resampled at this quality, if the bot accepts it")
+@click.option('--gain', default=0.0, help="Gain in dB applied to the stream")
+@click.option('--limiter', is_flag=True, help="Keep peaks below -1 dBFS with a look-ahead limiter (adds 5 ms)")
+@click.option('--mono', is_flag=True, help="Downmix to mono, half the bytes, if the bot accepts it")
+@click.option('--max-lag', default=MAX_LAG,
+              help="With several link codes, seconds a bot may fall behind the others before it is dropped")
+@click.option('--capture', default=None,
+              help="Keep the last of the sent audio in this directory, for replaying it with benchmarks/replay_capture.py")
+@click.option('--capture-size', default=CAPTURE_BUDGET // (1024 * 1024), help="Disk space of the capture in MiB")
+@click.option('--metrics-port', default=METRICS_PORT,
+              help="Port on localhost for the Prometheus metrics of the stream, 0 to disable")
+@click.option('--cache', default=CACHE_DIR, help="Directory for librespot's per-user audio caches")
+@click.option('--system-cache', default=None, help="Directory for the per-user credentials, defaults to --cache")
+@click.option('--cache-size', default=CACHE_SIZE_LIMIT, help="Size limit of the audio caches in MiB, 0 to disable")
+@click.option('--no-cache', is_flag=True, help="Always log in with the password and cache nothing")
+def spoofy(username: str, password: str, bitrate: int, max_burst: float, jitter_ms: int, jitter_policy: str,
+           codec: str, dtx: bool, silence_threshold: float, resample: Optional[str], gain: float, limiter: bool,
+           mono: bool, max_lag: float, capture: Optional[str], capture_size: int, metrics_port: int, cache: str,
+           system_cache: str, cache_size: int, no_cache: bool, link_codes: Tuple[str, ...]):
     """
-    Connect your Spotify account to the Spoofy bot through the CLI
+    Connect your Spotify account to the Spoofy bot through the CLI. With several link codes, the same audio is
+    streamed to every bot.
     """
-    librespot_path = resource_path("libraries/librespot")
-    args = [
-        librespot_path,
-        "--name", SPOTIFY_CONNECT_NAME,
-        "--username", username,
-        "--password", password,
-        "--bitrate", str(bitrate),
-        "--disable-discovery",
-        "--device-type", "speaker",
-        "--backend", "pipe",
-        "--initial-volume", "100",
-        "--enable-volume-normalisation"
-        ]
-    process = subprocess.Popen(args=args, stdout=subprocess.PIPE)
-    res = requests.get(API_BASE_URL + "connect/", params={"user": username, "link_code": link_code})
-    data = res.json()
-    address, port = data['address'], data['port']
-    output_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    stdout_thread = Thread(target=output_worker, args=[address, port, output_socket, process.stdout])
-    stdout_thread.start()
-    res = requests.get(API_BASE_URL + "start/", params={"link_code": link_code})
-
+    # The streaming modules pull in asyncio and the optional features, only load them once the command runs
+    from librespot_pool import LibrespotPool
+    from spotify_controller import SpotifyController
 
-def output_worker(address: str, port: int, sock: socket.socket, stdout):
-    # Connect to address
-    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-    sock.connect((address, port))
+    client = CliClient()
+    pool = LibrespotPool.get_instance()
+    if not no_cache:
+        from credential_cache import CredentialCache
+        pool.cache = CredentialCache(cache, system_cache, cache_size * 1024 * 1024)
+    else:
+        pool.cache = None
+    try:
+        dsp = None
+        if gain or limiter or mono:
+            from dsp import DspStage
+            dsp = DspStage(gain, limiter, mono)
+        controller = SpotifyController.create(client, username, password, bitrate)
+    except ValueError as e:
+        print(f"[ERROR] Could not start Spotify. {e}")
+        return
+    controller.max_burst = max_burst
+    controller.jitter_ms = jitter_ms or None
+    controller.jitter_policy = jitter_policy
+    controller.codec = codec
+    if dtx:
+        controller.silence_threshold_db = silence_threshold
+    controller.resample_quality = resample
+    controller.dsp = dsp
+    controller.fanout_max_lag = max_lag
+    controller.capture_dir = capture
+    controller.capture_budget = capture_size * 1024 * 1024
+    # Stop waiting as soon as librespot exits
+    controller.engine.submit(controller.process.wait()).add_done_callback(lambda _: client.done.set())
+    metrics_server = None
+    if metrics_port:
+        from metrics_server import MetricsServer
+        metrics_server = MetricsServer(port=metrics_port)
+        try:
+            controller.engine.run(metrics_server.start())
+            print(f"Serving stream metrics on http://{metrics_server.host}:{metrics_server.port}/metrics")
+        except OSError as e:
+            print(f"[WARNING] Could not serve stream metrics on port {metrics_port}: {e}")
+            metrics_server = None
 
-    # Start sending data
+    from handshake import Handshake
     try:
-        while (not stdout.closed):
-            # Read and send 0.25 seconds of audio
-            sock.send(stdout.read(CHUNK_SIZE))
-            # Wait 250ms before reading the next chunk
-            time.sleep(0.25)
-    except (ConnectionResetError, BrokenPipeError, OSError):
-        print("Disconnected from bot. Either user disconnected, bot disconnected or there are connection problems.")
+        fanout = len(link_codes) > 1
+        for link_code in link_codes:
+            res, msg, short_msg = Handshake(controller, fanout=fanout).run(username, link_code)
+            if res:
+                client.outputs += 1
+            else:
+                print(f"[ERROR] Error during connection{f' for {link_code}' if fanout else ''}. {msg}")
+        if client.outputs == 0:
+            return
+        print("Connected and streaming! You can now start using the bot.")
+        client.done.wait()
+    except KeyboardInterrupt:
+        pass
     finally:
-        if sock is not None:
-            sock.close()
-
-    print("OutputWorker stopped")
+        controller.stop()
+        if metrics_server is not None:
+            controller.engine.run(metrics_server.stop())
+        print(f"Stream: {controller.metrics.summary()}")
+        print("API latency: " + ", ".join(f"{name} {hist}" for name, hist in controller.api.latency.items()))
 
 
 if __name__ == "__main__":
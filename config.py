@@ -0,0 +1,36 @@
+import os
+
+# Shared constants, kept free of heavy imports so every entry point can import them cheaply
+
+CLIENT_VERSION = "v1.0"
+
+GITHUB_LINK_BOT = "https://github.com/Kanakonn/Spoofy"
+GITHUB_LINK_CLIENT = "https://github.com/Kanakonn/SpoofyClient"
+GITHUB_LATEST_RELEASE_API_URL = "https://api.github.com/repos/Kanakonn/SpoofyClient/releases/latest"
+
+# SPOOFY_API_URL points the client at another API, e.g. the stand-in in benchmarks/fake_api.py
+API_BASE_URL = os.environ.get("SPOOFY_API_URL", "https://spoofy.baka.tokyo/")
+
+# Per-user librespot caches (credentials and audio), SPOOFY_CACHE_DIR moves them
+if os.name == "nt":
+    _cache_home = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    CACHE_DIR = os.environ.get("SPOOFY_CACHE_DIR", os.path.join(_cache_home, "Spoofy", "cache"))
+else:
+    _cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    CACHE_DIR = os.environ.get("SPOOFY_CACHE_DIR", os.path.join(_cache_home, "spoofy"))
+# Audio cached by librespot for all users together, in MiB
+CACHE_SIZE_LIMIT = 512
+
+# Codecs the stream to the bot can use. PCM is the raw librespot output without any header, the other codecs are
+# negotiated with the bot when the connection is opened.
+PCM = "pcm"
+LOSSLESS = "lossless"
+OPUS = "opus"
+CODECS = (PCM, LOSSLESS, OPUS)
+# Maximum amount of audio (in seconds) that is sent as a burst to catch up after a stall
+MAX_BURST = 1.0
+# A fan-out destination that falls this far (seconds of audio) behind the others is evicted
+MAX_LAG = 2.0
+# Prometheus metrics of the streams
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
@@ -0,0 +1,150 @@
+import asyncio
+import hmac
+import json
+import os
+from typing import Callable, Dict, Optional, Tuple, Awaitable
+
+CONTROL_HOST = "127.0.0.1"
+CONTROL_PORT = 9465
+# Requests are small JSON objects, anything bigger is refused
+MAX_BODY_SIZE = 64 * 1024
+REQUEST_TIMEOUT = 10.0
+# Host headers of requests to the TCP listener, anything else may be a web page that rebound its domain to us
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "[::1]")
+
+# (method, path) -> handler(body) returning (status, content type, response body)
+Route = Tuple[str, str]
+Handler = Callable[[dict], Awaitable[Tuple[int, str, bytes]]]
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+               413: "Payload Too Large", 415: "Unsupported Media Type", 500: "Internal Server Error"}
+
+
+def json_response(data, status: int = 200) -> Tuple[int, str, bytes]:
+    return status, "application/json", json.dumps(data).encode("utf-8")
+
+
+def host_name(host: str) -> str:
+    # Host header without the port, IPv6 addresses keep their brackets
+    host = host.strip().lower()
+    if host.startswith("["):
+        return host[:host.find("]") + 1]
+    return host.split(":", 1)[0]
+
+
+class ControlServer:
+    """
+    Small HTTP/1.1 server on the engine loop for controlling the daemon.
+
+    Listens on localhost, or on a Unix socket that only the daemon's user can access. Request bodies are JSON,
+    every request gets its own connection. Browsers can reach localhost too, so POST requests must be sent as
+    application/json (which a web page can only do after a CORS preflight, never answered here), requests from a
+    web page (with an Origin header) are refused, and on TCP the Host has to be local. With a token, every
+    request needs it as `Authorization: Bearer <token>`.
+    """
+
+    def __init__(self, routes: Dict[Route, Handler], host: str = CONTROL_HOST, port: int = CONTROL_PORT,
+                 unix_socket: Optional[str] = None, token: Optional[str] = None):
+        self.routes: Dict[Route, Handler] = routes
+        self.host: str = host
+        self.port: int = port
+        self.unix_socket: Optional[str] = unix_socket
+        self.token: Optional[str] = token
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def address(self) -> str:
+        return self.unix_socket if self.unix_socket is not None else f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        if self.unix_socket is not None:
+            if os.path.exists(self.unix_socket):
+                os.unlink(self.unix_socket)
+            # Created accessible to the daemon's user only, there is no moment anyone else could connect
+            umask = os.umask(0o177)
+            try:
+                self.server = await asyncio.start_unix_server(self.handle, self.unix_socket)
+            finally:
+                os.umask(umask)
+        else:
+            self.server = await asyncio.start_server(self.handle, self.host, self.port)
+            self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+            if self.unix_socket is not None and os.path.exists(self.unix_socket):
+                os.unlink(self.unix_socket)
+
+    async def read_request(self, reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+        head = await reader.readuntil(b"\r\n\r\n")
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        method, target, _ = request_line.split(" ", 2)
+        headers = {}
+        for line in header_lines:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_SIZE:
+            raise OverflowError
+        body = await reader.readexactly(length) if length else b""
+        return method, target.split("?", 1)[0], headers, body
+
+    def refuse(self, method: str, headers: Dict[str, str]) -> Optional[Tuple[int, str, bytes]]:
+        # Response for a request that may not come from a local client, None if it may
+        if "origin" in headers:
+            return json_response({"ok": False, "msg": "Requests from web pages are not allowed."}, 403)
+        if self.unix_socket is None:
+            if host_name(headers.get("host", "")) not in LOCAL_HOSTS:
+                return json_response({"ok": False, "msg": "Host must be the local address."}, 403)
+        if self.token is not None:
+            given = headers.get("authorization", "")
+            if not hmac.compare_digest(given.encode("utf-8"), f"Bearer {self.token}".encode("utf-8")):
+                return json_response({"ok": False, "msg": "Missing or wrong token."}, 401)
+        if method == "POST" and headers.get("content-type", "").split(";")[0].strip().lower() != "application/json":
+            return json_response({"ok": False, "msg": "Request body must be sent as application/json."}, 415)
+        return None
+
+    async def dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[int, str, bytes]:
+        refused = self.refuse(method, headers)
+        if refused is not None:
+            return refused
+        handler = self.routes.get((method, path))
+        if handler is None:
+            return json_response({"ok": False, "msg": f"No such endpoint: {method} {path}"}, 404)
+        try:
+            params = json.loads(body) if body else {}
+        except ValueError:
+            return json_response({"ok": False, "msg": "Request body is not valid JSON."}, 400)
+        if not isinstance(params, dict):
+            return json_response({"ok": False, "msg": "Request body must be a JSON object."}, 400)
+        try:
+            return await handler(params)
+        except (KeyError, TypeError) as e:
+            return json_response({"ok": False, "msg": f"Missing or invalid parameter: {e}"}, 400)
+        except Exception as e:
+            print(f"Control request {method} {path} failed: {e}")
+            return json_response({"ok": False, "msg": str(e)}, 500)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                method, path, headers, body = await asyncio.wait_for(self.read_request(reader), REQUEST_TIMEOUT)
+            except OverflowError:
+                status, content_type, data = json_response({"ok": False, "msg": "Request body too large."}, 413)
+            except ValueError:
+                status, content_type, data = json_response({"ok": False, "msg": "Malformed request."}, 400)
+            else:
+                status, content_type, data = await self.dispatch(method, path, headers, body)
+            writer.write(f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                         f"Content-Type: {content_type}\r\n"
+                         f"Content-Length: {len(data)}\r\n"
+                         f"Connection: close\r\n\r\n".encode("ascii") + data)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
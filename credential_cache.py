@@ -0,0 +1,157 @@
+import hashlib
+import hmac
+import os
+from typing import Optional, List, Tuple, Callable
+
+from config import CACHE_DIR, CACHE_SIZE_LIMIT
+from librespot_events import LibrespotLine, AuthFailed, AuthSucceeded
+from log_dispatch import LogTarget
+from spotify_controller import librespot_args
+from utils import hash_password
+
+# Written by librespot to the system cache after logging in with a password
+CREDENTIALS_FILE = "credentials.json"
+# Salted hash of the password that created the cached credentials, so another password does not log in with them
+PASSWORD_FILE = "password.hash"
+SALT_SIZE = 16
+
+
+class CredentialCache:
+    """
+    Per-user cache directories for librespot.
+
+    Every user gets a system cache (credentials and volume, librespot's --system-cache) and an audio cache
+    (--cache) below the roots, named after a hash of the username. Once librespot has logged in with a password
+    it keeps reusable credentials there, so later starts leave the password off the command line. The audio
+    caches of all users together are kept below `size_limit` bytes by removing the oldest files.
+    """
+    _instance: Optional['CredentialCache'] = None
+
+    def __init__(self, root: str = CACHE_DIR, system_root: Optional[str] = None,
+                 size_limit: int = CACHE_SIZE_LIMIT * 1024 * 1024):
+        self.root: str = root
+        self.system_root: str = system_root if system_root is not None else root
+        self.size_limit: int = size_limit
+
+    @classmethod
+    def get_instance(cls) -> 'CredentialCache':
+        if cls._instance is None:
+            cls._instance = CredentialCache()
+        return cls._instance
+
+    @staticmethod
+    def user_key(username: str) -> str:
+        return hashlib.sha256(username.lower().encode("utf-8")).hexdigest()[:16]
+
+    def paths(self, username: str) -> Tuple[str, str]:
+        # (system cache, audio cache) of a user, created if needed and only accessible by us
+        key = self.user_key(username)
+        system_dir = os.path.join(self.system_root, key, "system")
+        audio_dir = os.path.join(self.root, key, "audio")
+        for path in (system_dir, audio_dir):
+            os.makedirs(path, mode=0o700, exist_ok=True)
+        return system_dir, audio_dir
+
+    def has_credentials(self, username: str, password: Optional[str] = None) -> bool:
+        # Whether librespot can log in from the cache, for the same password if one is given
+        system_dir = os.path.join(self.system_root, self.user_key(username), "system")
+        if not os.path.exists(os.path.join(system_dir, CREDENTIALS_FILE)):
+            return False
+        if password is None:
+            return True
+        try:
+            with open(os.path.join(system_dir, PASSWORD_FILE), "rb") as f:
+                data = f.read()
+        except OSError:
+            return False
+        salt, password_hash = data[:SALT_SIZE], data[SALT_SIZE:]
+        return hmac.compare_digest(password_hash, hash_password(password, salt))
+
+    def remember(self, username: str, password: Optional[str]):
+        # Called once librespot logged in with `password`, it has written the credentials by then
+        if password is None:
+            return
+        system_dir, _ = self.paths(username)
+        salt = os.urandom(SALT_SIZE)
+        path = os.path.join(system_dir, PASSWORD_FILE)
+        with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+            f.write(salt + hash_password(password, salt))
+
+    def forget(self, username: str):
+        # The cached credentials were refused, the next login has to use the password again
+        system_dir = os.path.join(self.system_root, self.user_key(username), "system")
+        for name in (CREDENTIALS_FILE, PASSWORD_FILE):
+            try:
+                os.remove(os.path.join(system_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def librespot_args(self, username: str, password: Optional[str], bitrate: int = 160,
+                       args_factory: Callable[..., List[str]] = librespot_args) -> Tuple[List[str], 'CacheTarget']:
+        # Command line for librespot using this cache, and the log target that keeps the cache up to date
+        cached = self.has_credentials(username, password)
+        if password is None and not cached:
+            raise ValueError(f"No password given and no cached credentials for '{username}'.")
+        # With cached credentials the password stays out of the process table
+        args = args_factory(username, None if cached else password, bitrate) + self.args(username)
+        return args, CacheTarget(self, username, password, cached)
+
+    def args(self, username: str) -> List[str]:
+        system_dir, audio_dir = self.paths(username)
+        if self.size_limit <= 0:
+            return ["--system-cache", system_dir, "--disable-audio-cache"]
+        self.evict()
+        return ["--system-cache", system_dir, "--cache", audio_dir]
+
+    def evict(self) -> int:
+        # Remove the least recently written audio files until all users fit in the limit, returns bytes removed
+        if not os.path.isdir(self.root):
+            return 0
+        files = []
+        for key in os.listdir(self.root):
+            audio_dir = os.path.join(self.root, key, "audio")
+            for root, _, names in os.walk(audio_dir):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in sorted(files):
+            if total - removed <= self.size_limit:
+                break
+            try:
+                os.remove(path)
+                removed += size
+            except OSError:
+                pass
+        if removed:
+            print(f"Removed {removed / 1024 / 1024:.1f} MiB from the audio cache")
+        return removed
+
+
+class CacheTarget(LogTarget):
+    """
+    Keeps the credential cache in step with how librespot's login went.
+    """
+    # Hashes the password and writes files
+    blocking = True
+
+    def __init__(self, cache: CredentialCache, username: str, password: Optional[str], cached: bool):
+        self.cache: CredentialCache = cache
+        self.username: str = username
+        self.password: Optional[str] = password
+        # Whether librespot was started without a password, to log in from the cache
+        self.cached: bool = cached
+
+    def process(self, line: LibrespotLine):
+        event = line.event
+        if isinstance(event, AuthSucceeded) and not self.cached:
+            self.cache.remember(self.username, self.password)
+            self.password = None
+        elif isinstance(event, AuthFailed) and self.cached:
+            print(f"Cached credentials for {self.username} were refused, forgetting them")
+            self.cache.forget(self.username)
@@ -0,0 +1,349 @@
+import asyncio
+import signal
+import time
+from concurrent.futures import Future, TimeoutError
+from threading import Event
+from typing import Optional, Tuple, Callable, List
+
+import click
+
+from capture import CAPTURE_BUDGET
+from config import CACHE_DIR, CACHE_SIZE_LIMIT
+from control_server import ControlServer, CONTROL_HOST, CONTROL_PORT, json_response
+from credential_cache import CredentialCache
+from dsp import DspStage
+from engine import Engine
+from handshake import Handshake
+from jitter_buffer import POLICIES, DROP_OLDEST
+from librespot_events import LibrespotLine, AuthFailed, AuthSucceeded, SessionLost
+from log_dispatch import LogTarget
+from resampler import QUALITIES
+from session_manager import SessionManager, SessionLimits
+from spotify_controller import SpotifyController, librespot_args
+from stream_codec import CODECS, PCM
+from stream_metrics import render_prometheus
+
+# How long a login may take before it is given up
+LOGIN_TIMEOUT = 15.0
+# Types of the control API's parameters, anything else is refused with 400
+PARAM_TYPES = {"username": (str,), "password": (str,), "link_code": (str,), "bitrate": (int,), "gain_db": (int, float)}
+
+
+def check_param(key: str, value):
+    # JSON true and false are ints to Python, but never a bitrate or a gain
+    types = PARAM_TYPES.get(key)
+    if types is not None and (isinstance(value, bool) or not isinstance(value, types)):
+        raise TypeError(f"'{key}' must be {'a number' if str not in types else 'a string'}")
+    return value
+
+
+class SessionEventsTarget(LogTarget):
+    def __init__(self, session: 'DaemonSession'):
+        self.session: 'DaemonSession' = session
+
+    def process(self, line: LibrespotLine):
+        event = line.event
+        if isinstance(event, AuthSucceeded):
+            self.session.on_login(True, "")
+        elif isinstance(event, AuthFailed):
+            self.session.on_login(False, event.error)
+        elif isinstance(event, SessionLost):
+            self.session.on_session_lost(event.reason)
+
+
+class DaemonSession:
+    """
+    A logged in Spotify account of the daemon.
+
+    Librespot keeps running between streams, so connecting to another link code only costs the handshake with the
+    bot. Acts as the SpotifyController's client, so it always knows the state of the stream.
+    """
+
+    def __init__(self, username: str):
+        self.username: str = username
+        self.controller: Optional[SpotifyController] = None
+        self.state: str = "logging_in"
+        self.link_code: Optional[str] = None
+        # Link code the session is registered under in the SessionManager, the last one it connected to
+        self.key_code: Optional[str] = None
+        self.error: Optional[str] = None
+        self.streams: int = 0
+        self.started_at: float = time.monotonic()
+        # Resolved with (ok, error) once librespot logged in, failed to log in or exited
+        self.logged_in: Future = Future()
+
+    @property
+    def alive(self) -> bool:
+        return self.controller is not None and self.controller.process.returncode is None
+
+    def on_login(self, ok: bool, error: str):
+        if not self.logged_in.done():
+            self.logged_in.set_result((ok, error))
+        if ok:
+            self.state = "ready"
+        else:
+            self.state, self.error = "failed", error
+
+    def on_session_lost(self, reason: str):
+        print(f"[{self.username}] Spotify session lost: {reason}")
+        self.state, self.error = "session_lost", reason
+
+    def on_exit(self, _):
+        self.on_login(False, "Librespot exited.")
+        self.state = "stopped"
+
+    def on_bot_disconnect(self):
+        print(f"[{self.username}] Bot disconnected from link code {self.link_code}")
+        self.state, self.link_code = "ready", None
+
+    def on_bot_reconnecting(self, attempt: int):
+        self.state = "reconnecting"
+
+    def on_bot_reconnected(self, recovery: float):
+        self.state = "streaming"
+
+    def status(self) -> dict:
+        status = {
+            "username": self.username,
+            "state": self.state,
+            "link_code": self.link_code,
+            "error": self.error,
+            "streams": self.streams,
+            "uptime": time.monotonic() - self.started_at,
+        }
+        if self.controller is not None:
+            metrics = self.controller.metrics
+            timings = self.controller.timings
+            status.update({
+                "bytes_sent": metrics.bytes_sent,
+                "throughput": metrics.rate.rate(),
+                "reconnects": metrics.reconnects,
+                "time_to_first_audio": timings.time_to_first_audio if timings is not None else None,
+                "stream": metrics.summary(),
+            })
+        return status
+
+
+class Daemon:
+    """
+    Long-running host for Spotify sessions, controlled through a local API.
+
+    The sessions live in a SessionManager, which applies its limits to them, one per account. A DaemonSession is
+    the client of its SpotifyController. All methods block and are thread-safe, the control server calls them on
+    the engine's executor.
+    """
+
+    def __init__(self, engine: Optional[Engine] = None, login_timeout: float = LOGIN_TIMEOUT,
+                 args_factory: Callable[..., List[str]] = librespot_args, cache: Optional[CredentialCache] = None,
+                 max_sessions: int = 50, limits: Optional[SessionLimits] = None):
+        self.engine: Engine = engine if engine is not None else Engine.get_instance()
+        self.login_timeout: float = login_timeout
+        # One session per account, with the per-user librespot cache, so restarting the daemon does not need every
+        # password again
+        self.manager: SessionManager = SessionManager(max_sessions, limits, self.engine, args_factory, cache)
+        # Stream settings for new sessions
+        self.codec: str = PCM
+        self.resample_quality: Optional[str] = None
+        # DSP stage of new sessions, the gain can be changed per session later
+        self.gain_db: float = 0.0
+        self.limiter: bool = False
+        self.mono: bool = False
+        self.jitter_ms: Optional[int] = None
+        self.jitter_policy: str = DROP_OLDEST
+        # Every session captures the audio it sends below this directory, if set
+        self.capture_dir: Optional[str] = None
+        self.capture_budget: int = CAPTURE_BUDGET
+
+    def find(self, username: str) -> Optional[DaemonSession]:
+        controllers = self.manager.find(username)
+        return controllers[0].client if controllers else None
+
+    def session(self, username: str) -> DaemonSession:
+        session = self.find(username)
+        if session is None:
+            raise ValueError(f"'{username}' is not logged in.")
+        return session
+
+    def login(self, username: str, password: Optional[str] = None, bitrate: int = 160) -> Tuple[bool, str, str]:
+        session = self.find(username)
+        if session is not None:
+            if session.alive and session.state != "failed":
+                return True, "Already logged in.", ""
+            self.logout(username)
+
+        session = DaemonSession(username)
+        try:
+            controller = self.manager.create(session, username, password, None, bitrate, self.jitter_ms,
+                                             self.jitter_policy)
+        except ValueError as e:
+            # Already logging in, or the daemon hosts as many sessions as it may
+            return False, str(e), "Could not start Spotify."
+        except Exception as e:
+            return False, f"Could not start librespot: {e}", "Could not start Spotify."
+        controller.log_targets.append(SessionEventsTarget(session))
+        controller.codec = self.codec
+        controller.resample_quality = self.resample_quality
+        if self.gain_db or self.limiter or self.mono:
+            controller.dsp = DspStage(self.gain_db, self.limiter, self.mono)
+        controller.capture_dir = self.capture_dir
+        controller.capture_budget = self.capture_budget
+        session.controller = controller
+        self.engine.submit(controller.process.wait()).add_done_callback(session.on_exit)
+
+        try:
+            ok, error = session.logged_in.result(timeout=self.login_timeout)
+        except TimeoutError:
+            ok, error = False, "Timed out logging in to Spotify."
+        if not ok:
+            self.logout(username)
+            return False, error, "Login failed."
+        print(f"[{username}] Logged in")
+        return True, "", ""
+
+    def connect(self, username: str, link_code: str) -> Tuple[bool, str, str]:
+        session = self.session(username)
+        if not session.alive:
+            return False, "Librespot is not running, log in again.", "Spotify is not running."
+        if session.state in ("streaming", "reconnecting"):
+            # One stream per session, switch it over to the new link code
+            session.controller.disconnect()
+        self.manager.move(username, session.key_code, link_code)
+        session.key_code = link_code
+        session.state, session.link_code = "connecting", link_code
+        res, msg, short_msg = Handshake(session.controller).run(username, link_code)
+        if res:
+            session.state = "streaming"
+            session.streams += 1
+        else:
+            session.state, session.link_code, session.error = "ready", None, msg
+        return res, msg, short_msg
+
+    def set_gain(self, username: str, gain_db: float) -> Tuple[bool, str, str]:
+        session = self.session(username)
+        if session.controller is None:
+            return False, "Librespot is not running, log in again.", "Spotify is not running."
+        dsp = session.controller.dsp
+        if dsp is None:
+            # Without a DSP stage the stream is untouched, it goes through one from the next stream on
+            session.controller.dsp = DspStage(float(gain_db), limiter=False)
+            return True, "The gain applies from the next stream.", ""
+        dsp.gain_db = float(gain_db)
+        return True, "", ""
+
+    def disconnect(self, username: str) -> Tuple[bool, str, str]:
+        session = self.session(username)
+        if session.controller is not None:
+            session.controller.disconnect()
+        session.state, session.link_code = "ready", None
+        return True, "", ""
+
+    def logout(self, username: str) -> Tuple[bool, str, str]:
+        session = self.find(username)
+        if session is None:
+            return False, f"'{username}' is not logged in.", "Not logged in."
+        self.manager.remove(username, session.key_code)
+        print(f"[{username}] Logged out")
+        return True, "", ""
+
+    def status(self) -> dict:
+        return {"sessions": [c.client.status() for c in self.manager.all()]}
+
+    def stop_all(self):
+        # All sessions are stopped together, under one deadline
+        sessions = [c.client for c in self.manager.all()]
+        self.manager.stop_all()
+        for session in sessions:
+            print(f"[{session.username}] Logged out")
+
+    def routes(self) -> dict:
+        # Control API, every handler runs the blocking Daemon method on the engine's executor
+        def action(method, *keys, **optional):
+            async def handler(params: dict):
+                args = [check_param(key, params[key]) for key in keys]
+                kwargs = {key: check_param(key, params[key]) if params.get(key) is not None else default
+                          for key, default in optional.items()}
+                loop = asyncio.get_running_loop()
+                try:
+                    ok, msg, short_msg = await loop.run_in_executor(None, lambda: method(*args, **kwargs))
+                except ValueError as e:
+                    ok, msg, short_msg = False, str(e), "Invalid request."
+                return json_response({"ok": ok, "msg": msg, "short_msg": short_msg})
+            return handler
+
+        async def status(_):
+            return json_response(self.status())
+
+        async def metrics(_):
+            return 200, "text/plain; version=0.0.4; charset=utf-8", render_prometheus().encode("utf-8")
+
+        return {
+            ("POST", "/login"): action(self.login, "username", password=None, bitrate=160),
+            ("POST", "/connect"): action(self.connect, "username", "link_code"),
+            ("POST", "/disconnect"): action(self.disconnect, "username"),
+            ("POST", "/gain"): action(self.set_gain, "username", "gain_db"),
+            ("POST", "/logout"): action(self.logout, "username"),
+            ("GET", "/status"): status,
+            ("GET", "/metrics"): metrics,
+        }
+
+
+@click.command()
+@click.option('--host', default=CONTROL_HOST, help="Address for the control API, keep this on localhost")
+@click.option('--port', default=CONTROL_PORT, help="Port for the control API")
+@click.option('--socket', 'unix_socket', default=None, help="Serve the control API on this Unix socket instead")
+@click.option('--token', default=None, envvar="SPOOFY_DAEMON_TOKEN",
+              help="Require this token as 'Authorization: Bearer <token>' on every request")
+@click.option('--codec', default=PCM, type=click.Choice(CODECS), help="Codec offered to the bot")
+@click.option('--resample', default=None, type=click.Choice(QUALITIES),
+              help="Send 48 kHz like Discord uses, resampled at this quality, if the bot accepts it")
+@click.option('--gain', default=0.0, help="Gain in dB of new sessions, can be changed per session with /gain")
+@click.option('--limiter', is_flag=True, help="Keep peaks below -1 dBFS with a look-ahead limiter (adds 5 ms)")
+@click.option('--mono', is_flag=True, help="Downmix to mono, half the bytes, if the bot accepts it")
+@click.option('--jitter-ms', default=0, help="Target latency of the jitter buffer in milliseconds, 0 to disable")
+@click.option('--jitter-policy', default=DROP_OLDEST, type=click.Choice(POLICIES),
+              help="What to do when the jitter buffer is full")
+@click.option('--capture', default=None,
+              help="Keep the last of every session's sent audio below this directory, for replaying it with benchmarks/replay_capture.py")
+@click.option('--capture-size', default=CAPTURE_BUDGET // (1024 * 1024), help="Disk space of every session's capture in MiB")
+@click.option('--cache', default=CACHE_DIR, help="Directory for librespot's per-user audio caches")
+@click.option('--system-cache', default=None, help="Directory for the per-user credentials, defaults to --cache")
+@click.option('--cache-size', default=CACHE_SIZE_LIMIT, help="Size limit of the audio caches in MiB, 0 to disable")
+@click.option('--no-cache', is_flag=True, help="Always log in with the password and cache nothing")
+@click.option('--max-sessions', default=50, help="Most Spotify accounts logged in at once")
+@click.option('--memory-limit', default=0, help="Address space limit of every librespot in MiB, 0 for none")
+def spoofyd(host: str, port: int, unix_socket: Optional[str], token: Optional[str], codec: str, resample: Optional[str], gain: float,
+            limiter: bool, mono: bool, jitter_ms: int, jitter_policy: str, capture: Optional[str], capture_size: int,
+            cache: str, system_cache: Optional[str], cache_size: int, no_cache: bool, max_sessions: int,
+            memory_limit: int):
+    """
+    Run Spoofy as a headless daemon, controlled through a local HTTP API
+    """
+    limits = SessionLimits(memory_limit=memory_limit * 1024 * 1024 or None)
+    daemon = Daemon(cache=None if no_cache else CredentialCache(cache, system_cache, cache_size * 1024 * 1024),
+                    max_sessions=max_sessions, limits=limits)
+    daemon.codec = codec
+    daemon.resample_quality = resample
+    daemon.gain_db, daemon.limiter, daemon.mono = gain, limiter, mono
+    daemon.jitter_ms = jitter_ms or None
+    daemon.jitter_policy = jitter_policy
+    daemon.capture_dir = capture
+    daemon.capture_budget = capture_size * 1024 * 1024
+    server = ControlServer(daemon.routes(), host=host, port=port, unix_socket=unix_socket, token=token)
+    daemon.engine.run(server.start())
+    print(f"Spoofy daemon listening on {server.address}")
+
+    stopping = Event()
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    try:
+        # Wake up now and then, so signals are handled on every platform
+        while not stopping.wait(1):
+            pass
+    finally:
+        print("Stopping Spoofy daemon...")
+        daemon.engine.run(server.stop())
+        daemon.stop_all()
+
+
+if __name__ == "__main__":
+    spoofyd(standalone_mode=False)
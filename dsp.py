@@ -0,0 +1,141 @@
+import time
+import weakref
+from importlib.util import find_spec
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from stream_metrics import StreamMetrics
+
+DSP_SUPPORTED = find_spec("numpy") is not None
+
+# Gain can be set between these (dB), the limiter keeps peaks below its threshold (dBFS)
+MIN_GAIN_DB = -60.0
+MAX_GAIN_DB = 24.0
+LIMITER_THRESHOLD_DB = -1.0
+# The limiter sees peaks this far ahead (which delays the audio by as much), and holds the gain down this long
+# after them so it does not pump on every wave
+LOOKAHEAD_MS = 5
+HOLD_MS = 50
+SAMPLE_RATE = 44100
+CHANNELS = 2
+FULL_SCALE = 32768
+
+
+class DspStage:
+    """
+    Gain, look-ahead limiter and mono downmix for 16 bit stereo PCM, done on whole chunks with numpy.
+
+    The gain can be changed at any time (from any thread), it is ramped over the next chunk so it does not click.
+    The limiter works out the gain every frame needs to stay below the threshold, takes the minimum over the
+    look-ahead and hold window and smooths that with a moving average over the look-ahead. The audio is delayed by
+    the look-ahead, so the gain is already down when a peak comes out. All of it keeps its state between chunks,
+    so the output does not depend on how the stream is chunked.
+    """
+
+    def __init__(self, gain_db: float = 0.0, limiter: bool = True, mono: bool = False,
+                 threshold_db: float = LIMITER_THRESHOLD_DB, lookahead_ms: int = LOOKAHEAD_MS, hold_ms: int = HOLD_MS,
+                 sample_rate: int = SAMPLE_RATE):
+        if not DSP_SUPPORTED:
+            raise ValueError("The DSP stage needs numpy.")
+        import numpy
+        self.np = numpy
+        # Stages of other streams of the same session, their gain follows this one
+        self.copies: 'weakref.WeakSet[DspStage]' = weakref.WeakSet()
+        self.gain: float = 1.0
+        self.gain_db = gain_db
+        self.limiter: bool = limiter
+        self.mono: bool = mono
+        self.threshold_db: float = threshold_db
+        self.threshold: float = FULL_SCALE * 10 ** (threshold_db / 20)
+        self.lookahead_ms: int = lookahead_ms
+        self.hold_ms: int = hold_ms
+        self.sample_rate: int = sample_rate
+        self.lookahead: int = max(sample_rate * lookahead_ms // 1000, 1)
+        self.window: int = self.lookahead + sample_rate * hold_ms // 1000
+        # Per-chunk processing time is reported here, if set
+        self.metrics: Optional['StreamMetrics'] = None
+        self.reset()
+
+    @property
+    def gain_db(self) -> float:
+        return 20 * self.np.log10(self.gain)
+
+    @gain_db.setter
+    def gain_db(self, value: float):
+        if not MIN_GAIN_DB <= value <= MAX_GAIN_DB:
+            raise ValueError(f"Gain must be between {MIN_GAIN_DB:.0f} and {MAX_GAIN_DB:.0f} dB.")
+        # A single assignment, so it is safe to change while the stream is running
+        self.gain = float(10 ** (value / 20))
+        for stage in self.copies:
+            stage.gain = self.gain
+
+    def copy(self) -> 'DspStage':
+        # Same settings with its own state, for another stream of the session
+        stage = DspStage(self.gain_db, self.limiter, self.mono, self.threshold_db, self.lookahead_ms, self.hold_ms,
+                         self.sample_rate)
+        self.copies.add(stage)
+        return stage
+
+    @property
+    def delay_frames(self) -> int:
+        return self.lookahead - 1 if self.limiter else 0
+
+    def reset(self):
+        # Start a new stream, the gain stays as it is
+        np = self.np
+        self.applied_gain: float = self.gain
+        # Required gains and their minimums of the last frames, and the delayed audio
+        self.required = np.ones(self.window - 1, dtype=np.float32)
+        self.minimums = np.ones(self.lookahead - 1, dtype=np.float32)
+        self.delayed = np.zeros((self.lookahead - 1, CHANNELS), dtype=np.float32)
+        self.limited_frames: int = 0
+
+    def running_min(self, values, width: int):
+        # out[i] = min(values[i:i + width]) in O(n): the minimum from i to the end of its block of `width` values,
+        # and from the start of the next block to i + width - 1 (van Herk/Gil-Werman)
+        np = self.np
+        count = len(values) - width + 1
+        padded = np.concatenate((values, np.full(-len(values) % width, np.inf, dtype=values.dtype)))
+        blocks = padded.reshape(-1, width)
+        prefix = np.minimum.accumulate(blocks, axis=1).ravel()
+        suffix = np.minimum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+        return np.minimum(suffix[:count], prefix[width - 1:width - 1 + count])
+
+    def limit(self, x):
+        # Returns the delayed audio with the limiter's gain applied
+        np = self.np
+        peaks = np.abs(x).max(axis=1)
+        required = np.minimum(self.threshold / np.maximum(peaks, 1.0), 1.0).astype(np.float32)
+        self.limited_frames += int(np.count_nonzero(required < 1.0))
+        required = np.concatenate((self.required, required))
+        self.required = required[len(required) - (self.window - 1):]
+        minimums = np.concatenate((self.minimums, self.running_min(required, self.window)))
+        self.minimums = minimums[len(minimums) - (self.lookahead - 1):]
+        sums = np.concatenate(([0.0], np.cumsum(minimums, dtype=np.float64)))
+        smooth = ((sums[self.lookahead:] - sums[:-self.lookahead]) / self.lookahead).astype(np.float32)
+        delayed = np.concatenate((self.delayed, x))
+        self.delayed = delayed[len(x):]
+        return delayed[:len(x)] * smooth[:, None]
+
+    def process(self, pcm, mono: Optional[bool] = None) -> bytes:
+        # Whole frames of 16 bit little-endian stereo (bytes or a memoryview), returns as many frames, in mono if
+        # `mono` (defaults to the stage's setting)
+        started = time.perf_counter()
+        np = self.np
+        x = np.frombuffer(pcm, dtype="<i2").reshape(-1, CHANNELS).astype(np.float32)
+        if len(x) == 0:
+            return b""
+        gain, applied = self.gain, self.applied_gain
+        if gain != applied:
+            x *= np.linspace(applied, gain, len(x), dtype=np.float32)[:, None]
+            self.applied_gain = gain
+        elif gain != 1.0:
+            x *= gain
+        if self.limiter:
+            x = self.limit(x)
+        if self.mono if mono is None else mono:
+            x = x.mean(axis=1)
+        out = np.clip(np.rint(x), -32768, 32767).astype("<i2").tobytes()
+        if self.metrics is not None:
+            self.metrics.record_dsp(time.perf_counter() - started, len(x) / self.sample_rate)
+        return out
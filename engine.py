@@ -0,0 +1,76 @@
+import asyncio
+import os
+import sys
+from concurrent.futures import Future
+from threading import Thread, Lock, get_ident
+from typing import Optional, Coroutine, Any
+
+
+class Engine:
+    """
+    Runs a single asyncio event loop in a background thread.
+
+    All librespot processes, log readers and audio relays run as tasks on this loop, so the number of threads
+    does not grow with the number of sessions. Other threads (the wx main loop, the CLI) hand work to it through
+    `run` and `submit`, which are thread-safe.
+    """
+    _instance: Optional['Engine'] = None
+    _instance_lock: Lock = Lock()
+
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+        self.thread: Thread = Thread(target=self._run, name="SpotifyEngine", daemon=True)
+
+    @classmethod
+    def get_instance(cls) -> 'Engine':
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = Engine()
+                cls._instance.start()
+            return cls._instance
+
+    def start(self):
+        # Before 3.12 the default child watcher starts a thread for every subprocess, pidfds don't need one
+        if sys.platform == "linux" and sys.version_info < (3, 12) and hasattr(os, "pidfd_open"):
+            watcher = asyncio.PidfdChildWatcher()
+            watcher.attach_loop(self.loop)
+            asyncio.set_child_watcher(watcher)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def in_loop(self) -> bool:
+        return self.thread.ident is not None and self.thread.ident == get_ident()
+
+    def submit(self, coro: Coroutine) -> Future:
+        # Schedule a coroutine on the engine loop, returns a concurrent.futures.Future
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        # Run a coroutine on the engine loop and wait for its result
+        if self.in_loop():
+            raise RuntimeError("Engine.run() cannot be called from the engine thread, await the coroutine instead.")
+        return self.submit(coro).result(timeout)
+
+    def call_soon(self, callback, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def stop(self):
+        # Cancel everything that is still running and stop the loop
+        async def cancel_all():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self.loop.is_running():
+            self.run(cancel_all())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+        with Engine._instance_lock:
+            if Engine._instance is self:
+                Engine._instance = None
+
@@ -0,0 +1,238 @@
+import asyncio
+import os
+import socket
+import time
+from typing import Callable, List, Optional
+
+from capture import Capture
+from config import MAX_LAG
+from jitter_buffer import FRAME_SIZE
+from pacer import Pacer
+from stream_codec import Encoder
+from stream_metrics import StreamMetrics
+
+# Kernel send buffer of every destination, so a slow one pushes back on us instead of queueing seconds of audio
+SEND_BUFFER = 64 * 1024
+
+# Why a destination was removed
+EVICTED = "evicted"
+DISCONNECTED = "disconnected"
+REMOVED = "removed"
+ENDED = "ended"
+
+
+class Destination:
+    """
+    A socket the fan-out writes to, with its own position in the stream, its own encoder and its own capture of
+    the PCM it sent.
+    """
+
+    def __init__(self, sock: socket.socket, cursor: int, encoder: Optional[Encoder] = None, name: str = "",
+                 metrics: Optional[StreamMetrics] = None, capture: Optional[Capture] = None):
+        self.sock: socket.socket = sock
+        self.fd: int = sock.fileno()
+        self.name: str = name
+        self.encoder: Optional[Encoder] = encoder
+        self.metrics: Optional[StreamMetrics] = metrics
+        self.capture: Optional[Capture] = capture
+        # Stream position of the next audio to send, and what was taken from before it but is not sent yet
+        self.cursor: int = cursor
+        self.pending: memoryview = memoryview(b"")
+        self.pending_start: int = 0
+        self.pending_end: int = 0
+        self.pending_audio: int = 0
+        # Audio the packets carry, silence the encoder holds back counts once its packet is sent
+        self.pending_counted: int = 0
+        self.pending_pcm = b""
+        self.pending_since: float = 0.0
+        self.want_write: bool = False
+        self.on_first_send: Optional[Callable[[], None]] = None
+        # Resolved with the reason once the destination is removed
+        self.closed: Optional[asyncio.Future] = None
+        self.reason: Optional[str] = None
+        self.error: Optional[Exception] = None
+
+    @property
+    def position(self) -> int:
+        # Stream position up to which the audio was handed to the socket
+        return self.cursor - self.pending_audio
+
+
+class FanOut:
+    """
+    Reads librespot's pipe once and writes the audio to any number of sockets.
+
+    The pipe is read at real time into a ring buffer of raw PCM, whether anyone is listening or not, so a
+    destination that joins starts with live audio. Every destination sends from its own cursor as fast as its
+    socket takes it, encoded for itself if it negotiated a codec. One that can not keep up falls behind on its own,
+    and is evicted once it is `max_lag` seconds behind, before the ring overwrites what it still has to send. The
+    others never wait for it.
+    """
+
+    def __init__(self, src_fd: int, pacer: Pacer, chunk_size: int, max_lag: float = MAX_LAG):
+        self.src_fd: int = src_fd
+        self.pacer: Pacer = pacer
+        self.chunk_size: int = chunk_size
+        self.max_lag: int = int(max_lag * pacer.byte_rate)
+        # Room for the largest allowed lag and the read that detects it
+        capacity = self.max_lag + 2 * chunk_size
+        self.capacity: int = capacity + -capacity % FRAME_SIZE
+        self.buffer: bytearray = bytearray(self.capacity)
+        self.view: memoryview = memoryview(self.buffer)
+        # Stream position of the next byte read from the pipe
+        self.write_pos: int = 0
+        self.destinations: List[Destination] = []
+        self.evictions: int = 0
+        self.done: bool = False
+        self.want_read: bool = True
+        self.timeout: Optional[float] = None
+        self.wake: Optional[asyncio.Future] = None
+
+    def add(self, sock: socket.socket, encoder: Optional[Encoder] = None, name: str = "",
+            metrics: Optional[StreamMetrics] = None, capture: Optional[Capture] = None) -> Destination:
+        # Call on the loop that runs the fan-out. Starts at the last whole frame read, await `closed` for the end.
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        destination = Destination(sock, self.write_pos - self.write_pos % FRAME_SIZE, encoder, name, metrics,
+                                  capture)
+        destination.closed = asyncio.get_running_loop().create_future()
+        if encoder is not None:
+            encoder.reset()
+        self.destinations.append(destination)
+        self._wake()
+        return destination
+
+    def remove(self, destination: Destination, reason: str = REMOVED, error: Optional[Exception] = None):
+        # Call on the loop that runs the fan-out, the owner of the destination closes its socket
+        if destination not in self.destinations:
+            return
+        self.destinations.remove(destination)
+        destination.reason, destination.error = reason, error
+        self._wake()
+        if not destination.closed.done():
+            destination.closed.set_result(reason)
+
+    def lag(self, destination: Destination) -> float:
+        return (self.write_pos - destination.position) / self.pacer.byte_rate
+
+    def _wake(self):
+        if self.wake is not None and not self.wake.done():
+            self.wake.set_result(None)
+
+    def _read(self) -> Optional[int]:
+        # Read up to a chunk into the ring, None if the pipe is empty
+        offset = self.write_pos % self.capacity
+        try:
+            moved = os.readv(self.src_fd, [self.view[offset:min(offset + self.chunk_size, self.capacity)]])
+        except BlockingIOError:
+            return None
+        self.write_pos += moved
+        return moved
+
+    def _evict_slow(self):
+        for destination in list(self.destinations):
+            if self.write_pos - destination.position > self.max_lag:
+                self.evictions += 1
+                self.remove(destination, EVICTED)
+
+    def _send(self, destination: Destination):
+        # Send whatever this destination can take of what has been read so far
+        destination.want_write = False
+        while True:
+            if destination.pending_start < destination.pending_end:
+                try:
+                    destination.pending_start += destination.sock.send(
+                        destination.pending[destination.pending_start:destination.pending_end])
+                except BlockingIOError:
+                    destination.want_write = True
+                    return
+                except OSError as e:
+                    self.remove(destination, DISCONNECTED, e)
+                    return
+                if destination.on_first_send is not None:
+                    callback, destination.on_first_send = destination.on_first_send, None
+                    callback()
+                continue
+            if destination.pending_audio:
+                if destination.metrics is not None:
+                    destination.metrics.record_send(destination.pending_counted,
+                                                    time.monotonic() - destination.pending_since,
+                                                    destination.pending_end)
+                if destination.capture is not None:
+                    destination.capture.write(destination.pending_pcm)
+                destination.pending_audio = 0
+            if destination.cursor >= self.write_pos:
+                return
+            # The next contiguous part of the ring, at most a chunk
+            start = destination.cursor % self.capacity
+            end = min(start + self.write_pos - destination.cursor, self.capacity, start + self.chunk_size)
+            data = destination.pending_pcm = self.view[start:end]
+            destination.pending_counted = end - start
+            if destination.encoder is not None:
+                held = destination.encoder.held
+                data = memoryview(destination.encoder.encode(data))
+                destination.pending_pcm = destination.encoder.processed
+                destination.pending_counted += held - destination.encoder.held
+            destination.pending, destination.pending_start, destination.pending_end = data, 0, len(data)
+            destination.pending_audio = end - start
+            destination.pending_since = time.monotonic()
+            destination.cursor += end - start
+
+    def pump(self):
+        self.want_read = False
+        self.timeout = None
+        while True:
+            for destination in list(self.destinations):
+                self._send(destination)
+            if self.pacer.budget() < self.chunk_size:
+                self.timeout = max(self.pacer.delay(self.chunk_size), 0)
+                return
+            moved = self._read()
+            if moved is None:
+                self.want_read = True
+                return
+            if moved == 0:
+                # Librespot closed its end of the pipe, send what is left and stop
+                for destination in list(self.destinations):
+                    self._send(destination)
+                self.done = True
+                return
+            self.pacer.consume(moved)
+            self._evict_slow()
+
+    async def run_async(self, poll_interval: float = 0.25):
+        # Drive the fan-out from the running asyncio loop until the source is exhausted or the task is cancelled
+        loop = asyncio.get_running_loop()
+        os.set_blocking(self.src_fd, False)
+        self.pacer.start(preroll=self.chunk_size / self.pacer.byte_rate)
+        try:
+            while True:
+                self.pump()
+                if self.done:
+                    break
+
+                self.wake = wake = loop.create_future()
+                want_read, timer = self.want_read, None
+                writers = [d.fd for d in self.destinations if d.want_write]
+                if want_read:
+                    loop.add_reader(self.src_fd, self._wake)
+                for fd in writers:
+                    loop.add_writer(fd, self._wake)
+                if self.timeout is not None or not want_read:
+                    timer = loop.call_later(poll_interval if self.timeout is None else self.timeout, self._wake)
+                try:
+                    await wake
+                finally:
+                    self.wake = None
+                    if want_read:
+                        loop.remove_reader(self.src_fd)
+                    for fd in writers:
+                        loop.remove_writer(fd)
+                    if timer is not None:
+                        timer.cancel()
+        finally:
+            for destination in list(self.destinations):
+                self.remove(destination, ENDED)
+
+    def __str__(self):
+        return f"{len(self.destinations)} destination(s), {self.evictions} evicted, {self.pacer}"
@@ -1,16 +1,32 @@
-import re
+import importlib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from threading import RLock
+from typing import TYPE_CHECKING, Optional
 
-import requests
 import wx
 import wx.adv
 import wx.lib.newevent
 
+from config import CLIENT_VERSION, GITHUB_LINK_BOT, GITHUB_LINK_CLIENT, GITHUB_LATEST_RELEASE_API_URL
 from gui_view import SpoofyLoginDialog, SpoofyStatusDialog, AboutDialog
+from librespot_events import LibrespotLine, AuthFailed, AuthSucceeded, SessionLost
+from log_dispatch import LogTarget
+from log_model import LogModel
 from utils import resource_path
-from spotify_controller import SpotifyController, LogTarget
 
-LOG_MSG_FORMAT = re.compile(r"\[.*?] (.*)")
+if TYPE_CHECKING:
+    from spotify_controller import SpotifyController
+
+# Imported in the background once the login window is up, they are only needed after logging in
+PRELOAD_MODULES = ("handshake", "spotify_controller", "api_client")
+
+# Number of lines kept in the log view, and how often new lines are added to it
+LOG_MAX_LINES = 1000
+LOG_FLUSH_INTERVAL_MS = 100
+# How often the stream metrics in the status window are refreshed
+STREAM_STATUS_INTERVAL_MS = 1000
 
 BITRATE_CHOICES = {
     0: 96,
@@ -21,39 +37,31 @@ BITRATE_CHOICES = {
 LogEvent, EVT_LOG = wx.lib.newevent.NewEvent()
 SpotifyEvent, EVT_SPOTIFY = wx.lib.newevent.NewEvent()
 BotEvent, EVT_BOT = wx.lib.newevent.NewEvent()
+VersionEvent, EVT_VERSION = wx.lib.newevent.NewEvent()
 
 
 class LogTextboxTarget(LogTarget):
     def __init__(self, client: 'SpoofyClientApp'):
         self.client: 'SpoofyClientApp' = client
 
-    def process(self, message):
-        # Filter out log tags from message
-        with self.client.gui_update_lock:
-            if m := LOG_MSG_FORMAT.match(message):
-                evt = LogEvent(msg=m.group(1))
-            else:
-                evt = LogEvent(msg=message)
-            wx.PostEvent(self.client, evt)
+    def process(self, line: LibrespotLine):
+        # Show the message without its log tag, posting events is thread-safe
+        wx.PostEvent(self.client, LogEvent(msg=line.message))
 
 
 class LibrespotOutputProcessorTarget(LogTarget):
-    AUTH_ERROR_RE = re.compile(r"\[.*?] Could not connect to server: Authentication failed with error: (.*)")
-    AUTH_SUCCESS_RE = re.compile(r"\[.*?] Authenticated as \"(.*)\" !")
-
     def __init__(self, client: 'SpoofyClientApp'):
         self.client: 'SpoofyClientApp' = client
 
-    def process(self, message):
+    def process(self, line: LibrespotLine):
         # Detect errors in librespot output
-        with self.client.gui_update_lock:
-            if m := self.AUTH_ERROR_RE.match(message):
-                auth_error = SpotifyEvent(evt_type="auth_error", err_msg=m.group(1))
-                wx.PostEvent(self.client, auth_error)
-
-            elif m := self.AUTH_SUCCESS_RE.match(message):
-                auth_success = SpotifyEvent(evt_type="auth_success", username=m.group(1))
-                wx.PostEvent(self.client, auth_success)
+        event = line.event
+        if isinstance(event, AuthFailed):
+            wx.PostEvent(self.client, SpotifyEvent(evt_type="auth_error", err_msg=event.error))
+        elif isinstance(event, AuthSucceeded):
+            wx.PostEvent(self.client, SpotifyEvent(evt_type="auth_success", username=event.username))
+        elif isinstance(event, SessionLost):
+            wx.PostEvent(self.client, SpotifyEvent(evt_type="session_lost", reason=event.reason))
 
 
 class SpoofyTaskBarIcon(wx.adv.TaskBarIcon):
@@ -82,6 +90,43 @@ class SpoofyTaskBarIcon(wx.adv.TaskBarIcon):
         self.frame.on_taskbar_restore()
 
 
+class MainLoopStallMonitor:
+    """
+    Measures how long the wx main loop is blocked, by checking how late a periodic timer fires.
+
+    `hook` is called with the stall duration and the longest stall so far (in seconds) for every stall longer
+    than `threshold`.
+    """
+
+    def __init__(self, app: wx.App, interval_ms: int = 50, threshold: float = 0.1, hook=None):
+        self.interval_ms: int = interval_ms
+        self.threshold: float = threshold
+        self.hook = hook
+        self.longest: float = 0.0
+        self.last_tick: float = time.monotonic()
+        self.timer = wx.Timer(app)
+        app.Bind(wx.EVT_TIMER, self.on_tick, self.timer)
+
+    def start(self):
+        self.last_tick = time.monotonic()
+        self.timer.Start(self.interval_ms)
+
+    def stop(self):
+        self.timer.Stop()
+
+    def on_tick(self, event):
+        now = time.monotonic()
+        stall = now - self.last_tick - self.interval_ms / 1000
+        self.last_tick = now
+        self.longest = max(self.longest, stall)
+        if stall > self.threshold and self.hook is not None:
+            self.hook(stall, self.longest)
+
+
+def report_stall(stall: float, longest: float):
+    print(f"Main loop was blocked for {stall * 1000:.0f} ms (longest: {longest * 1000:.0f} ms)")
+
+
 class SpoofyClientApp(wx.App):
     def OnInit(self):
         self.gui_update_lock = RLock()
@@ -91,6 +136,23 @@ class SpoofyClientApp(wx.App):
         self.login_window.Show()
         self.taskbar_icon = None
         self.spotify_client = None
+        self.metrics_server = None
+
+        # Network and process work runs here, results come back as events. A single worker keeps the tasks in
+        # order, so e.g. logging back in always happens after the previous session has been stopped.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="SpoofyTask")
+        self.stall_monitor = MainLoopStallMonitor(self, hook=report_stall)
+        self.stall_monitor.start()
+
+        # Log lines are collected in the model and added to the log view in batches
+        self.log_model = LogModel(max_lines=LOG_MAX_LINES)
+        self.log_lines_shown = 0
+        self.log_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.flush_log, self.log_timer)
+        self.log_timer.Start(LOG_FLUSH_INTERVAL_MS)
+        self.stream_status_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.update_stream_status, self.stream_status_timer)
+        self.stream_status_timer.Start(STREAM_STATUS_INTERVAL_MS)
 
         # Status variables
         self.minimized = False
@@ -110,6 +172,9 @@ class SpoofyClientApp(wx.App):
             # Link Bot Event handler
             self.Bind(EVT_BOT, self.on_bot_event)
 
+            # Link latest version check handler
+            self.Bind(EVT_VERSION, self.on_version_event)
+
             # Link on window close handlers
             self.login_window.Bind(wx.EVT_CLOSE, self.on_login_window_close)
             self.status_window.Bind(wx.EVT_CLOSE, self.on_status_window_close)
@@ -130,7 +195,6 @@ class SpoofyClientApp(wx.App):
             self.about_window.close_button.Bind(wx.EVT_BUTTON, self.on_about_close_clicked)
 
             # Update version label in login view and about view, and github urls
-            from main import CLIENT_VERSION, GITHUB_LINK_BOT, GITHUB_LINK_CLIENT
             self.login_window.title.SetLabel(f"Spoofy Client {CLIENT_VERSION}")
             self.about_window.title.SetLabel(f"Spoofy Client {CLIENT_VERSION}")
             self.about_window.label_version_current.SetLabel(f"Current version: {CLIENT_VERSION}")
@@ -139,14 +203,65 @@ class SpoofyClientApp(wx.App):
             self.about_window.link_bot.SetLabel(GITHUB_LINK_BOT)
             self.about_window.link_bot.SetURL(GITHUB_LINK_BOT)
 
-            return True
+        self.executor.submit(self.preload_modules)
+        self.executor.submit(self.start_metrics_server)
+        return True
+
+    @staticmethod
+    def preload_modules():
+        # Runs on the task executor, so the first login does not have to wait for these imports
+        for name in PRELOAD_MODULES:
+            importlib.import_module(name)
+
+    def start_metrics_server(self):
+        # Runs on the task executor, serves the stream metrics on localhost next to the status window
+        from engine import Engine
+        from metrics_server import MetricsServer
+        server = MetricsServer()
+        try:
+            Engine.get_instance().run(server.start())
+        except OSError as e:
+            print(f"Could not serve stream metrics on port {server.port}: {e}")
+            return
+        self.metrics_server = server
+        print(f"Serving stream metrics on http://{server.host}:{server.port}/metrics")
 
     def log(self, message):
+        self.log_model.append(message)
+
+    def flush_log(self, event=None):
+        # Add the new lines to the top of the log view (newest first), and cut off what no longer fits
+        lines, overflow = self.log_model.take_pending()
+        if not lines:
+            return
+        with self.gui_update_lock:
+            log_text = self.status_window.log_text
+            log_text.Freeze()
+            try:
+                if overflow:
+                    log_text.SetValue("\n".join(reversed(lines)))
+                    self.log_lines_shown = len(lines)
+                else:
+                    text = "\n".join(reversed(lines))
+                    if self.log_lines_shown:
+                        text += "\n"
+                    log_text.SetInsertionPoint(0)
+                    log_text.WriteText(text)
+                    self.log_lines_shown += len(lines)
+                    if self.log_lines_shown > LOG_MAX_LINES:
+                        # Remove everything from the end of the last line that is kept
+                        end_of_kept = log_text.XYToPosition(0, LOG_MAX_LINES) - 1
+                        log_text.Remove(end_of_kept, log_text.GetLastPosition())
+                        self.log_lines_shown = LOG_MAX_LINES
+                log_text.SetInsertionPoint(0)
+            finally:
+                log_text.Thaw()
+
+    def clear_log(self):
         with self.gui_update_lock:
-            cur_log = self.status_window.log_text.GetValue().split("\n")
-            new_log = [message] + cur_log[:1000]
-            self.status_window.log_text.SetValue("\n".join(new_log))
-            self.status_window.log_text.SetInsertionPoint(0)
+            self.log_model.clear()
+            self.log_lines_shown = 0
+            self.status_window.log_text.Clear()
 
     def update_spotify_status(self, state, msg):
         with self.gui_update_lock:
@@ -158,24 +273,93 @@ class SpoofyClientApp(wx.App):
             self.status_window.status_bot_icon.SetBitmap(wx.Bitmap(resource_path(f"res/{state}.png"), wx.BITMAP_TYPE_ANY))
             self.status_window.status_bot_label.SetLabel(f"Spoofy Bot: {msg}")
 
-    def check_latest_version(self):
-        from main import GITHUB_LATEST_RELEASE_API_URL
+    def update_stream_status(self, event=None):
+        # Reading the metrics only takes a few locks and ioctls, so this is fine on the main loop
+        client = self.spotify_client
+        if client is None or client.metrics.sock is None:
+            msg = "Not streaming"
+        else:
+            msg = client.metrics.summary()
         with self.gui_update_lock:
-            res = requests.get(GITHUB_LATEST_RELEASE_API_URL)
-            if res.status_code == 200:
-                data = res.json()
-                if 'tag_name' in data:
-                    self.about_window.label_version_latest.SetLabel(f"Latest version: {data['tag_name']}")
-                else:
-                    self.about_window.label_version_latest.SetLabel(f"Latest version: Unknown (error checking)")
-            else:
-                self.about_window.label_version_latest.SetLabel(f"Latest version: Unknown (error checking)")
+            self.status_window.status_stream_label.SetLabel(f"Stream: {msg}")
+
+    def run_in_background(self, event_cls, evt_type, func, *args, **event_kwargs):
+        # Run func(*args) on the task executor, and post event_cls(evt_type, result, error) when it is done
+        def done(future):
+            try:
+                result, error = future.result(), None
+            except Exception as e:
+                result, error = None, e
+            wx.PostEvent(self, event_cls(evt_type=evt_type, result=result, error=error, **event_kwargs))
+
+        self.executor.submit(func, *args).add_done_callback(done)
+
+    def fetch_latest_version(self):
+        # Runs on the task executor
+        import requests
+        res = requests.get(GITHUB_LATEST_RELEASE_API_URL, timeout=10)
+        if res.status_code == 200:
+            return res.json().get('tag_name')
+        return None
 
-    def clear_spotify_client(self):
-        if self.spotify_client is not None:
-            self.spotify_client.stop()
-            self.spotify_client.wait()
-            self.spotify_client = None
+    def check_latest_version(self):
+        with self.gui_update_lock:
+            self.about_window.label_version_latest.SetLabel(f"Latest version: Checking...")
+            self.run_in_background(VersionEvent, "latest_version", self.fetch_latest_version)
+
+    def start_spotify_client(self, username, password, bitrate):
+        # Runs on the task executor
+        from spotify_controller import SpotifyController
+        client = SpotifyController.create(self, username, password, bitrate)
+        client.log_targets.append(LogTextboxTarget(client=self))
+        client.log_targets.append(LibrespotOutputProcessorTarget(client=self))
+        if client.reused:
+            # Librespot from the warm pool is already logged in, it will not log it again
+            wx.PostEvent(self, SpotifyEvent(evt_type="auth_success", username=username))
+        return client, client.check_req(username)
+
+    @staticmethod
+    def spotify_instance() -> Optional['SpotifyController']:
+        # Nothing can be running before spotify_controller is loaded, so don't import it on the main loop for this
+        module = sys.modules.get("spotify_controller")
+        return module.SpotifyController.get_instance() if module is not None else None
+
+    @staticmethod
+    def stop_spotify_client(client: Optional['SpotifyController'], keep_warm: bool):
+        # Runs on the task executor
+        if keep_warm:
+            if client is not None:
+                client.release()
+            return
+        # Quitting, stop this session and the warm ones together
+        controllers = [client] if client is not None else []
+        if "librespot_pool" in sys.modules:
+            controllers += sys.modules["librespot_pool"].LibrespotPool.get_instance().take_all()
+        if controllers:
+            from spotify_controller import stop_controllers
+            stop_controllers(controllers)
+
+    def clear_spotify_client(self, then=None, keep_warm: bool = True):
+        # Stops the client in the background, `then` is called on the main loop once it has stopped. With
+        # keep_warm, a logged in librespot is kept in the pool for the next login.
+        client = self.spotify_client if self.spotify_client is not None else self.spotify_instance()
+        self.spotify_client = None
+        if client is None and keep_warm:
+            if then is not None:
+                then()
+            return
+        self.run_in_background(SpotifyEvent, "stopped", self.stop_spotify_client, client, keep_warm, then=then)
+
+    def quit(self):
+        print(f"Quitting, longest main loop stall: {self.stall_monitor.longest * 1000:.0f} ms")
+        self.stall_monitor.stop()
+        self.log_timer.Stop()
+        self.stream_status_timer.Stop()
+        if self.metrics_server is not None:
+            from engine import Engine
+            Engine.get_instance().submit(self.metrics_server.stop())
+        self.executor.shutdown(wait=False)
+        self.ExitMainLoop()
 
     def on_login_clicked(self, event):
         with self.gui_update_lock:
@@ -190,36 +374,49 @@ class SpoofyClientApp(wx.App):
             # Setup spotify connection
             print("Starting spotify client...")
             self.log("Starting spotify client...")
-            self.spotify_client = SpotifyController.create(self, self.username, self.password, self.bitrate)
-            self.spotify_client.log_targets.append(LogTextboxTarget(client=self))
-            self.spotify_client.log_targets.append(LibrespotOutputProcessorTarget(client=self))
-            result, msg, short_msg = self.spotify_client.check_req(self.username)
-
-            if not result:
-                if not msg:
-                    print("Not ok to connect, no linked account on Discord side.")
-                    self.update_bot_status("058-error", "Not ready, no linked account!")
-                    dialog = wx.MessageDialog(None, "Cannot log in. You have no linked account on the Discord side of the bot. "
-                                                    "Please link your account to the bot first by using the 's!link' command.",
-                                              "Error", wx.CLOSE | wx.ICON_ERROR)
-                    dialog.ShowModal()
-                    self.clear_spotify_client()
-                    self.login_window.login_button.Enable()
-                    return
-                else:
-                    print("Connection error with bot backend.")
-                    self.update_bot_status("058-error", short_msg)
-                    dialog = wx.MessageDialog(None, f"Cannot connect to the bot. {msg}\nPlease try again later.",
-                                              "Error", wx.CLOSE | wx.ICON_ERROR)
-                    dialog.ShowModal()
-                    self.clear_spotify_client()
-                    self.login_window.login_button.Enable()
-                    return
-
+            self.run_in_background(SpotifyEvent, "started", self.start_spotify_client,
+                                   self.username, self.password, self.bitrate)
+
+    def on_spotify_client_started(self, event: SpotifyEvent):
+        if event.error is not None:
+            print(f"Could not start spotify client: {event.error}")
+            self.update_spotify_status("058-error", "Could not start Spotify client.")
+            dialog = wx.MessageDialog(None, f"Cannot start the Spotify client. {event.error}",
+                                      "Error", wx.CLOSE | wx.ICON_ERROR)
+            dialog.ShowModal()
+            self.login_window.login_button.Enable()
+            return
+
+        client, (result, msg, short_msg) = event.result
+        if self.spotify_instance() is not client:
+            # Already stopped again, e.g. because authentication failed in the meantime
+            return
+        self.spotify_client = client
+
+        if not result:
+            if not msg:
+                print("Not ok to connect, no linked account on Discord side.")
+                self.update_bot_status("058-error", "Not ready, no linked account!")
+                dialog = wx.MessageDialog(None, "Cannot log in. You have no linked account on the Discord side of the bot. "
+                                                "Please link your account to the bot first by using the 's!link' command.",
+                                          "Error", wx.CLOSE | wx.ICON_ERROR)
+                dialog.ShowModal()
+                self.clear_spotify_client()
+                self.login_window.login_button.Enable()
+                return
+            else:
+                print("Connection error with bot backend.")
+                self.update_bot_status("058-error", short_msg)
+                dialog = wx.MessageDialog(None, f"Cannot connect to the bot. {msg}\nPlease try again later.",
+                                          "Error", wx.CLOSE | wx.ICON_ERROR)
+                dialog.ShowModal()
+                self.clear_spotify_client()
+                self.login_window.login_button.Enable()
+                return
 
-            print("Connected to bot, linked account found. OK to connect!")
-            self.log("Connected to bot, linked account found. OK to connect!")
-            self.update_bot_status("061-info", "Ready, waiting for link code")
+        print("Connected to bot, linked account found. OK to connect!")
+        self.log("Connected to bot, linked account found. OK to connect!")
+        self.update_bot_status("061-info", "Ready, waiting for link code")
 
     def on_login_window_key_up(self, event):
         # If the enter key was pressed in the login dialog, while the focus is in one of the text boxes or the bitrate,
@@ -257,6 +454,13 @@ class SpoofyClientApp(wx.App):
             self.check_latest_version()
             self.about_window.Show()
 
+    def on_version_event(self, event: VersionEvent):
+        with self.gui_update_lock:
+            if event.error is None and event.result:
+                self.about_window.label_version_latest.SetLabel(f"Latest version: {event.result}")
+            else:
+                self.about_window.label_version_latest.SetLabel(f"Latest version: Unknown (error checking)")
+
     def on_about_close_clicked(self, event):
         with self.gui_update_lock:
             self.about_window.Hide()
@@ -276,7 +480,7 @@ class SpoofyClientApp(wx.App):
             self.status_window.connect_button.SetLabel("Connect")
             self.update_spotify_status("060-warning", "Unknown")
             self.update_bot_status("060-warning", "Unknown")
-            self.status_window.log_text.SetValue("")
+            self.clear_log()
 
     def on_minimize_clicked(self, event):
         with self.gui_update_lock:
@@ -304,26 +508,11 @@ class SpoofyClientApp(wx.App):
                 self.log("Connecting to the bot...")
                 link_code = self.status_window.link_code.GetValue()
                 if link_code and self.spotify_client:
-                    done, msg_or_addr, short_msg_or_port = self.spotify_client.connect_req(self.username, link_code)
-                    if not done:
-                        self.update_bot_status("058-error", f"{short_msg_or_port}")
-                        self.log(f"[ERROR] {msg_or_addr}")
-                        self.status_window.connect_button.Enable()
-                        return
-
-                    address, port = msg_or_addr, short_msg_or_port
-                    self.spotify_client.address, self.spotify_client.port = address, port
-                    self.spotify_client.setup_output_thread()
-                    res, msg, short_msg = self.spotify_client.start_req(link_code)
-                    if res:
-                        self.status_window.connect_button.SetLabel("Disconnect")
-                        self.update_bot_status("059-success", f"Connected and streaming!")
-                        self.log("Connected and streaming! You can now start using the bot.")
-                    else:
-                        self.update_bot_status("058-error", short_msg)
-                        self.log(f"[ERROR] Error during connection. {msg}")
-                        self.spotify_client.disconnect()
-
+                    # The button is enabled again once the handshake is done
+                    from handshake import Handshake
+                    self.run_in_background(BotEvent, "connected", Handshake(self.spotify_client).run,
+                                           self.username, link_code)
+                    return
                 elif not link_code:
                     self.update_bot_status("061-info", f"Ready, waiting for link code")
                     self.log(f"[ERROR] No link code given.")
@@ -334,30 +523,37 @@ class SpoofyClientApp(wx.App):
             elif label == "Disconnect":
                 self.log("Disconnecting from the bot...")
                 self.update_bot_status("061-info", f"Disconnecting...")
-                self.spotify_client.disconnect()
-                self.status_window.connect_button.SetLabel("Connect")
-                self.log("Disconnected.")
-                self.update_bot_status("060-warning", f"Disconnected.")
+                self.disconnect_spotify_client()
+                return
 
             self.status_window.connect_button.Enable()
 
+    def disconnect_spotify_client(self):
+        if self.spotify_client is not None:
+            self.run_in_background(BotEvent, "disconnected", self.spotify_client.disconnect)
+        else:
+            wx.PostEvent(self, BotEvent(evt_type="disconnected", result=None, error=None))
+
     def on_login_window_close(self, event):
         with self.gui_update_lock:
-            print("Quitting")
-            if self.spotify_client is not None:
-                self.spotify_client.stop()
-            self.ExitMainLoop()
+            self.login_window.Hide()
+            self.clear_spotify_client(then=self.quit, keep_warm=False)
 
     def on_status_window_close(self, event):
         with self.gui_update_lock:
-            self.clear_spotify_client()
-            print("Quitting")
-            self.ExitMainLoop()
+            self.status_window.Hide()
+            self.clear_spotify_client(then=self.quit, keep_warm=False)
 
     def on_bot_disconnect(self):
         disconnect_evt = BotEvent(evt_type="disconnect")
         wx.PostEvent(self, disconnect_evt)
 
+    def on_bot_reconnecting(self, attempt: int):
+        wx.PostEvent(self, BotEvent(evt_type="reconnecting", attempt=attempt))
+
+    def on_bot_reconnected(self, recovery: float):
+        wx.PostEvent(self, BotEvent(evt_type="reconnected", recovery=recovery))
+
     # Handle incoming log message events
     def on_log_event(self, event: LogEvent):
         with self.gui_update_lock:
@@ -379,6 +575,16 @@ class SpoofyClientApp(wx.App):
                 dialog.ShowModal()
                 self.clear_spotify_client()
                 self.login_window.login_button.Enable()
+            elif event.evt_type == "started":
+                self.on_spotify_client_started(event)
+            elif event.evt_type == "stopped":
+                if event.error is not None:
+                    print(f"Error while stopping spotify client: {event.error}")
+                if event.then is not None:
+                    event.then()
+            elif event.evt_type == "session_lost":
+                print(f"Spotify session lost: {event.reason}")
+                self.update_spotify_status("058-error", "Connection to Spotify lost. Please log out and log back in.")
             elif event.evt_type == "auth_success":
                 print(f"Spotify auth success, authenticated as {event.username}")
                 # Set spotify status to green, add username to message.
@@ -394,8 +600,26 @@ class SpoofyClientApp(wx.App):
             if event.evt_type == "disconnect":
                 self.log("Bot has disconnected from voice, or there are connection problems...")
                 self.update_bot_status("061-info", f"Disconnecting...")
-                if self.spotify_client is not None:
-                    self.spotify_client.disconnect()
+                self.status_window.connect_button.Disable()
+                self.disconnect_spotify_client()
+            elif event.evt_type == "reconnecting":
+                self.log(f"Lost the connection to the bot, reconnecting (attempt {event.attempt})...")
+                self.update_bot_status("061-info", f"Reconnecting...")
+            elif event.evt_type == "reconnected":
+                self.log(f"Reconnected to the bot, audio resumed after {event.recovery:.1f} seconds.")
+                self.update_bot_status("059-success", f"Connected and streaming!")
+            elif event.evt_type == "disconnected":
                 self.status_window.connect_button.SetLabel("Connect")
                 self.log("Disconnected.")
                 self.update_bot_status("060-warning", f"Disconnected.")
+                self.status_window.connect_button.Enable()
+            elif event.evt_type == "connected":
+                res, msg, short_msg = event.result if event.error is None else (False, str(event.error), "Connection error.")
+                if res:
+                    self.status_window.connect_button.SetLabel("Disconnect")
+                    self.update_bot_status("059-success", f"Connected and streaming!")
+                    self.log("Connected and streaming! You can now start using the bot.")
+                else:
+                    self.update_bot_status("058-error", short_msg)
+                    self.log(f"[ERROR] Error during connection. {msg}")
+                self.status_window.connect_button.Enable()
@@ -85,6 +85,7 @@ class SpoofyStatusDialog(wx.Dialog):
         self.status_spotify_label = wx.StaticText(self, wx.ID_ANY, "Spotify: Unknown")
         self.status_bot_icon = wx.StaticBitmap(self, wx.ID_ANY, wx.Bitmap(resource_path("res/060-warning.png"), wx.BITMAP_TYPE_ANY))
         self.status_bot_label = wx.StaticText(self, wx.ID_ANY, "Spoofy Bot: Unknown")
+        self.status_stream_label = wx.StaticText(self, wx.ID_ANY, "Stream: Not streaming")
         self.log_text = wx.TextCtrl(self, wx.ID_ANY, "", style=wx.TE_MULTILINE | wx.TE_PROCESS_ENTER | wx.TE_READONLY | wx.TE_WORDWRAP)
 
         self.__set_properties()
@@ -131,6 +132,7 @@ class SpoofyStatusDialog(wx.Dialog):
         status_grid.Add(self.status_bot_label, 0, wx.ALIGN_CENTER_VERTICAL, 0)
         status_grid.AddGrowableCol(1)
         sizer_status.Add(status_grid, 0, wx.BOTTOM | wx.EXPAND | wx.LEFT | wx.RIGHT, 8)
+        sizer_status.Add(self.status_stream_label, 0, wx.BOTTOM | wx.EXPAND | wx.LEFT | wx.RIGHT, 8)
         sizer_container.Add(sizer_status, 0, wx.EXPAND, 0)
         label_log = wx.StaticText(self, wx.ID_ANY, "Log output (most recent on top)")
         label_log.SetFont(wx.Font(11, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD, 0, ""))
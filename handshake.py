@@ -0,0 +1,63 @@
+import time
+from concurrent.futures import CancelledError, TimeoutError
+from typing import Tuple
+
+from spotify_controller import SpotifyController, StreamTimings
+
+
+class Handshake:
+    """
+    Connects a running SpotifyController to the bot for a link code.
+
+    The connect request has to finish first, since it returns the address of the bot. After that, the TCP
+    connection to the bot is opened on the engine while the start request runs on the calling thread, so their
+    round trips overlap instead of adding up. The timings of every phase end up in `timings`, the time to first
+    audio is filled in by the stream as soon as the first byte has been sent.
+
+    With `fanout`, the bot is added to the bots the session already streams to instead of replacing them.
+    """
+
+    def __init__(self, controller: SpotifyController, connect_timeout: float = 10.0, fanout: bool = False):
+        self.controller: SpotifyController = controller
+        self.connect_timeout: float = connect_timeout
+        self.fanout: bool = fanout
+        self.timings: StreamTimings = StreamTimings()
+
+    def run(self, username: str, link_code: str) -> Tuple[bool, str, str]:
+        self.timings = timings = StreamTimings()
+        done, msg_or_addr, short_msg_or_port = self.controller.connect_req(username, link_code)
+        timings.connect_req_at = time.monotonic()
+        if not done:
+            return False, msg_or_addr, short_msg_or_port
+
+        # Open the connection to the bot in the background, and send the start request in the meantime
+        address, port = msg_or_addr, short_msg_or_port
+        if self.fanout:
+            self.controller.add_output(address, port, link_code, timings)
+        else:
+            self.controller.address, self.controller.port = address, port
+            self.controller.link_code = link_code
+            self.controller.setup_output(timings)
+        res, msg, short_msg = self.controller.start_req(link_code)
+        timings.start_req_at = time.monotonic()
+        if not res:
+            self.disconnect(address, port)
+            return False, msg, short_msg
+
+        try:
+            timings.connected.result(timeout=self.connect_timeout)
+        except TimeoutError:
+            self.disconnect(address, port)
+            return False, "Timed out connecting to the bot.", "Connection error."
+        except (OSError, CancelledError) as e:
+            self.disconnect(address, port)
+            return False, f"Could not connect to the bot: {e}", "Connection error."
+
+        print(f"Handshake done, {timings}")
+        return True, "", ""
+
+    def disconnect(self, address: str, port: int):
+        if self.fanout:
+            self.controller.remove_output(address, port)
+        else:
+            self.controller.disconnect()
@@ -0,0 +1,131 @@
+from threading import Condition
+from typing import Optional
+
+# What to do when audio arrives and the buffer is full
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+POLICIES = (DROP_OLDEST, BLOCK)
+
+# Bytes per PCM frame (16 bit stereo), drops always happen on a frame boundary
+FRAME_SIZE = 4
+
+
+class JitterBuffer:
+    """
+    Fixed-size ring buffer that sits between the librespot pipe and the bot socket.
+
+    The capacity is derived from the target latency, so it bounds how much audio can be held back while the
+    connection to the bot is congested. When the buffer is full, new audio either replaces the oldest audio
+    (DROP_OLDEST) or the writer has to wait until there is room again (BLOCK). The buffer can be used from
+    threads (`write` and `read_into` block when needed) or from an event loop (`writable_view`/`commit` and
+    `read_into` never block).
+    """
+
+    def __init__(self, target_ms: int, byte_rate: int, policy: str = DROP_OLDEST):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown jitter buffer policy: '{policy}'")
+        capacity = (byte_rate * target_ms // 1000) // FRAME_SIZE * FRAME_SIZE
+        if capacity <= 0:
+            raise ValueError("Jitter buffer target latency is too small.")
+        self.target_ms: int = target_ms
+        self.byte_rate: int = byte_rate
+        self.policy: str = policy
+        self.capacity: int = capacity
+        self.buffer: bytearray = bytearray(capacity)
+        self.view: memoryview = memoryview(self.buffer)
+        self.read_pos: int = 0
+        self.depth: int = 0
+        self.closed: bool = False
+        self.underruns: int = 0
+        self.overruns: int = 0
+        self.dropped_bytes: int = 0
+        self.cond: Condition = Condition()
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.depth
+
+    @property
+    def depth_ms(self) -> float:
+        return self.depth * 1000 / self.byte_rate
+
+    def close(self):
+        # Wake up anyone waiting on the buffer
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def make_room(self, amount: int) -> int:
+        # Drop the oldest audio so `amount` bytes fit, returns the number of bytes dropped
+        with self.cond:
+            missing = min(amount, self.capacity) - self.free
+            if missing <= 0:
+                return 0
+            missing = -(-missing // FRAME_SIZE) * FRAME_SIZE
+            self.read_pos = (self.read_pos + missing) % self.capacity
+            self.depth -= missing
+            self.overruns += 1
+            self.dropped_bytes += missing
+            return missing
+
+    def writable_view(self, amount: int) -> memoryview:
+        # Contiguous free region of at most `amount` bytes, fill it and then call commit()
+        with self.cond:
+            write_pos = (self.read_pos + self.depth) % self.capacity
+            size = min(amount, self.free, self.capacity - write_pos)
+            return self.view[write_pos:write_pos + size]
+
+    def commit(self, amount: int):
+        with self.cond:
+            self.depth += amount
+            self.cond.notify_all()
+
+    def write(self, data, timeout: Optional[float] = None) -> int:
+        # Write all of `data`, dropping old audio or waiting for room depending on the policy
+        data = memoryview(data)
+        written = 0
+        with self.cond:
+            while written < len(data) and not self.closed:
+                if self.free == 0:
+                    if self.policy == DROP_OLDEST:
+                        self.make_room(len(data) - written)
+                    else:
+                        self.overruns += 1
+                        if not self.cond.wait_for(lambda: self.free > 0 or self.closed, timeout):
+                            break
+                        continue
+                view = self.writable_view(len(data) - written)
+                view[:] = data[written:written + len(view)]
+                self.commit(len(view))
+                written += len(view)
+        return written
+
+    def read_into(self, out: memoryview, timeout: Optional[float] = 0) -> int:
+        # Copy up to len(out) bytes into `out`. With a timeout other than 0, wait for data to arrive first.
+        with self.cond:
+            if self.depth < len(out):
+                if timeout != 0:
+                    self.cond.wait_for(lambda: self.depth >= len(out) or self.closed, timeout)
+                if self.depth < len(out):
+                    self.underruns += 1
+            amount = min(len(out), self.depth)
+            first = min(amount, self.capacity - self.read_pos)
+            out[:first] = self.view[self.read_pos:self.read_pos + first]
+            out[first:amount] = self.view[:amount - first]
+            self.read_pos = (self.read_pos + amount) % self.capacity
+            self.depth -= amount
+            self.cond.notify_all()
+            return amount
+
+    def stats(self) -> dict:
+        return {
+            "depth_ms": self.depth_ms,
+            "target_ms": self.target_ms,
+            "underruns": self.underruns,
+            "overruns": self.overruns,
+            "dropped_bytes": self.dropped_bytes,
+        }
+
+    def __str__(self):
+        return f"jitter buffer {self.depth_ms:.0f}/{self.target_ms} ms, {self.underruns} underruns, " \
+               f"{self.overruns} overruns ({self.dropped_bytes} bytes dropped)"
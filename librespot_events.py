@@ -0,0 +1,96 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+# "[2021-03-01T21:14:02Z INFO  librespot_core::session] Authenticated as ..." (level and module are optional, so
+# lines in an unexpected format still get their tag stripped)
+LINE_RE = re.compile(r"\[(?:\S+ +(?P<level>[A-Z]+) +(?P<module>[^\]]+)|[^\]]*)] (?P<message>.*)")
+
+# All messages we care about in a single regex, `lastgroup` tells which alternative matched
+EVENT_RE = re.compile(
+    r"(?P<auth_failed>Could not connect to server: Authentication failed with error: (?P<error>.*))"
+    r"|(?P<auth_succeeded>Authenticated as \"(?P<username>.*)\" !)"
+    r"|(?P<track_changed>Loading <(?P<track>.*)> with Spotify URI <(?P<uri>[^>]*)>)"
+    r"|(?P<playback_changed>kMessageType(?P<command>Play|Pause)\b)"
+    r"|(?P<volume_changed>Volume set to (?P<volume>\d+))"
+    r"|(?P<session_lost>(?P<reason>Connection to server closed\.|Spirc shut down unexpectedly))"
+)
+
+
+@dataclass
+class AuthFailed:
+    __slots__ = ("error",)
+    error: str
+
+
+@dataclass
+class AuthSucceeded:
+    __slots__ = ("username",)
+    username: str
+
+
+@dataclass
+class TrackChanged:
+    __slots__ = ("name", "uri")
+    name: str
+    uri: str
+
+
+@dataclass
+class PlaybackChanged:
+    __slots__ = ("playing",)
+    playing: bool
+
+
+@dataclass
+class VolumeChanged:
+    __slots__ = ("volume",)
+    # Spotify volume, 0 - 65535
+    volume: int
+
+
+@dataclass
+class SessionLost:
+    __slots__ = ("reason",)
+    reason: str
+
+
+@dataclass
+class LibrespotLine:
+    """
+    A single line of librespot output, parsed once and shared by every log target.
+    """
+    __slots__ = ("raw", "level", "module", "message", "event")
+    raw: str
+    level: Optional[str]
+    module: Optional[str]
+    # The line without its "[timestamp level module]" tag
+    message: str
+    event: Optional[object]
+
+    def __str__(self):
+        return self.raw
+
+
+def _event(m: re.Match) -> object:
+    kind = m.lastgroup
+    if kind == "auth_failed":
+        return AuthFailed(m.group("error"))
+    if kind == "auth_succeeded":
+        return AuthSucceeded(m.group("username"))
+    if kind == "track_changed":
+        return TrackChanged(m.group("track"), m.group("uri"))
+    if kind == "playback_changed":
+        return PlaybackChanged(m.group("command") == "Play")
+    if kind == "volume_changed":
+        return VolumeChanged(int(m.group("volume")))
+    return SessionLost(m.group("reason"))
+
+
+def parse_line(raw: str) -> LibrespotLine:
+    if m := LINE_RE.match(raw):
+        level, module, message = m.group("level", "module", "message")
+    else:
+        level, module, message = None, None, raw
+    event = _event(m) if (m := EVENT_RE.match(message)) else None
+    return LibrespotLine(raw, level, module, message, event)
@@ -0,0 +1,251 @@
+import asyncio
+import hmac
+import os
+import time
+from concurrent.futures import Future, TimeoutError
+from threading import RLock
+from typing import Optional, List, Tuple, Callable, TYPE_CHECKING
+
+from engine import Engine
+from librespot_events import LibrespotLine, AuthFailed, AuthSucceeded, SessionLost
+from log_dispatch import LogTarget
+from spotify_controller import SpotifyController, StandardOutTarget, librespot_args, stop_controllers
+from utils import hash_password
+
+if TYPE_CHECKING:
+    from credential_cache import CredentialCache
+
+# Logged in librespot processes kept around after logging out, and how long they are kept
+MAX_IDLE = 2
+IDLE_TIMEOUT = 600.0
+# How often idle processes are checked
+CHECK_INTERVAL = 10.0
+# How long a warm process that is still logging in is waited for
+LOGIN_TIMEOUT = 15.0
+
+Key = Tuple[str, int]
+
+
+class HealthTarget(LogTarget):
+    def __init__(self, session: 'PooledSession'):
+        self.session: 'PooledSession' = session
+
+    def process(self, line: LibrespotLine):
+        event = line.event
+        if isinstance(event, AuthSucceeded):
+            self.session.set_logged_in(True)
+        elif isinstance(event, AuthFailed):
+            self.session.set_logged_in(False)
+        elif isinstance(event, SessionLost):
+            self.session.lost = True
+
+
+class PooledSession:
+    """
+    A librespot process owned by the pool, either handed out or waiting for the next login.
+    """
+
+    def __init__(self, controller: SpotifyController, username: str, password: Optional[str], bitrate: int):
+        self.controller: SpotifyController = controller
+        self.key: Key = (username, bitrate)
+        self.salt: bytes = os.urandom(16)
+        # None when it logged in from the credential cache without a password
+        self.password_hash: Optional[bytes] = hash_password(password, self.salt) if password is not None else None
+        # Resolved with True once librespot logged in, False if it failed to
+        self.logged_in: Future = Future()
+        self.lost: bool = False
+        self.idle_since: Optional[float] = None
+        self.health_target: HealthTarget = HealthTarget(self)
+        self.cache_target: Optional[LogTarget] = None
+
+    def set_logged_in(self, ok: bool):
+        if not self.logged_in.done():
+            self.logged_in.set_result(ok)
+
+    def matches(self, password: Optional[str]) -> bool:
+        if password is None or self.password_hash is None:
+            return password is None
+        return hmac.compare_digest(self.password_hash, hash_password(password, self.salt))
+
+    @property
+    def healthy(self) -> bool:
+        if self.lost or self.controller.process.returncode is not None:
+            return False
+        return not self.logged_in.done() or self.logged_in.result()
+
+
+class LibrespotPool:
+    """
+    Keeps logged in librespot processes warm, keyed by account and bitrate.
+
+    Logging out hands the process back instead of stopping it, so logging back in (or switching back to a bitrate
+    that was used before) skips librespot's login. Idle processes are stopped after `idle_timeout`, when there
+    are more than `max_idle`, or when they lost their Spotify session or exited.
+    """
+    _instance: Optional['LibrespotPool'] = None
+
+    def __init__(self, engine: Optional[Engine] = None, max_idle: int = MAX_IDLE, idle_timeout: float = IDLE_TIMEOUT,
+                 args_factory: Callable[..., List[str]] = librespot_args, cache: Optional['CredentialCache'] = None):
+        self.engine: Engine = engine if engine is not None else Engine.get_instance()
+        self.max_idle: int = max_idle
+        self.idle_timeout: float = idle_timeout
+        self.args_factory: Callable[..., List[str]] = args_factory
+        # Per-user librespot cache, None to always log in with the password
+        self.cache: Optional['CredentialCache'] = cache
+        self.login_timeout: float = LOGIN_TIMEOUT
+        self.idle: List[PooledSession] = []
+        self.lock: RLock = RLock()
+        self.check_handle: Optional[asyncio.TimerHandle] = None
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @classmethod
+    def get_instance(cls) -> 'LibrespotPool':
+        if cls._instance is None:
+            from credential_cache import CredentialCache
+            cls._instance = LibrespotPool(cache=CredentialCache.get_instance())
+        return cls._instance
+
+    def spawn(self, client, username: str, password: Optional[str], bitrate: int) -> PooledSession:
+        cache_target = None
+        if self.cache is not None:
+            args, cache_target = self.cache.librespot_args(username, password, bitrate, self.args_factory)
+        else:
+            args = self.args_factory(username, password, bitrate)
+        controller = SpotifyController.spawn(client, args, engine=self.engine, name=username)
+        if cache_target is not None:
+            controller.log_targets.append(cache_target)
+        controller.bitrate = bitrate
+        controller.pool = self
+        session = PooledSession(controller, username, password, bitrate)
+        session.cache_target = cache_target
+        controller.pooled = session
+        controller.log_targets.append(session.health_target)
+        return session
+
+    def take(self, username: str, password: Optional[str], bitrate: int) -> Optional[PooledSession]:
+        # Remove and return the idle process for this account and bitrate, if any
+        with self.lock:
+            for session in self.idle:
+                if session.key == (username, bitrate):
+                    self.idle.remove(session)
+                    break
+            else:
+                return None
+        if session.matches(password):
+            return session
+        # Started with another password, it is of no use anymore
+        session.controller.stop()
+        return None
+
+    def acquire(self, client, username: str, password: Optional[str], bitrate: int = 160) -> SpotifyController:
+        # A logged in process from the pool if there is one, `controller.reused` tells whether it was
+        session = self.take(username, password, bitrate)
+        if session is not None:
+            try:
+                ok = session.logged_in.result(timeout=self.login_timeout)
+            except TimeoutError:
+                ok = False
+            if ok and session.healthy:
+                self.hits += 1
+                controller = session.controller
+                controller.client = client
+                controller.reused = True
+                self.engine.run(discard_audio(controller))
+                print(f"Reusing warm librespot for {username} ({self.hits} hits, {self.misses} misses)")
+                return controller
+            session.controller.stop()
+
+        self.misses += 1
+        return self.spawn(client, username, password, bitrate).controller
+
+    def prewarm(self, username: str, password: str, bitrate: int = 160):
+        # Start logging in in the background, e.g. for the other bitrates of an account
+        with self.lock:
+            if any(s.key == (username, bitrate) for s in self.idle):
+                return
+        self.park(self.spawn(None, username, password, bitrate))
+
+    def release(self, controller: SpotifyController) -> bool:
+        # Takes the process back after a logout, False if it can not be reused and should be stopped
+        session: Optional[PooledSession] = getattr(controller, "pooled", None)
+        if session is None or not session.healthy or self.max_idle <= 0:
+            return False
+        controller.disconnect()
+        # Only keep our own log targets, the ones of the last client go with it
+        keep = [t for t in controller.log_targets
+                if isinstance(t, StandardOutTarget) or t is session.health_target or t is session.cache_target]
+        self.engine.run(remove_log_targets(controller, keep))
+        controller.client = None
+        self.park(session)
+        return True
+
+    def park(self, session: PooledSession):
+        session.idle_since = time.monotonic()
+        with self.lock:
+            self.idle.append(session)
+            evicted = self.idle[:-self.max_idle] if len(self.idle) > self.max_idle else []
+            self.idle = self.idle[len(evicted):]
+        for old in evicted:
+            print(f"Stopping idle librespot for {old.key[0]}, pool is full")
+        stop_controllers([old.controller for old in evicted])
+        self.engine.call_soon(self.schedule_check)
+
+    def schedule_check(self):
+        # Runs on the engine loop
+        if self.check_handle is None:
+            self.check_handle = asyncio.get_running_loop().call_later(CHECK_INTERVAL, self.on_check)
+
+    def on_check(self):
+        # Runs on the engine loop, stopping takes a while so it is done on the executor
+        self.check_handle = None
+        asyncio.get_running_loop().run_in_executor(None, self.check)
+
+    def check(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [s for s in self.idle if not s.healthy or now - s.idle_since > self.idle_timeout]
+            self.idle = [s for s in self.idle if s not in expired]
+            remaining = len(self.idle)
+        for session in expired:
+            reason = "timed out" if session.healthy else "not healthy"
+            print(f"Stopping idle librespot for {session.key[0]}, {reason}")
+        stop_controllers([session.controller for session in expired])
+        if remaining:
+            self.engine.call_soon(self.schedule_check)
+
+    def take_all(self) -> List[SpotifyController]:
+        # Empty the pool, the caller stops the processes
+        with self.lock:
+            idle, self.idle = self.idle, []
+        return [session.controller for session in idle]
+
+    def close(self):
+        # Stop every idle process, e.g. when quitting
+        stop_controllers(self.take_all())
+
+    def __len__(self):
+        return len(self.idle)
+
+
+async def remove_log_targets(controller: SpotifyController, keep: List):
+    for target in list(controller.log_targets):
+        if not any(target is k for k in keep):
+            controller.log_targets.remove(target)
+            if controller.log_dispatcher is not None:
+                controller.log_dispatcher.remove(target)
+
+
+async def discard_audio(controller: SpotifyController):
+    # Audio librespot wrote while the process was idle is stale, drop what is waiting in the pipe
+    if controller.stdout_fd is None:
+        return
+    os.set_blocking(controller.stdout_fd, False)
+    dropped = 0
+    try:
+        while data := os.read(controller.stdout_fd, 65536):
+            dropped += len(data)
+    except BlockingIOError:
+        pass
+    if dropped:
+        print(f"Dropped {dropped} bytes of stale audio")
@@ -0,0 +1,114 @@
+import asyncio
+from typing import Dict, List, Optional
+
+# What to do with a new message when a target's queue is full
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class LogTarget:
+    # Targets that may block (e.g. because they take a lock) are called off the engine loop
+    blocking: bool = False
+
+    def process(self, message):
+        pass
+
+
+class Delivery:
+    """
+    Bounded queue of messages for a single log target, emptied by its own task on the engine loop.
+
+    Targets that can block (`target.blocking`) are called on the loop's default executor, so they never hold
+    up the loop or the stderr reader.
+    """
+
+    def __init__(self, target, maxsize: int, policy: str):
+        self.target = target
+        self.policy: str = policy
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.delivered: int = 0
+        self.dropped: int = 0
+        self.task: asyncio.Task = asyncio.create_task(self.run())
+
+    async def put(self, message):
+        if not self.queue.full():
+            self.queue.put_nowait(message)
+        elif self.policy == BLOCK:
+            await self.queue.put(message)
+        elif self.policy == DROP_OLDEST:
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.queue.put_nowait(message)
+            self.dropped += 1
+        else:
+            self.dropped += 1
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        blocking = getattr(self.target, "blocking", False)
+        while True:
+            message = await self.queue.get()
+            try:
+                if blocking:
+                    await loop.run_in_executor(None, self.target.process, message)
+                else:
+                    self.target.process(message)
+                self.delivered += 1
+            except Exception as e:
+                print(f"Log target {self.target} failed: {e}")
+            finally:
+                self.queue.task_done()
+
+
+class LogDispatcher:
+    """
+    Fans log messages out to a list of targets, each with its own bounded queue and delivery task.
+
+    The list of targets is read on every dispatch, so targets can be added to it at any time.
+    """
+
+    def __init__(self, targets: List, maxsize: int = 1000, policy: str = DROP_OLDEST):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown log drop policy: '{policy}'")
+        self.targets: List = targets
+        self.maxsize: int = maxsize
+        self.policy: str = policy
+        self.deliveries: Dict[int, Delivery] = {}
+
+    def delivery(self, target) -> Delivery:
+        delivery = self.deliveries.get(id(target))
+        if delivery is None:
+            delivery = self.deliveries[id(target)] = Delivery(target, self.maxsize, self.policy)
+        return delivery
+
+    def remove(self, target):
+        # Stop delivering to a target that was taken out of the list, its queued messages are dropped
+        delivery = self.deliveries.pop(id(target), None)
+        if delivery is not None:
+            delivery.task.cancel()
+
+    async def dispatch(self, message):
+        for target in list(self.targets):
+            if target is not None:
+                await self.delivery(target).put(message)
+
+    async def close(self, timeout: Optional[float] = None):
+        # Deliver what is still queued (for at most `timeout` seconds), then stop the delivery tasks
+        deliveries = list(self.deliveries.values())
+        try:
+            await asyncio.wait_for(asyncio.gather(*(d.queue.join() for d in deliveries)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for delivery in deliveries:
+                delivery.task.cancel()
+            await asyncio.gather(*(d.task for d in deliveries), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {getattr(d.target, "name", type(d.target).__name__): {"delivered": d.delivered, "dropped": d.dropped}
+                for d in self.deliveries.values()}
+
+    def __str__(self):
+        return ", ".join(f"{name} {s['delivered']} delivered/{s['dropped']} dropped" for name, s in self.stats().items())
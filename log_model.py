@@ -0,0 +1,37 @@
+from collections import deque
+from threading import Lock
+from typing import Deque, List, Tuple
+
+
+class LogModel:
+    """
+    Bounded buffer of the log messages that have not been shown yet.
+
+    The view polls `take_pending` on a timer, so bursts of messages turn into a single update of the control. When
+    more than `max_lines` arrive in between, only the newest are kept and the view is rebuilt from them.
+    """
+
+    def __init__(self, max_lines: int = 1000):
+        self.max_lines: int = max_lines
+        self.pending: Deque[str] = deque(maxlen=max_lines)
+        self.dropped: int = 0
+        self.lock: Lock = Lock()
+
+    def append(self, message: str):
+        with self.lock:
+            if len(self.pending) == self.max_lines:
+                # The oldest pending message will never be shown
+                self.dropped += 1
+            self.pending.append(message)
+
+    def take_pending(self) -> Tuple[List[str], bool]:
+        # Returns the new messages (oldest first), and whether so many arrived that the view has to be rebuilt
+        with self.lock:
+            pending = list(self.pending)
+            overflow = len(self.pending) == self.max_lines
+            self.pending.clear()
+            return pending, overflow
+
+    def clear(self):
+        with self.lock:
+            self.pending.clear()
@@ -3,11 +3,15 @@
 block_cipher = None
 
 
+# The GUI imports these lazily after startup, list them so they are always bundled
 a = Analysis(['main.py'],
              pathex=['.'],
              binaries=[],
              datas=[('res', 'res'), ('libraries', 'libraries')],
-             hiddenimports=[],
+             hiddenimports=['handshake', 'spotify_controller', 'api_client', 'engine', 'relay', 'fanout', 'pacer',
+                            'jitter_buffer', 'stream_codec', 'stream_metrics', 'metrics', 'metrics_server', 'capture',
+                            'dsp', 'resampler', 'silence', 'librespot_pool', 'credential_cache', 'librespot_events',
+                            'log_dispatch', 'numpy'],
              hookspath=[],
              runtime_hooks=[],
              excludes=[],
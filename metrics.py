@@ -0,0 +1,84 @@
+import bisect
+import time
+from collections import deque
+from threading import Lock
+from typing import Tuple, List, Deque, Optional
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram (in seconds), cheap enough to update on every request or audio chunk.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets: Tuple[float, ...] = buckets
+        # One extra bucket for everything above the largest bound
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.count: int = 0
+        self.total: float = 0.0
+        self.lock: Lock = Lock()
+
+    def observe(self, seconds: float):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+
+    def percentile(self, p: float) -> float:
+        # Upper bound of the bucket the p-th percentile falls in
+        with self.lock:
+            if self.count == 0:
+                return 0.0
+            rank = p / 100 * self.count
+            seen = 0
+            for i, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return self.buckets[i] if i < len(self.buckets) else float("inf")
+            return float("inf")
+
+    def mean(self) -> float:
+        with self.lock:
+            return self.total / self.count if self.count else 0.0
+
+    def __str__(self):
+        return f"n={self.count} mean={self.mean() * 1000:.0f}ms p50<={self.percentile(50) * 1000:.0f}ms " \
+               f"p99<={self.percentile(99) * 1000:.0f}ms"
+
+    def snapshot(self) -> Tuple[Tuple[float, ...], List[int], int, float]:
+        # Bucket bounds, per-bucket counts, total count and sum, taken under the lock
+        with self.lock:
+            return self.buckets, list(self.counts), self.count, self.total
+
+
+class RateMeter:
+    """
+    Bytes per second over a sliding window.
+    """
+
+    def __init__(self, window: float = 5.0):
+        self.window: float = window
+        self.total: int = 0
+        self.samples: Deque[Tuple[float, int]] = deque()
+        self.lock: Lock = Lock()
+
+    def add(self, amount: int, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.total += amount
+            self.samples.append((now, self.total))
+            while self.samples and now - self.samples[0][0] > self.window:
+                self.samples.popleft()
+
+    def rate(self, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            while self.samples and now - self.samples[0][0] > self.window:
+                self.samples.popleft()
+            if not self.samples:
+                return 0.0
+            first_time, first_total = self.samples[0]
+            # The first sample's bytes were sent before the window started
+            elapsed = max(now - first_time, 1e-9)
+            return (self.total - first_total) / elapsed
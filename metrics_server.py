@@ -0,0 +1,46 @@
+import asyncio
+from typing import Callable, Optional
+
+from config import METRICS_HOST, METRICS_PORT
+from stream_metrics import render_prometheus
+
+
+class MetricsServer:
+    """
+    Minimal HTTP server on the engine loop that serves the stream metrics in Prometheus text format.
+
+    It only listens on localhost and answers every request with the current metrics.
+    """
+
+    def __init__(self, host: str = METRICS_HOST, port: int = METRICS_PORT,
+                 render: Callable[[], str] = render_prometheus):
+        self.host: str = host
+        self.port: int = port
+        self.render: Callable[[], str] = render
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # Read the request line and headers, the path does not matter
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            status = "200 OK" if request.startswith(b"GET ") else "405 Method Not Allowed"
+            body = self.render().encode("utf-8") if status == "200 OK" else b""
+            writer.write(f"HTTP/1.1 {status}\r\n"
+                         f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode("ascii") + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,82 @@
+import time
+from typing import Callable
+
+
+class Pacer:
+    """
+    Paces a byte stream against a monotonic clock.
+
+    Every byte that is sent is scheduled at `start + bytes_sent / byte_rate`, so time spent reading and sending
+    is absorbed by the schedule instead of being added on top of it. If the stream falls behind by more than
+    `max_burst` seconds (e.g. after a stall), the schedule is moved forward so at most `max_burst` seconds of
+    audio are sent as a catch-up burst.
+    """
+
+    def __init__(self, byte_rate: int, max_burst: float = 1.0, clock: Callable[[], float] = time.monotonic):
+        self.byte_rate: int = byte_rate
+        self.max_burst: float = max_burst
+        self.clock: Callable[[], float] = clock
+        self.started_at: float = 0.0
+        self.anchor: float = 0.0
+        self.scheduled_bytes: int = 0
+        self.bytes_sent: int = 0
+        self.resyncs: int = 0
+
+    def start(self, preroll: float = 0.0):
+        # `preroll` seconds worth of bytes are due right away
+        self.started_at = self.clock()
+        self.anchor = self.started_at - preroll
+        self.scheduled_bytes = 0
+        self.bytes_sent = 0
+        self.resyncs = 0
+
+    def _resync(self, now: float):
+        # Allow at most max_burst seconds worth of catch-up, drop the rest of the backlog from the schedule
+        if now - self.anchor - self.scheduled_bytes / self.byte_rate > self.max_burst:
+            self.anchor = now - self.max_burst
+            self.scheduled_bytes = 0
+            self.resyncs += 1
+
+    def delay(self, amount: int = 0) -> float:
+        # Seconds until the next `amount` bytes are due, zero or negative if they can be sent right away
+        now = self.clock()
+        self._resync(now)
+        return self.anchor + (self.scheduled_bytes + amount) / self.byte_rate - now
+
+    def budget(self) -> int:
+        # Number of bytes that are due to be sent right now
+        now = self.clock()
+        self._resync(now)
+        return max(0, int((now - self.anchor) * self.byte_rate) - self.scheduled_bytes)
+
+    def consume(self, amount: int):
+        self.scheduled_bytes += amount
+        self.bytes_sent += amount
+
+    def wait(self):
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    def throughput(self) -> float:
+        # Measured bytes per second since start
+        elapsed = self.clock() - self.started_at
+        if elapsed <= 0:
+            return 0.0
+        return self.bytes_sent / elapsed
+
+    def stats(self) -> dict:
+        throughput = self.throughput()
+        return {
+            "bytes_sent": self.bytes_sent,
+            "throughput": throughput,
+            "target": self.byte_rate,
+            "ratio": throughput / self.byte_rate if self.byte_rate else 0.0,
+            "drift": -self.delay(),
+            "resyncs": self.resyncs,
+        }
+
+    def __str__(self):
+        stats = self.stats()
+        return f"{stats['throughput']:.0f} B/s of {stats['target']} B/s target " \
+               f"({stats['ratio'] * 100:.1f}%), drift {stats['drift'] * 1000:.0f} ms, {stats['resyncs']} resyncs"
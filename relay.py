@@ -0,0 +1,313 @@
+import asyncio
+import os
+import socket
+import time
+from typing import Callable, Optional
+
+from capture import Capture
+from jitter_buffer import JitterBuffer, DROP_OLDEST, FRAME_SIZE
+from pacer import Pacer
+from stream_codec import Encoder, stream_format
+from stream_metrics import StreamMetrics
+
+# os.splice is only available on Linux (Python 3.10+)
+ZERO_COPY_SUPPORTED = hasattr(os, "splice")
+
+
+class Relay:
+    """
+    Moves audio from a pipe fd to a socket without blocking on either side.
+
+    The relay is driven from the outside: call `pump` whenever one of the fds it is interested in is ready (or
+    when its timeout expires), and afterwards check `want_read`, `want_write` and `timeout` to see what to wait
+    for next. When `os.splice` is available the data never enters user space, otherwise a single preallocated
+    buffer is reused and partial sends are resumed where they stopped.
+
+    With a jitter buffer, librespot is allowed to run ahead of the socket by the buffer's target latency, and
+    the relay keeps reading at real time while the socket is congested (dropping the oldest audio or pausing
+    librespot, depending on the buffer's policy).
+
+    With a capture, the PCM of every chunk as it was sent (after the encoder's DSP stage and resampler) is copied
+    to it once the chunk has been handed to the socket, so the copy happens while the relay waits for the next
+    chunk to be due instead of before sending.
+    """
+
+    def __init__(self, src_fd: int, sock: socket.socket, pacer: Pacer, chunk_size: int,
+                 zero_copy: Optional[bool] = None, jitter_buffer: Optional[JitterBuffer] = None,
+                 encoder: Optional[Encoder] = None, capture: Optional[Capture] = None):
+        self.src_fd: int = src_fd
+        self.sock: socket.socket = sock
+        self.pacer: Pacer = pacer
+        # A chunk can never be larger than what the jitter buffer holds
+        self.chunk_size: int = chunk_size if jitter_buffer is None else min(chunk_size, jitter_buffer.capacity)
+        self.jitter_buffer: Optional[JitterBuffer] = jitter_buffer
+        self.encoder: Optional[Encoder] = encoder
+        self.capture: Optional[Capture] = capture
+        # Zero-copy is not possible when the audio has to pass through the jitter buffer, the encoder or the capture
+        self.zero_copy: bool = (ZERO_COPY_SUPPORTED if zero_copy is None else zero_copy and ZERO_COPY_SUPPORTED) \
+            and jitter_buffer is None and encoder is None and capture is None
+        self.buffer: bytearray = bytearray(chunk_size)
+        self.view: memoryview = memoryview(self.buffer)
+        # What is left to send, either a part of `view` or the encoded packets, and how much audio that was
+        self.pending: memoryview = self.view
+        self.pending_start: int = 0
+        self.pending_end: int = 0
+        self.pending_audio: int = 0
+        # Audio the packets in the send buffer carry, silence the encoder holds back counts once its packet is sent
+        self.pending_counted: int = 0
+        # PCM of the chunk in the send buffer, for the capture
+        self.pending_pcm = b""
+        # When the chunk in the send buffer was read, for the send latency
+        self.pending_since: float = 0.0
+        # Position within the current frame of the spliced stream, and the rest of a frame that was only partly
+        # spliced to a socket that went away, which is skipped after a reconnect
+        self.spliced: int = 0
+        self.skip: int = 0
+        self.metrics: Optional[StreamMetrics] = None
+        self.read_pacer: Optional[Pacer] = None
+        if jitter_buffer is not None:
+            # Allows reading at real time (plus the buffer's worth of lead) when the buffer is full
+            self.read_pacer = Pacer(pacer.byte_rate, max_burst=jitter_buffer.target_ms / 1000, clock=pacer.clock)
+        # Called once, right after the first audio has been handed to the socket
+        self.on_first_send: Optional[Callable[[], None]] = None
+        self.src_eof: bool = False
+        self.starving: bool = False
+        self.done: bool = False
+        self.want_read: bool = True
+        self.want_write: bool = False
+        self.timeout: Optional[float] = None
+
+    def setup(self):
+        os.set_blocking(self.src_fd, False)
+        self.sock.setblocking(False)
+
+    def start(self):
+        # Send the first chunk right away instead of a chunk's worth of time later
+        self.pacer.start(preroll=self.chunk_size / self.pacer.byte_rate)
+        if self.read_pacer is not None:
+            self.read_pacer.start()
+
+    def replace_socket(self, sock: socket.socket, encoder: Optional[Encoder] = None):
+        # Continue on a new connection after the old one broke, call run_async again afterwards. `encoder`
+        # is what was negotiated for the new connection.
+        self.sock = sock
+        self.done = False
+        if self.encoder is not None or encoder is not None:
+            # Packets are encoded for a single stream, the new one starts from scratch
+            self.pending_start = self.pending_end = self.pending_audio = 0
+        self.encoder = encoder
+        if encoder is not None:
+            encoder.reset()
+            self.zero_copy = False
+        if self.capture is not None:
+            self.capture.reconnected()
+            self.capture.set_format(*stream_format(encoder))
+        # The bot starts a new stream, so never start it in the middle of a frame
+        self.pending_start -= self.pending_start % FRAME_SIZE
+        if self.pending_start == self.pending_end:
+            self.pending_start = self.pending_end = 0
+        self.skip = -self.spliced % FRAME_SIZE
+        self.spliced = 0
+
+    def _skip_partial_frame(self) -> bool:
+        # Returns False while the rest of the partial frame has not arrived yet
+        try:
+            data = os.read(self.src_fd, self.skip)
+        except BlockingIOError:
+            return False
+        if not data:
+            self.done = True
+            return False
+        self.skip -= len(data)
+        return self.skip == 0
+
+    def _first_send(self):
+        callback, self.on_first_send = self.on_first_send, None
+        if callback is not None:
+            callback()
+
+    def _set_pending(self, moved: int):
+        # The first `moved` bytes of `view` were just read, queue them (encoded if needed) for sending
+        if self.encoder is None:
+            self.pending, self.pending_end = self.view, moved
+            self.pending_pcm = self.view[:moved]
+            self.pending_counted = moved
+        else:
+            held = self.encoder.held
+            encoded = self.encoder.encode(self.view[:moved])
+            self.pending, self.pending_end = memoryview(encoded), len(encoded)
+            self.pending_pcm = self.encoder.processed
+            self.pending_counted = moved + held - self.encoder.held
+        self.pending_start = 0
+        self.pending_audio = moved
+        self.pending_since = time.monotonic()
+
+    def _send_pending(self) -> bool:
+        # Send whatever is left in the send buffer, returns False if the socket is full
+        while self.pending_start < self.pending_end:
+            try:
+                self.pending_start += self.sock.send(self.pending[self.pending_start:self.pending_end])
+            except BlockingIOError:
+                return False
+            if self.on_first_send is not None:
+                self._first_send()
+        if self.pending_audio and self.metrics is not None:
+            self.metrics.record_send(self.pending_counted, time.monotonic() - self.pending_since, self.pending_end)
+        if self.pending_audio and self.capture is not None:
+            self.capture.write(self.pending_pcm)
+        self.pending_start = self.pending_end = self.pending_audio = 0
+        return True
+
+    def pump(self, readable: bool = False, writable: bool = False):
+        if self.jitter_buffer is None:
+            self._pump_direct(readable)
+        else:
+            self._pump_buffered()
+
+    def _pump_direct(self, readable: bool):
+        self.want_read = self.want_write = False
+        self.timeout = None
+        while True:
+            if not self._send_pending():
+                self.want_write = True
+                return
+
+            # Only move a full chunk at a time, so we don't wake up for every few bytes
+            if self.pacer.budget() < self.chunk_size:
+                self.timeout = max(self.pacer.delay(self.chunk_size), 0)
+                return
+
+            if self.zero_copy:
+                if self.skip and not self._skip_partial_frame():
+                    self.want_read = not self.done
+                    return
+                started = time.monotonic()
+                try:
+                    moved = os.splice(self.src_fd, self.sock.fileno(), self.chunk_size,
+                                      flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+                except BlockingIOError:
+                    # Either the pipe is empty or the socket is full. If we were woken up because the pipe was
+                    # readable, it must be the socket, otherwise assume the pipe.
+                    if readable:
+                        self.want_write = True
+                    else:
+                        self.want_read = True
+                    return
+            else:
+                try:
+                    moved = os.readv(self.src_fd, [self.view])
+                except BlockingIOError:
+                    self.want_read = True
+                    return
+                self._set_pending(moved)
+
+            if moved == 0:
+                # Librespot closed its end of the pipe
+                self.done = True
+                return
+            if self.zero_copy:
+                self.spliced = (self.spliced + moved) % FRAME_SIZE
+                if self.metrics is not None:
+                    self.metrics.record_send(moved, time.monotonic() - started)
+                if self.on_first_send is not None:
+                    self._first_send()
+            self.pacer.consume(moved)
+            readable = False
+
+    def _pump_buffered(self):
+        # Alternate between both sides until neither of them can make progress
+        while True:
+            self.want_read = self.want_write = False
+            self.timeout = None
+            read = self._fill_buffer()
+            sent = self._drain_buffer()
+            if self.done or not (read or sent):
+                break
+
+    def _fill_buffer(self) -> bool:
+        # Read side: keep the buffer topped up, and keep reading at real time when it is full
+        jitter = self.jitter_buffer
+        progress = False
+        while not self.src_eof:
+            if jitter.free == 0:
+                if jitter.policy != DROP_OLDEST:
+                    break
+                if self.read_pacer.budget() < self.chunk_size:
+                    self.timeout = max(self.read_pacer.delay(self.chunk_size), 0)
+                    break
+                jitter.make_room(self.chunk_size)
+            view = jitter.writable_view(self.chunk_size)
+            try:
+                moved = os.readv(self.src_fd, [view])
+            except BlockingIOError:
+                self.want_read = True
+                break
+            if moved == 0:
+                self.src_eof = True
+                break
+            jitter.commit(moved)
+            self.read_pacer.consume(moved)
+            progress = True
+        return progress
+
+    def _drain_buffer(self) -> bool:
+        # Send side: send a chunk from the buffer every time one is due
+        jitter = self.jitter_buffer
+        progress = False
+        while True:
+            if not self._send_pending():
+                self.want_write = True
+                break
+            if self.pacer.budget() < self.chunk_size:
+                delay = max(self.pacer.delay(self.chunk_size), 0)
+                self.timeout = delay if self.timeout is None else min(self.timeout, delay)
+                break
+            if jitter.depth == 0:
+                if self.src_eof:
+                    self.done = True
+                elif not self.starving:
+                    # Count a single underrun for every time the buffer runs dry
+                    jitter.underruns += 1
+                    self.starving = True
+                break
+            self.starving = False
+            moved = jitter.read_into(self.view[:min(self.chunk_size, jitter.depth)])
+            self._set_pending(moved)
+            self.pacer.consume(moved)
+            progress = True
+        return progress
+
+    async def run_async(self, poll_interval: float = 0.25):
+        # Drive the relay from the running asyncio loop until the source is exhausted or the task is cancelled
+        loop = asyncio.get_running_loop()
+        self.setup()
+        self.start()
+        readable = writable = False
+        while True:
+            self.pump(readable, writable)
+            if self.done:
+                break
+
+            wake = loop.create_future()
+
+            def on_ready(kind):
+                if not wake.done():
+                    wake.set_result(kind)
+
+            want_read, want_write, timer = self.want_read, self.want_write, None
+            if want_read:
+                loop.add_reader(self.src_fd, on_ready, "read")
+            if want_write:
+                loop.add_writer(self.sock.fileno(), on_ready, "write")
+            if self.timeout is not None or not (want_read or want_write):
+                timer = loop.call_later(poll_interval if self.timeout is None else self.timeout, on_ready, "timer")
+            try:
+                kind = await wake
+            finally:
+                if want_read:
+                    loop.remove_reader(self.src_fd)
+                if want_write:
+                    loop.remove_writer(self.sock.fileno())
+                if timer is not None:
+                    timer.cancel()
+            readable, writable = kind == "read", kind == "write"
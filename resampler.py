@@ -0,0 +1,90 @@
+from importlib.util import find_spec
+from math import gcd
+from typing import Dict, Tuple
+
+RESAMPLER_SUPPORTED = find_spec("numpy") is not None
+
+FAST = "fast"
+MEDIUM = "medium"
+HIGH = "high"
+# Quality level -> (filter taps per phase, Kaiser window beta, cutoff relative to the lower Nyquist frequency).
+# More taps give a steeper filter with less aliasing, at a cost that grows linearly with them.
+QUALITIES: Dict[str, Tuple[int, float, float]] = {
+    FAST: (8, 5.0, 0.85),
+    MEDIUM: (16, 8.0, 0.90),
+    HIGH: (32, 10.0, 0.95),
+}
+CHANNELS = 2
+
+
+class Resampler:
+    """
+    Streaming polyphase resampler for interleaved 16 bit PCM, e.g. 44.1 kHz -> 48 kHz (160/147).
+
+    Every output sample is a dot product of one of the filter's `up` phases with the last few input frames,
+    computed for the whole chunk at once. The last input frames and the position in the output are kept between
+    chunks, so a stream resampled chunk by chunk is identical to one resampled in one go.
+    """
+
+    def __init__(self, in_rate: int = 44100, out_rate: int = 48000, quality: str = MEDIUM, channels: int = CHANNELS):
+        if not RESAMPLER_SUPPORTED:
+            raise ValueError("Resampling needs numpy.")
+        if quality not in QUALITIES:
+            raise ValueError(f"Unknown resampling quality: '{quality}'")
+        import numpy
+        self.np = numpy
+        self.in_rate: int = in_rate
+        self.out_rate: int = out_rate
+        self.quality: str = quality
+        self.channels: int = channels
+        divisor = gcd(in_rate, out_rate)
+        self.up: int = out_rate // divisor
+        self.down: int = in_rate // divisor
+        self.taps: int = QUALITIES[quality][0]
+        self.phases = self.design_filter()
+        self.reset()
+
+    def design_filter(self):
+        # Windowed sinc low-pass at the upsampled rate, split into `up` phases of `taps` coefficients each
+        np = self.np
+        taps, beta, cutoff = QUALITIES[self.quality]
+        length = self.up * taps
+        # Cycles per sample at the upsampled rate
+        fc = 0.5 * cutoff / max(self.up, self.down)
+        m = np.arange(length) - (length - 1) / 2
+        h = 2 * fc * np.sinc(2 * fc * m) * np.kaiser(length, beta)
+        # Upsampling spreads the energy over `up` samples, make up for it so unity gain stays unity gain
+        h *= self.up / h.sum()
+        # phases[p, k] = h[p + k * up], applied to input frames i, i - 1, ... i - taps + 1. Reversed, so they line up
+        # with a window of input frames from the oldest to the newest.
+        return h.reshape(taps, self.up).T[:, ::-1].astype(np.float32).copy()
+
+    def reset(self):
+        # Start a new stream, e.g. after changing `channels`
+        self.history = self.np.zeros((self.taps - 1, self.channels), dtype=self.np.float32)
+        # Global index of the next input frame and of the next output frame
+        self.position: int = 0
+        self.produced: int = 0
+
+    def process(self, pcm) -> bytes:
+        # Resample whole frames of 16 bit little-endian PCM, returns all output that can be computed so far
+        np = self.np
+        frames = np.frombuffer(pcm, dtype="<i2").reshape(-1, self.channels).astype(np.float32)
+        count = len(frames)
+        if count == 0:
+            return b""
+        x = np.concatenate((self.history, frames))
+        # Output frame n needs input frame (n * down) // up, produce all that are covered by this chunk
+        last = self.position + count - 1
+        end = ((last + 1) * self.up + self.down - 1) // self.down
+        n = np.arange(self.produced, end, dtype=np.int64)
+        phase = (n * self.down) % self.up
+        # Position of the oldest input frame every output frame needs within x
+        oldest = (n * self.down) // self.up - self.position
+        # Windows of `taps` frames are views of x, (outputs, channels, taps) @ (outputs, taps, 1)
+        windows = np.lib.stride_tricks.sliding_window_view(x, self.taps, axis=0)[oldest]
+        out = np.matmul(windows, self.phases[phase][:, :, None])[:, :, 0]
+        self.history = x[len(x) - (self.taps - 1):]
+        self.position += count
+        self.produced = end
+        return np.clip(np.rint(out), -32768, 32767).astype("<i2").tobytes()
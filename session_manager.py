@@ -0,0 +1,123 @@
+from threading import RLock
+from typing import Optional, Dict, Tuple, List, Callable, TYPE_CHECKING
+
+from engine import Engine
+from jitter_buffer import DROP_OLDEST
+from spotify_controller import SpotifyController, librespot_args, stop_controllers, MAX_BURST
+
+if TYPE_CHECKING:
+    from credential_cache import CredentialCache
+
+# The link code is None for a session that is not streaming to a bot yet
+SessionKey = Tuple[str, Optional[str]]
+
+
+class SessionLimits:
+    """
+    Resource limits applied to every session of a SessionManager.
+    """
+
+    def __init__(self, max_outputs: int = 1, max_jitter_ms: int = 2000, max_burst: float = MAX_BURST,
+                 memory_limit: Optional[int] = None):
+        self.max_outputs: int = max_outputs
+        self.max_jitter_ms: int = max_jitter_ms
+        self.max_burst: float = max_burst
+        # Address space limit for each librespot process in bytes (not supported on Windows)
+        self.memory_limit: Optional[int] = memory_limit
+
+
+class SessionManager:
+    """
+    Hosts several librespot sessions in one process.
+
+    Sessions are keyed by Spotify username and link code. All sessions share the same Engine, so they also share
+    one event loop for pacing and relaying audio.
+    """
+
+    def __init__(self, max_sessions: int = 50, limits: Optional[SessionLimits] = None,
+                 engine: Optional[Engine] = None,
+                 args_factory: Callable[[str, str, int], List[str]] = librespot_args,
+                 cache: Optional['CredentialCache'] = None):
+        self.max_sessions: int = max_sessions
+        self.limits: SessionLimits = limits if limits is not None else SessionLimits()
+        self.engine: Engine = engine if engine is not None else Engine.get_instance()
+        self.args_factory: Callable[[str, str, int], List[str]] = args_factory
+        # Per-user librespot cache, None to always log in with the password
+        self.cache: Optional['CredentialCache'] = cache
+        self.sessions: Dict[SessionKey, SpotifyController] = {}
+        self.lock: RLock = RLock()
+
+    def create(self, client, username: str, password: Optional[str], link_code: Optional[str], bitrate: int = 160,
+               jitter_ms: Optional[int] = None, jitter_policy: str = DROP_OLDEST) -> SpotifyController:
+        key = (username, link_code)
+        with self.lock:
+            if key in self.sessions:
+                raise ValueError(f"Session for '{username}' with this link code already exists!")
+            if len(self.sessions) >= self.max_sessions:
+                raise ValueError(f"Maximum number of sessions ({self.max_sessions}) reached.")
+            # Reserve the slot while librespot is starting
+            self.sessions[key] = None
+
+        cache_target = None
+        try:
+            if self.cache is not None:
+                args, cache_target = self.cache.librespot_args(username, password, bitrate, self.args_factory)
+            else:
+                args = self.args_factory(username, password, bitrate)
+            controller = SpotifyController.spawn(client, args, engine=self.engine,
+                                                 memory_limit=self.limits.memory_limit, name=username)
+        except Exception:
+            with self.lock:
+                del self.sessions[key]
+            raise
+
+        if cache_target is not None:
+            controller.log_targets.append(cache_target)
+        controller.bitrate = bitrate
+        controller.max_outputs = self.limits.max_outputs
+        controller.max_burst = self.limits.max_burst
+        if jitter_ms:
+            controller.jitter_ms = min(jitter_ms, self.limits.max_jitter_ms)
+            controller.jitter_policy = jitter_policy
+        with self.lock:
+            self.sessions[key] = controller
+        return controller
+
+    def move(self, username: str, link_code: Optional[str], new_link_code: Optional[str]):
+        # The session streams to another link code from now on
+        if new_link_code == link_code:
+            return
+        with self.lock:
+            if (username, new_link_code) in self.sessions:
+                raise ValueError(f"Session for '{username}' with this link code already exists!")
+            if (username, link_code) not in self.sessions:
+                raise ValueError(f"No session for '{username}' with this link code.")
+            self.sessions[(username, new_link_code)] = self.sessions.pop((username, link_code))
+
+    def get(self, username: str, link_code: Optional[str]) -> Optional[SpotifyController]:
+        with self.lock:
+            return self.sessions.get((username, link_code))
+
+    def find(self, username: str) -> List[SpotifyController]:
+        with self.lock:
+            return [c for (user, _), c in self.sessions.items() if user == username and c is not None]
+
+    def all(self) -> List[SpotifyController]:
+        with self.lock:
+            return [c for c in self.sessions.values() if c is not None]
+
+    def remove(self, username: str, link_code: Optional[str]):
+        with self.lock:
+            controller = self.sessions.pop((username, link_code), None)
+        if controller is not None:
+            controller.stop()
+
+    def stop_all(self):
+        with self.lock:
+            controllers = [c for c in self.sessions.values() if c is not None]
+            self.sessions = {}
+        stop_controllers(controllers)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.sessions)
@@ -1,14 +1,31 @@
+import asyncio
+import functools
 import os
 import platform
+import shlex
 import socket
 import subprocess
 import time
-from threading import Thread
-from typing import Optional, IO, AnyStr, List
-
-import requests
-
-from utils import resource_path, strip_html
+from concurrent.futures import Future
+from typing import Optional, List, Callable, Tuple, Dict, TYPE_CHECKING
+
+from capture import Capture, CAPTURE_BUDGET, capture_dir
+from config import MAX_BURST, MAX_LAG
+from engine import Engine
+from fanout import FanOut, EVICTED, DISCONNECTED
+from jitter_buffer import JitterBuffer, DROP_OLDEST
+from librespot_events import parse_line
+from log_dispatch import LogDispatcher, LogTarget
+from pacer import Pacer
+from relay import Relay
+from stream_codec import Encoder, PCM, OPUS, OPUS_SUPPORTED, create_encoder, negotiate, stream_format
+from stream_metrics import StreamMetrics, SHUTDOWN_LATENCY
+from utils import resource_path
+
+if TYPE_CHECKING:
+    from api_client import ApiClient
+    from dsp import DspStage
+    from librespot_pool import LibrespotPool, PooledSession
 
 SPOTIFY_CONNECT_NAME = "Spoofy Bot"
 SAMPLE_RATE = 44100
@@ -16,12 +33,18 @@ CHANNELS = 2
 BITS = 16
 SAMPLE_SIZE = (SAMPLE_RATE * BITS * CHANNELS) // 8
 CHUNK_SIZE = SAMPLE_SIZE // 4
+# The event-driven relay needs to select() on the librespot pipe, which Windows does not support
+RELAY_SUPPORTED = platform.system() != "Windows"
+# Log messages queued per log target, and how long queued messages may take to be delivered on shutdown
+LOG_QUEUE_SIZE = 1000
+LOG_DRAIN_TIMEOUT = 0.5
+# How often a lost connection to the bot is dialed again before giving up
+RECONNECT_ATTEMPTS = 5
+# Deadline for stopping a session, and how much of it is left for killing librespot if it ignores SIGTERM
+STOP_TIMEOUT = 2.0
+KILL_TIMEOUT = 0.5
 
 
-class LogTarget:
-    def process(self, message):
-        pass
-
 class StandardOutTarget(LogTarget):
     def __init__(self, name: str):
         self.name = name
@@ -30,57 +53,477 @@ class StandardOutTarget(LogTarget):
         print(f"[{self.name}] {message}")
 
 
-def log_worker(controller: 'SpotifyController', targets: List, stdout: Optional[IO[AnyStr]]):
-    while not controller.stop_threads:
-        output = stdout.readline().decode("utf-8").strip()
-        if output:
-            for target in targets:
-                if target is not None:
-                    target.process(output)
-    print(f"LogWorker stopped")
+async def log_worker(controller: 'SpotifyController', dispatcher: LogDispatcher, stderr: asyncio.StreamReader):
+    # Runs until librespot closes stderr (it exited) or the task is cancelled
+    try:
+        while line := await stderr.readline():
+            output = line.decode("utf-8", errors="replace").strip()
+            if output:
+                # Parse once, every target gets the same LibrespotLine
+                await dispatcher.dispatch(parse_line(output))
+    finally:
+        await dispatcher.close(timeout=LOG_DRAIN_TIMEOUT)
+        print(f"LogWorker stopped, {dispatcher}")
+
+
+class StreamTimings:
+    """
+    Timestamps (time.monotonic) of the phases of connecting a stream to the bot.
+
+    `connected` is resolved once the TCP connection to the bot is up (or failed), so other threads can wait for it.
+    """
+
+    def __init__(self, started_at: Optional[float] = None):
+        self.started_at: float = started_at if started_at is not None else time.monotonic()
+        self.connect_req_at: Optional[float] = None
+        self.tcp_connected_at: Optional[float] = None
+        self.start_req_at: Optional[float] = None
+        self.first_byte_at: Optional[float] = None
+        self.connected: Future = Future()
+
+    def _since_start(self, timestamp: Optional[float]) -> Optional[float]:
+        return None if timestamp is None else timestamp - self.started_at
+
+    @property
+    def time_to_first_audio(self) -> Optional[float]:
+        return self._since_start(self.first_byte_at)
+
+    def phases(self) -> dict:
+        return {
+            "connect_request": self._since_start(self.connect_req_at),
+            "tcp_connect": self._since_start(self.tcp_connected_at),
+            "start_request": self._since_start(self.start_req_at),
+            "first_audio": self.time_to_first_audio,
+        }
+
+    def __str__(self):
+        return ", ".join(f"{name} {'-' if value is None else f'{value * 1000:.0f} ms'}"
+                         for name, value in self.phases().items())
+
+
+async def output_worker(controller: 'SpotifyController', sock: socket.socket, stdout: asyncio.StreamReader,
+                        first_send: Optional[Callable[[], None]] = None, encoder: Optional[Encoder] = None):
+    # Fallback for platforms without the relay, reads from the librespot stream and sends it paced to real time
+    loop = asyncio.get_running_loop()
+    pacer = Pacer(SAMPLE_SIZE, max_burst=controller.max_burst)
+    pacer.start()
+    capture = controller.open_capture(*stream_format(encoder))
+    try:
+        while True:
+            # Wait until the next chunk is due
+            delay = pacer.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Read and send 0.25 seconds of audio
+            data = await stdout.read(CHUNK_SIZE)
+            if not data:
+                break
+            started = time.monotonic()
+            held = encoder.held if encoder is not None else 0
+            packets = data if encoder is None else encoder.encode(data)
+            await loop.sock_sendall(sock, packets)
+            # Silence the encoder holds back counts once its packet is sent
+            counted = len(data) + held - (encoder.held if encoder is not None else 0)
+            controller.metrics.record_send(counted, time.monotonic() - started, len(packets))
+            if capture is not None:
+                capture.write(data if encoder is None else encoder.processed)
+            if first_send is not None:
+                first_send, callback = None, first_send
+                callback()
+            pacer.consume(len(data))
+    finally:
+        print(f"OutputWorker stopped, {pacer}")
+        if capture is not None:
+            print(f"OutputWorker {capture}")
+            capture.close()
+
+
+def on_first_send(timings: StreamTimings):
+    timings.first_byte_at = time.monotonic()
+    print(f"First audio sent to the bot, {timings}")
+
+
+def on_recovered(controller: 'SpotifyController', lost_at: float):
+    recovery = time.monotonic() - lost_at
+    controller.metrics.record_recovery(recovery)
+    print(f"Audio resumed {recovery * 1000:.0f} ms after losing the bot")
+    controller.on_bot_reconnected(recovery)
+
+
+def create_relay(controller: 'SpotifyController', sock: socket.socket, stdout_fd: int,
+                 encoder: Optional[Encoder] = None) -> Relay:
+    jitter_buffer = None
+    if controller.jitter_ms:
+        jitter_buffer = JitterBuffer(controller.jitter_ms, SAMPLE_SIZE, policy=controller.jitter_policy)
+    relay = Relay(stdout_fd, sock, Pacer(SAMPLE_SIZE, max_burst=controller.max_burst), CHUNK_SIZE,
+                  jitter_buffer=jitter_buffer, encoder=encoder,
+                  capture=controller.open_capture(*stream_format(encoder)))
+    relay.metrics = controller.metrics
+    controller.metrics.pipe_fd = stdout_fd
+    if jitter_buffer is not None:
+        controller.metrics.attach_jitter_buffer(jitter_buffer)
+    return relay
+
+
+async def relay_worker(relay: Relay, first_send: Optional[Callable[[], None]] = None):
+    # Relay data from the librespot pipe to the socket, paced to real time
+    relay.on_first_send = first_send
+    try:
+        await relay.run_async()
+    finally:
+        print(f"RelayWorker stopped, {relay.pacer}, zero-copy: {relay.zero_copy}")
+        if relay.jitter_buffer is not None:
+            print(f"RelayWorker {relay.jitter_buffer}")
 
 
-def output_worker(controller: 'SpotifyController', address: str, port: int, sock: socket.socket, stdout: Optional[IO[AnyStr]]):
+def bot_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setblocking(False)
+    return sock
+
+
+async def open_stream(controller: 'SpotifyController', sock: socket.socket, address: str, port: int,
+                      offer: Optional[Encoder]) -> Optional[Encoder]:
+    # Connect to the bot and agree on a codec, returns the encoder to use (None for plain PCM)
+    await asyncio.get_running_loop().sock_connect(sock, (address, port))
+    if offer is None or not offer.negotiated:
+        return offer
+    return await negotiate(sock, offer, controller.bitrate)
+
+
+async def redial(controller: 'SpotifyController', address: str, port: int, offer: Optional[Encoder],
+                 link_code: Optional[str]) -> Optional[Tuple[socket.socket, Optional[Encoder]]]:
+    # Reconnect supervisor: dial the bot again with backoff and ask it to start streaming again. Librespot keeps
+    # running meanwhile, its audio waits in the pipe (and jitter buffer) until the new connection is up.
+    loop = asyncio.get_running_loop()
+    for attempt in range(controller.reconnect_attempts):
+        controller.on_bot_reconnecting(attempt + 1)
+        await asyncio.sleep(controller.api.backoff_delay(attempt))
+        sock = bot_socket()
+        try:
+            encoder = await open_stream(controller, sock, address, port, offer)
+        except OSError as e:
+            print(f"Reconnect attempt {attempt + 1} to {address}:{port} failed: {e}")
+            sock.close()
+            continue
+        if link_code is not None:
+            res, msg, _ = await loop.run_in_executor(None, controller.start_req, link_code)
+            if not res:
+                print(f"Reconnect attempt {attempt + 1} failed, bot did not restart the stream: {msg}")
+                sock.close()
+                continue
+        return sock, encoder
+    return None
+
+
+async def stream_worker(controller: 'SpotifyController', address: str, port: int, sock: socket.socket,
+                        timings: StreamTimings):
     # Connect to address
+    loop = asyncio.get_running_loop()
     sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-    sock.connect((address, port))
+    sock.setblocking(False)
+    if controller.dsp is not None:
+        controller.dsp.metrics = controller.metrics
+    offer = create_encoder(controller.codec, controller.bitrate, controller.silence_threshold_db,
+                           controller.resample_quality, controller.dsp)
+    relay = None
+    try:
+        try:
+            encoder = await open_stream(controller, sock, address, port, offer)
+        except OSError as e:
+            # Whoever set up the stream is waiting on this, the bot never saw a connection
+            print(f"Could not connect to bot at {address}:{port}: {e}")
+            timings.connected.set_exception(e)
+            return
+        timings.tcp_connected_at = time.monotonic()
+        timings.connected.set_result(True)
+        controller.metrics.record_connect(sock)
+
+        relay = create_relay(controller, sock, controller.stdout_fd, encoder) if controller.use_relay else None
+        first_send = functools.partial(on_first_send, timings)
+        while True:
+            try:
+                if relay is not None:
+                    await relay_worker(relay, first_send)
+                else:
+                    await output_worker(controller, sock, controller.process.stdout, first_send, encoder)
+                # Librespot closed its output
+                return
+            except (ConnectionResetError, BrokenPipeError, OSError):
+                print("Disconnected from bot. Either user disconnected, bot disconnected or there are connection "
+                      "problems.")
+                lost_at = time.monotonic()
+                controller.metrics.record_disconnect()
+                sock.close()
+
+            reconnected = await redial(controller, address, port, offer, controller.link_code)
+            if reconnected is None:
+                controller.on_bot_disconnect()
+                return
+            sock, encoder = reconnected
+            controller.output_socket = sock
+            controller.metrics.record_connect(sock, reconnect=True)
+            if relay is not None:
+                relay.replace_socket(sock, encoder)
+            elif encoder is not None:
+                encoder.reset()
+            first_send = functools.partial(on_recovered, controller, lost_at)
+    except asyncio.CancelledError:
+        if not timings.connected.done():
+            timings.connected.cancel()
+        raise
+    finally:
+        if controller.metrics.sock is sock:
+            controller.metrics.sock = None
+        sock.close()
+        if relay is not None and relay.capture is not None:
+            print(f"RelayWorker {relay.capture}")
+            relay.capture.close()
 
-    # Clear stdout
-    if stdout.seekable() and platform.system() == "Linux":
-        stdout.seek(-8, os.SEEK_END)
-    else:
-        print("Cannot seek in stdout")
 
-    # Start sending data
+async def fanout_reader(controller: 'SpotifyController', fanout: FanOut):
+    # Reads librespot's output once for every bot the session streams to
+    controller.metrics.pipe_fd = fanout.src_fd
     try:
-        while (not stdout.closed) or (not controller.stop_threads):
-            # Read and send 0.25 seconds of audio
-            sock.send(stdout.read(CHUNK_SIZE))
-            # Wait 250ms before reading the next chunk
-            time.sleep(0.25)
-    except (ConnectionResetError, BrokenPipeError, OSError):
-        print("Disconnected from bot. Either user disconnected, bot disconnected or there are connection problems.")
-        controller.on_bot_disconnect()
+        await fanout.run_async()
     finally:
-        if sock is not None:
+        print(f"FanOut stopped, {fanout}")
+        if controller.fanout is fanout:
+            controller.fanout = None
+
+
+def on_output_recovered(metrics: StreamMetrics, name: str, lost_at: float):
+    recovery = time.monotonic() - lost_at
+    metrics.record_recovery(recovery)
+    print(f"Audio to {name} resumed {recovery * 1000:.0f} ms after losing it")
+
+
+async def fanout_worker(controller: 'SpotifyController', address: str, port: int, link_code: Optional[str],
+                        sock: socket.socket, timings: StreamTimings):
+    # One bot of a fan-out: connects and negotiates like a single stream, then sends from the shared buffer until
+    # it is removed, evicted for falling behind or lost for good
+    name = f"{address}:{port}"
+    metrics = StreamMetrics(f"{controller.metrics.session}->{name}", SAMPLE_SIZE)
+    # Its own DSP state, the gain follows the session's
+    dsp = controller.dsp.copy() if controller.dsp is not None else None
+    if dsp is not None:
+        dsp.metrics = metrics
+    offer = create_encoder(controller.codec, controller.bitrate, controller.silence_threshold_db,
+                           controller.resample_quality, dsp)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setblocking(False)
+    destination = capture = None
+    try:
+        try:
+            encoder = await open_stream(controller, sock, address, port, offer)
+        except OSError as e:
+            print(f"Could not connect to bot at {name}: {e}")
+            timings.connected.set_exception(e)
+            return
+        timings.tcp_connected_at = time.monotonic()
+        timings.connected.set_result(True)
+        metrics.record_connect(sock)
+        first_send = functools.partial(on_first_send, timings)
+        # Every bot is sent its own audio, so it gets its own capture
+        capture = controller.open_capture(*stream_format(encoder), metrics=metrics)
+        while True:
+            # The first bot that is connected starts reading librespot's output
+            destination = controller.start_fanout().add(sock, encoder, name, metrics, capture)
+            destination.on_first_send = first_send
+            reason = await destination.closed
+            if reason == EVICTED:
+                print(f"Evicted {name}, it fell {controller.fanout_max_lag:.1f} seconds behind")
+                controller.on_output_lost(address, port, reason)
+                return
+            if reason != DISCONNECTED:
+                return
+            print(f"Disconnected from bot at {name}: {destination.error}")
+            lost_at = time.monotonic()
+            metrics.record_disconnect()
             sock.close()
+            reconnected = await redial(controller, address, port, offer, link_code)
+            if reconnected is None:
+                controller.on_output_lost(address, port, reason)
+                return
+            sock, encoder = reconnected
+            metrics.record_connect(sock, reconnect=True)
+            if capture is not None:
+                capture.reconnected()
+                capture.set_format(*stream_format(encoder))
+            first_send = functools.partial(on_output_recovered, metrics, name, lost_at)
+    except asyncio.CancelledError:
+        if not timings.connected.done():
+            timings.connected.cancel()
+        raise
+    finally:
+        if destination is not None and controller.fanout is not None:
+            controller.fanout.remove(destination)
+        if controller.fanout_outputs.get((address, port)) is asyncio.current_task():
+            del controller.fanout_outputs[(address, port)]
+        sock.close()
+        print(f"Output to {name} stopped, {metrics.summary()}")
+        if capture is not None:
+            print(f"Output to {name} {capture}")
+            capture.close()
+
+
+async def stop_process(process: asyncio.subprocess.Process, deadline: float):
+    # Ask librespot to exit, kill it if it has not by KILL_TIMEOUT before the deadline
+    if process.returncode is None:
+        if process.stdin is not None:
+            process.stdin.close()
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), max(deadline - KILL_TIMEOUT - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            print("Librespot did not exit in time, killing it")
+            process.kill()
+            try:
+                await asyncio.wait_for(process.wait(), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+
+async def stop_log_tasks(controller: 'SpotifyController', deadline: float):
+    # The log tasks end once librespot's stderr is closed, which normally happens when it exits
+    tasks, controller.log_tasks = controller.log_tasks, []
+    if not tasks:
+        return
+    _, pending = await asyncio.wait(tasks, timeout=max(deadline - LOG_DRAIN_TIMEOUT - time.monotonic(), 0))
+    if pending and controller.process.stderr is not None:
+        # Still open, e.g. inherited by a child of librespot, so end the reader ourselves
+        controller.process.stderr.feed_eof()
+        _, pending = await asyncio.wait(pending, timeout=max(deadline - time.monotonic(), 0))
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def stop_controllers(controllers: List['SpotifyController'], timeout: float = STOP_TIMEOUT):
+    # Stop several sessions at once, so they share one deadline instead of taking turns
+    by_engine = {}
+    for controller in controllers:
+        by_engine.setdefault(controller.engine, []).append(controller)
+    async def stop_group(group: List['SpotifyController']):
+        await asyncio.gather(*(c._stop(timeout) for c in group), return_exceptions=True)
+
+    for engine, group in by_engine.items():
+        engine.run(stop_group(group))
+
+
+def librespot_args(spotify_username: str, spotify_password: Optional[str], bitrate: int = 160) -> List[str]:
+    # Get proper path to librespot, SPOOFY_LIBRESPOT replaces it with another command (e.g. a stand-in for testing)
+    if override := os.environ.get("SPOOFY_LIBRESPOT"):
+        librespot_command = shlex.split(override, posix=os.name != "nt")
+    elif platform.system() == "Linux":
+        librespot_command = [resource_path("libraries/librespot")]
+    elif platform.system() == "Windows":
+        librespot_command = [resource_path("libraries/librespot.exe")]
+    else:
+        raise ValueError(f"Unsupported platform: '{platform.system()}'")
+
+    # Without a password, librespot logs in with the credentials in its cache
+    password_args = ["--password", spotify_password] if spotify_password is not None else []
+
+    # Create a FIFO pipe for librespot to use
+    return [
+        *librespot_command,
+        "--name", SPOTIFY_CONNECT_NAME,
+        "--username", spotify_username,
+        *password_args,
+        "--bitrate", str(bitrate),
+        "--disable-discovery",
+        "--device-type", "speaker",
+        "--backend", "pipe",
+        "--initial-volume", "100",
+        "--enable-volume-normalisation"
+    ]
 
-    print(f"OutputWorker stopped")
+
+def limit_memory(limit: int):
+    # Runs in the child process before librespot is started
+    import resource
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
 
 
 class SpotifyController:
+    """
+    Facade for a librespot session running on the shared asyncio Engine.
+
+    All methods are meant to be called from outside the engine thread (the wx main loop or the CLI), they hand
+    the work to the engine and wait for it to finish.
+    """
     _instance: Optional['SpotifyController'] = None
 
-    def __init__(self, client, process):
+    def __init__(self, client, engine: Optional[Engine] = None, api: Optional['ApiClient'] = None,
+                 name: str = "default"):
         self.client = client
-        self.process: subprocess.Popen = process
-        self.output_threads: List = []
-        self.log_threads: List = []
+        self.engine: Engine = engine if engine is not None else Engine.get_instance()
+        self._api: Optional['ApiClient'] = api
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.stdout_fd: Optional[int] = None
+        self.output_tasks: List[asyncio.Task] = []
+        self.log_tasks: List[asyncio.Task] = []
         self.log_targets: List = []
-        self.stop_threads: bool = False
+        self.log_dispatcher: Optional[LogDispatcher] = None
+        self.log_queue_size: int = LOG_QUEUE_SIZE
+        self.log_drop_policy: str = DROP_OLDEST
         self.address: Optional[str] = None
         self.port: Optional[int] = None
+        # Link code of the current stream, the start request is sent again with it after a reconnect
+        self.link_code: Optional[str] = None
+        self.reconnect_attempts: int = RECONNECT_ATTEMPTS
         self.output_socket: Optional[socket.socket] = None
+        # Set while the session streams to several bots, with the worker of every bot. Seconds a bot may fall
+        # behind the others before it is dropped.
+        self.fanout: Optional[FanOut] = None
+        self.fanout_outputs: Dict[Tuple[str, int], asyncio.Task] = {}
+        self.fanout_max_lag: float = MAX_LAG
+        self.timings: Optional[StreamTimings] = None
+        # Set to keep the last `capture_budget` bytes of sent audio on disk, below a directory per session
+        self.capture_dir: Optional[str] = None
+        self.capture_budget: int = CAPTURE_BUDGET
+        self.max_burst: float = MAX_BURST
+        # Codec offered to the bot, and the bitrate (kbps) used by librespot and the Opus encoder
+        self.codec: str = PCM
+        self.bitrate: int = 160
+        # Silence below this level (dBFS) is sent as silence packets if the bot supports them, None sends it as is.
+        # Even with PCM this negotiates with the bot, so it needs a bot that understands the stream header.
+        self.silence_threshold_db: Optional[float] = None
+        # Resampling quality for sending Discord's 48 kHz if the bot accepts it, None sends librespot's 44.1 kHz.
+        # Opus is always resampled, this only picks the quality for it.
+        self.resample_quality: Optional[str] = None
+        # Gain, limiter and mono downmix, None sends librespot's audio untouched. Its gain can be changed while
+        # streaming, the rest applies from the next stream.
+        self.dsp: Optional['DspStage'] = None
+        self.use_relay: bool = RELAY_SUPPORTED
+        # Target latency of the jitter buffer, only used by the relay. None disables the buffer.
+        self.jitter_ms: Optional[int] = None
+        self.jitter_policy: str = DROP_OLDEST
+        # Resource limits, None means unlimited
+        self.max_outputs: Optional[int] = None
+        self.memory_limit: Optional[int] = None
+        # Throughput, send latency, backlog etc. of the audio stream, labeled with the session name
+        self.metrics: StreamMetrics = StreamMetrics(name, SAMPLE_SIZE)
+        # Set when librespot was started by the warm pool, reused when it was already logged in when handed out
+        self.pool: Optional['LibrespotPool'] = None
+        self.pooled: Optional['PooledSession'] = None
+        self.reused: bool = False
+        # Seconds the last stop took
+        self.shutdown_duration: Optional[float] = None
+
+    @property
+    def api(self) -> 'ApiClient':
+        # Imported on first use, so librespot is already logging in while requests is being imported
+        if self._api is None:
+            from api_client import ApiClient
+            self._api = ApiClient.get_instance()
+        return self._api
+
+    @api.setter
+    def api(self, api: 'ApiClient'):
+        self._api = api
 
     @classmethod
     def get_instance(cls):
@@ -107,168 +550,201 @@ class SpotifyController:
         if inst is not None:
             raise ValueError("Instance already exists!")
 
-        # Get proper path to librespot
-        if platform.system() == "Linux":
-            librespot_path = resource_path("libraries/librespot")
-        elif platform.system() == "Windows":
-            librespot_path = resource_path("libraries/librespot.exe")
-        else:
-            raise ValueError(f"Unsupported platform: '{platform.system()}'")
-
-        # Create a FIFO pipe for librespot to use
-        args = [
-            librespot_path,
-            "--name", SPOTIFY_CONNECT_NAME,
-            "--username", spotify_username,
-            "--password", spotify_password,
-            "--bitrate", str(bitrate),
-            "--disable-discovery",
-            "--device-type", "speaker",
-            "--backend", "pipe",
-            "--initial-volume", "100",
-            "--enable-volume-normalisation"
-        ]
+        # Take a logged in librespot from the warm pool if there is one
+        from librespot_pool import LibrespotPool
+        inst = LibrespotPool.get_instance().acquire(client, spotify_username, spotify_password, bitrate)
+        cls._instance = inst
+        return inst
+
+    @classmethod
+    def spawn(cls, client, args: List[str], engine: Optional[Engine] = None,
+              memory_limit: Optional[int] = None, name: str = "default") -> 'SpotifyController':
+        # Start a librespot session that is not registered as the global instance
         print(f"Creating player...")
+        inst = SpotifyController(client=client, engine=engine, name=name)
+        inst.memory_limit = memory_limit
+        inst.engine.run(inst.start_process(args))
+        inst.setup_log_task()
+        return inst
 
+    async def start_process(self, args: List[str]):
         # Create librespot instance
+        preexec_fn = None
         if platform.system() == "Windows":
             startup_info = subprocess.STARTUPINFO()
             startup_info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
         else:
             startup_info = None
-        process = subprocess.Popen(
-            args=args,
-            startupinfo=startup_info,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            stdin=subprocess.PIPE
-        )
-
-        inst = SpotifyController(client=client, process=process)
-        inst.setup_log_thread()
-        cls._instance = inst
-        return inst
+            if self.memory_limit is not None:
+                preexec_fn = functools.partial(limit_memory, self.memory_limit)
 
-    def setup_log_thread(self):
-        tid = len(self.log_threads) + 1
+        # The relay works on the raw pipe, so give librespot our own pipe instead of an asyncio stream
+        stdout = subprocess.PIPE
+        if self.use_relay:
+            self.stdout_fd, stdout = os.pipe()
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *args,
+                startupinfo=startup_info,
+                preexec_fn=preexec_fn,
+                stdout=stdout,
+                stderr=subprocess.PIPE,
+                stdin=subprocess.PIPE
+            )
+        finally:
+            if self.use_relay:
+                os.close(stdout)
+
+    def setup_log_task(self):
+        tid = len(self.log_tasks) + 1
         self.log_targets.append(StandardOutTarget(f"Player-{tid}"))
-        stderr_thread = Thread(target=log_worker, args=[self, self.log_targets, self.process.stderr])
-        stderr_thread.start()
-        self.log_threads.append(stderr_thread)
+        self.engine.call_soon(self._create_log_task)
+
+    def _create_log_task(self):
+        self.log_dispatcher = LogDispatcher(self.log_targets, maxsize=self.log_queue_size, policy=self.log_drop_policy)
+        self.log_tasks.append(asyncio.create_task(log_worker(self, self.log_dispatcher, self.process.stderr)))
 
-    def setup_output_thread(self):
+    def setup_output(self, timings: Optional[StreamTimings] = None) -> StreamTimings:
+        # Starts connecting to the bot in the background, wait on timings.connected to know when it is up
         if self.address is None or self.port is None:
             raise ValueError("Address or port not set.")
+        if self.codec == OPUS and not OPUS_SUPPORTED:
+            raise ValueError("Opus encoding needs the opuslib package and libopus.")
+        if self.max_outputs is not None and len([t for t in self.output_tasks if not t.done()]) >= self.max_outputs:
+            raise ValueError(f"Session already has {self.max_outputs} output(s).")
+        if self.fanout is not None or self.fanout_outputs:
+            raise ValueError("Session is streaming to several bots, use add_output.")
         self.output_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        stdout_thread = Thread(target=output_worker, args=[self, self.address, self.port,
-                                                           self.output_socket, self.process.stdout])
-        stdout_thread.start()
-        self.output_threads.append(stdout_thread)
+        self.timings = timings if timings is not None else StreamTimings()
+        self.engine.call_soon(self._create_output_task, self.address, self.port, self.output_socket, self.timings)
+        return self.timings
+
+    def _create_output_task(self, address: str, port: int, sock: socket.socket, timings: StreamTimings):
+        self.output_tasks.append(asyncio.create_task(stream_worker(self, address, port, sock, timings)))
+
+    def add_output(self, address: str, port: int, link_code: Optional[str] = None,
+                   timings: Optional[StreamTimings] = None) -> StreamTimings:
+        # Streams to one more bot, librespot's output is read once and sent to all of them. `link_code` is sent
+        # with the start request again after reconnecting, like for a single stream.
+        if not self.use_relay:
+            raise ValueError("Streaming to several bots is not supported on this platform.")
+        if self.codec == OPUS and not OPUS_SUPPORTED:
+            raise ValueError("Opus encoding needs the opuslib package and libopus.")
+        if self.fanout is None and not self.fanout_outputs and any(not t.done() for t in self.output_tasks):
+            raise ValueError("Session is already streaming to a single bot, disconnect first.")
+        if (address, port) in self.fanout_outputs:
+            raise ValueError(f"Session is already streaming to {address}:{port}.")
+        if self.max_outputs is not None and len(self.fanout_outputs) >= self.max_outputs:
+            raise ValueError(f"Session already has {self.max_outputs} output(s).")
+        timings = timings if timings is not None else StreamTimings()
+        self.engine.run(self._add_output(address, port, link_code, socket.socket(socket.AF_INET, socket.SOCK_STREAM),
+                                         timings))
+        return timings
+
+    async def _add_output(self, address: str, port: int, link_code: Optional[str], sock: socket.socket,
+                          timings: StreamTimings):
+        task = asyncio.create_task(fanout_worker(self, address, port, link_code, sock, timings))
+        self.fanout_outputs[(address, port)] = task
+        self.output_tasks.append(task)
+
+    def start_fanout(self) -> FanOut:
+        # Runs on the engine loop
+        if self.fanout is None:
+            self.fanout = FanOut(self.stdout_fd, Pacer(SAMPLE_SIZE, max_burst=self.max_burst), CHUNK_SIZE,
+                                 self.fanout_max_lag)
+            self.output_tasks.append(asyncio.create_task(fanout_reader(self, self.fanout)))
+        return self.fanout
+
+    def remove_output(self, address: str, port: int):
+        # Stop streaming to one bot of a fan-out, the others keep going
+        self.engine.run(self._remove_output(address, port))
+
+    async def _remove_output(self, address: str, port: int):
+        task = self.fanout_outputs.get((address, port))
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def open_capture(self, sample_rate: int, channels: int,
+                     metrics: Optional[StreamMetrics] = None) -> Optional[Capture]:
+        # A capture for a new stream if capturing, named after the stream of `metrics` (the session's by default).
+        # A capture that can not be opened never stops the stream.
+        if self.capture_dir is None:
+            return None
+        metrics = metrics if metrics is not None else self.metrics
+        try:
+            return Capture(capture_dir(self.capture_dir, metrics.session, metrics.stream_id), self.capture_budget,
+                           sample_rate=sample_rate, channels=channels)
+        except (OSError, ValueError) as e:
+            print(f"Could not open the capture in {self.capture_dir}: {e}")
+            return None
+
+    def on_output_lost(self, address: str, port: int, reason: str):
+        # One bot of a fan-out is gone, the others keep streaming
+        callback = getattr(self.client, "on_output_lost", None)
+        if callback is not None:
+            callback(address, port, reason)
 
     def on_bot_disconnect(self):
         self.client.on_bot_disconnect()
 
+    def on_bot_reconnecting(self, attempt: int):
+        self.client.on_bot_reconnecting(attempt)
+
+    def on_bot_reconnected(self, recovery: float):
+        self.client.on_bot_reconnected(recovery)
+
+    async def _cancel_output(self):
+        tasks, self.output_tasks = self.output_tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.output_socket = None
+        self.fanout = None
+        self.fanout_outputs = {}
+
     def disconnect(self):
-        # Close the output socket if it is open
-        if self.output_socket is not None:
-            self.output_socket.close()
-            self.output_socket = None
-
-        # Join output threads
-        for thread in self.output_threads:
-            # Join the thread, wait for 1 second for it to quit.
-            thread.join(timeout=1)
-            # If thread is still alive after timeout, kill it.
-            if thread.is_alive():
-                print(f"Thread {thread} failed to stop")
-
-        self.output_threads = []
-
-    def stop(self):
-        # Stop Spotify subprocess
-        self.process.terminate()
-
-        # If not terminated immediately, wait 1 second.
-        if self.process.poll() is None:
-            time.sleep(1)
-
-        # If still not terminated after 1 second, kill it.
-        if self.process.poll() is None:
-            self.process.kill()
-
-        # Signal to stop log threads
-        self.stop_threads = True
-
-        # Close the output socket if it is open
-        if self.output_socket is not None:
-            self.output_socket.close()
-            self.output_socket = None
-
-        # Join log threads
-        for thread in self.log_threads:
-            # Join the thread, wait for 1 second for it to quit.
-            thread.join(timeout=1)
-            # If thread is still alive after timeout, kill it.
-            if thread.is_alive():
-                print(f"Thread {thread} failed to stop")
-
-        # Join output threads
-        for thread in self.output_threads:
-            # Join the thread, wait for 1 second for it to quit.
-            thread.join(timeout=1)
-            # If thread is still alive after timeout, kill it.
-            if thread.is_alive():
-                print(f"Thread {thread} failed to stop")
+        # Cancel the output tasks, they close their socket on the way out
+        self.engine.run(self._cancel_output())
+
+    async def _stop(self, timeout: float = STOP_TIMEOUT):
+        # Stop sending audio, librespot and the log task all at once, within `timeout` seconds together
+        started = time.monotonic()
+        deadline = started + timeout
+        await asyncio.gather(self._cancel_output(), stop_process(self.process, deadline),
+                             stop_log_tasks(self, deadline), return_exceptions=True)
+
+        # Nothing reads the pipe anymore
+        if self.stdout_fd is not None:
+            os.close(self.stdout_fd)
+            self.stdout_fd = None
 
         # Remove self from instance list
-        SpotifyController.remove_inst()
+        if SpotifyController._instance is self:
+            SpotifyController.remove_inst()
 
-    def wait(self):
-        self.process.wait()
+        self.shutdown_duration = time.monotonic() - started
+        SHUTDOWN_LATENCY.observe(self.shutdown_duration)
+        print(f"Stopped librespot in {self.shutdown_duration * 1000:.0f} ms")
 
-    def check_req(self, username):
-        from main import API_BASE_URL
-        # Connects to the API and checks if everything is good to go
-        try:
-            res = requests.get(API_BASE_URL + "check/", params={"user": username})
-        except ConnectionError as e:
-            return False, f"Connection error: {e}", "Connection error."
+    def stop(self, timeout: float = STOP_TIMEOUT):
+        self.engine.run(self._stop(timeout))
+
+    def release(self):
+        # Log out, librespot is kept warm in the pool if it came from there and is still logged in
+        if self.pool is None or not self.pool.release(self):
+            self.stop()
+        elif SpotifyController._instance is self:
+            SpotifyController.remove_inst()
 
-        if res.status_code == 200:
-            data = res.json()
-            return data['linked'], "", ""
+    def wait(self):
+        self.engine.run(self.process.wait())
 
-        content = strip_html(res.content.decode("utf-8"))
-        return False, f"HTTP error {res.status_code} - {content}", "Connection error."
+    def check_req(self, username):
+        return self.api.check(username)
 
     def connect_req(self, username, link_code):
-        from main import API_BASE_URL
-        try:
-            res = requests.get(API_BASE_URL + "connect/", params={"user": username, "link_code": link_code})
-        except ConnectionError as e:
-            return False, f"Connection error: {e}", "Connection error."
-        if res.status_code == 200:
-            data = res.json()
-            if data.get("error", False):
-                return False, data['msg'], data['short_msg']
-            else:
-                return True, data['address'], data['port']
-
-        content = strip_html(res.content.decode("utf-8"))
-        return False, f"HTTP error {res.status_code} - {content}", "Connection error."
+        return self.api.connect(username, link_code)
 
     def start_req(self, link_code):
-        from main import API_BASE_URL
-        try:
-            res = requests.get(API_BASE_URL + "start/", params={"link_code": link_code})
-        except ConnectionError as e:
-            return False, f"Connection error: {e}", "Connection error."
-        if res.status_code == 200:
-            data = res.json()
-            if data.get("error", False):
-                return False, data['msg'], data['short_msg']
-            else:
-                return True, "", ""
-
-        content = strip_html(res.content.decode("utf-8"))
-        return False, f"HTTP error {res.status_code} - {content}", "Connection error."
+        return self.api.start(link_code)
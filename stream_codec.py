@@ -0,0 +1,425 @@
+import asyncio
+import socket
+import struct
+import warnings
+import zlib
+from importlib.util import find_spec
+from typing import Optional, List, Tuple, TYPE_CHECKING
+
+from config import CODECS, LOSSLESS, OPUS, PCM
+
+if TYPE_CHECKING:
+    from dsp import DspStage
+    from resampler import Resampler
+    from silence import SilenceDetector
+
+CODEC_IDS = {PCM: 0, LOSSLESS: 1, OPUS: 2}
+# Opus needs the opuslib package (and the libopus shared library), they are only imported when Opus is used.
+# The resampler (numpy) or audioop (deprecated since Python 3.11) converts to 48 kHz for it.
+OPUS_SUPPORTED = find_spec("opuslib") is not None and (find_spec("numpy") is not None or
+                                                       find_spec("audioop") is not None)
+
+# Sent by the client after connecting: magic, version, codec, sample rate, channels, bitrate (kbps). The bot answers
+# with a single byte, the id of the codec it accepts (PCM if it does not support the offered one).
+STREAM_MAGIC = b"SPFY"
+STREAM_VERSION = 1
+STREAM_HEADER = struct.Struct("!4sBBIBH")
+# Every encoded packet is prefixed with its length
+PACKET_HEADER = struct.Struct("!I")
+NEGOTIATE_TIMEOUT = 5.0
+# In version 2 the codec ids carry flags, in the offer for what the client would like to do and in the answer for
+# what the bot accepts of it:
+# - DTX_ACCEPTED: silence may be replaced with silence packets, a packet header with SILENCE_FLAG set and the number
+#   of silent frames (at the stream's sample rate) instead of a length, without payload. Otherwise the client sends
+#   the silence like any other audio.
+# - RATE_ACCEPTED: only in the answer, for the sample rate in the header. Otherwise the client sends librespot's
+#   44.1 kHz. Opus is always 48 kHz.
+# - CHANNELS_ACCEPTED: only in the answer, for the channels in the header (mono). Otherwise the client sends stereo.
+STREAM_VERSION_FLAGS = 2
+DTX_ACCEPTED = 0x80
+RATE_ACCEPTED = 0x40
+CHANNELS_ACCEPTED = 0x20
+CODEC_ID_MASK = 0x1f
+SILENCE_FLAG = 0x80000000
+# While it stays silent, a silence packet is sent at least this often so the bot knows the stream is alive
+MAX_SILENCE_MS = 1000
+
+# Input format, same as the librespot pipe backend
+SAMPLE_RATE = 44100
+CHANNELS = 2
+FRAME_SIZE = 4
+# Discord voice runs at 48 kHz, Opus only supports a few sample rates and 20 ms packets are what Discord uses
+DISCORD_SAMPLE_RATE = 48000
+OPUS_SAMPLE_RATE = DISCORD_SAMPLE_RATE
+OPUS_FRAME_SAMPLES = OPUS_SAMPLE_RATE // 50
+
+
+class Encoder:
+    """
+    Turns the PCM stream into length-prefixed packets.
+
+    `encode` accepts any amount of audio, incomplete frames are kept until the rest arrives. The audio goes through
+    the DSP stage and the resampler first, if there are any, and `processed` is what came out of them for the last
+    chunk, in the stream's sample rate and channels.
+    """
+    codec: str = PCM
+    sample_rate: int = SAMPLE_RATE
+    # Input audio (bytes) taken but not in a packet yet, it only counts as sent once it is
+    held: int = 0
+
+    def __init__(self):
+        self.remainder: bytes = b""
+        self.input_remainder: bytes = b""
+        self.resampler: Optional['Resampler'] = None
+        self.dsp: Optional['DspStage'] = None
+        self.channels: int = CHANNELS
+        self.processed = b""
+
+    @property
+    def frame_size(self) -> int:
+        # Of the encoded stream, 16 bit samples
+        return 2 * self.channels
+
+    def set_resampler(self, resampler: Optional['Resampler']):
+        # None goes back to librespot's sample rate
+        self.resampler = resampler
+        self.sample_rate = resampler.out_rate if resampler is not None else type(self).sample_rate
+        if resampler is not None:
+            resampler.channels = self.channels
+            resampler.reset()
+
+    def set_dsp(self, dsp: Optional['DspStage']):
+        self.dsp = dsp
+        self.set_channels(1 if dsp is not None and dsp.mono else CHANNELS)
+
+    def set_channels(self, channels: int):
+        # Mono when the DSP stage downmixes, starts the stream over
+        self.channels = channels
+        if self.resampler is not None:
+            self.resampler.channels = channels
+        self.reset()
+
+    @property
+    def version(self) -> int:
+        # The bot has to say whether it accepts another sample rate or channel count
+        changed = self.resampler is not None and self.codec != OPUS or self.channels != CHANNELS
+        return STREAM_VERSION_FLAGS if changed else STREAM_VERSION
+
+    @property
+    def negotiated(self) -> bool:
+        # Plain PCM in librespot's format needs no stream header, even after the DSP stage
+        return self.codec != PCM or self.version != STREAM_VERSION
+
+    def _process(self, pcm) -> bytes:
+        # Whole input frames through the DSP stage and the resampler, keeps a partial frame for the next call
+        if self.input_remainder or len(pcm) % FRAME_SIZE:
+            data = self.input_remainder + bytes(pcm)
+            end = len(data) - len(data) % FRAME_SIZE
+            data, self.input_remainder = data[:end], data[end:]
+        else:
+            # The DSP stage reads a memoryview in place
+            data = pcm
+        if self.dsp is not None:
+            data = self.dsp.process(data, self.channels == 1)
+        self.processed = self._resample(data)
+        return self.processed
+
+    def _resample(self, data) -> bytes:
+        return bytes(data) if self.resampler is None else self.resampler.process(data)
+
+    def _take(self, pcm, multiple: int) -> bytes:
+        # Returns the audio that fills whole blocks of `multiple` bytes, keeps the rest for the next call
+        data = self.remainder + bytes(pcm)
+        end = len(data) - len(data) % multiple
+        self.remainder = data[end:]
+        return data[:end]
+
+    def encode(self, pcm) -> bytes:
+        raise NotImplementedError
+
+    def reset(self):
+        # Start a new stream, e.g. after reconnecting to the bot
+        self.remainder = self.input_remainder = b""
+        self.reset_processing()
+
+    def reset_processing(self):
+        # Forget the audio the DSP stage and the resampler still hold, e.g. when they did not see a gap in it
+        if self.resampler is not None:
+            self.resampler.reset()
+        if self.dsp is not None:
+            self.dsp.reset()
+
+    def header(self, bitrate: int, version: Optional[int] = None, flags: int = 0) -> bytes:
+        version = self.version if version is None else version
+        return STREAM_HEADER.pack(STREAM_MAGIC, version, CODEC_IDS[self.codec] | flags, self.sample_rate,
+                                  self.channels, bitrate)
+
+
+class PcmEncoder(Encoder):
+    """
+    Plain PCM after the DSP stage, or negotiated to send it resampled, in mono or with silence packets. Only the
+    silence packets need framing, without them it is sent as a plain stream like librespot's output.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.framed: bool = False
+
+    def encode(self, pcm) -> bytes:
+        data = self._take(self._process(pcm), self.frame_size)
+        if not self.framed:
+            return data
+        return PACKET_HEADER.pack(len(data)) + data if data else b""
+
+
+class LosslessEncoder(Encoder):
+    """
+    Lossless and cheap: the low and high bytes of each channel are split into separate planes, which zlib
+    compresses a lot better than interleaved samples.
+    """
+    codec = LOSSLESS
+
+    def __init__(self, level: int = 1):
+        super().__init__()
+        self.level: int = level
+
+    def encode(self, pcm) -> bytes:
+        data = self._take(self._process(pcm), self.frame_size)
+        if not data:
+            return b""
+        payload = zlib.compress(b"".join(data[i::self.frame_size] for i in range(self.frame_size)), self.level)
+        return PACKET_HEADER.pack(len(payload)) + payload
+
+
+class OpusEncoder(Encoder):
+    """
+    Resamples to 48 kHz and encodes 20 ms Opus packets, which is what Discord sends anyway.
+    """
+    codec = OPUS
+    sample_rate = OPUS_SAMPLE_RATE
+
+    def __init__(self, bitrate: int, resample_quality: Optional[str] = None):
+        self.audioop = None
+        try:
+            import opuslib
+            from resampler import Resampler, RESAMPLER_SUPPORTED, MEDIUM
+            if not RESAMPLER_SUPPORTED:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", DeprecationWarning)
+                    import audioop
+                self.audioop = audioop
+        except Exception as e:
+            # opuslib raises a plain Exception when libopus can not be loaded
+            raise ValueError(f"Opus encoding needs the opuslib package and libopus: {e}")
+        self.opuslib = opuslib
+        super().__init__()
+        if self.audioop is None:
+            self.set_resampler(Resampler(SAMPLE_RATE, OPUS_SAMPLE_RATE, resample_quality or MEDIUM))
+        self.bitrate: int = bitrate
+        self.encoder = None
+        self.resample_state = None
+        self.reset()
+
+    def set_resampler(self, resampler: Optional['Resampler']):
+        # Opus is always 48 kHz, only the way to get there can change
+        if resampler is not None:
+            super().set_resampler(resampler)
+
+    def reset(self):
+        super().reset()
+        self.encoder = self.opuslib.Encoder(OPUS_SAMPLE_RATE, self.channels, self.opuslib.APPLICATION_AUDIO)
+        self.encoder.bitrate = self.bitrate * 1000
+        self.resample_state = None
+
+    def reset_processing(self):
+        super().reset_processing()
+        self.resample_state = None
+
+    def _resample(self, data) -> bytes:
+        if self.audioop is None:
+            return super()._resample(data)
+        # Without numpy, audioop does it
+        resampled, self.resample_state = self.audioop.ratecv(bytes(data), 2, self.channels, SAMPLE_RATE,
+                                                             OPUS_SAMPLE_RATE, self.resample_state)
+        return resampled
+
+    def encode(self, pcm) -> bytes:
+        step = OPUS_FRAME_SAMPLES * self.frame_size
+        data = self._take(self._process(pcm), step)
+        packets: List[bytes] = []
+        for i in range(0, len(data), step):
+            packet = self.encoder.encode(data[i:i + step], OPUS_FRAME_SAMPLES)
+            packets.append(PACKET_HEADER.pack(len(packet)) + packet)
+        return b"".join(packets)
+
+
+class DtxEncoder(Encoder):
+    """
+    Discontinuous transmission: passes audio on to another encoder, but replaces silent chunks with silence
+    packets, which the bot turns back into the same amount of silence. Silent chunks skip the DSP stage and the
+    resampler, so their state is dropped when the audio comes back instead of sending what they held from before.
+    """
+
+    def __init__(self, inner: Encoder, detector: 'SilenceDetector', max_silence_ms: int = MAX_SILENCE_MS):
+        super().__init__()
+        self.inner: Encoder = inner
+        self.codec = inner.codec
+        self.sample_rate = inner.sample_rate
+        self.detector: 'SilenceDetector' = detector
+        self.max_silence_frames: int = SAMPLE_RATE * max_silence_ms // 1000
+        # Silent input frames not reported yet, and the totals at input and stream rate so rounding never adds up
+        self.pending_frames: int = 0
+        self.silent_frames: int = 0
+        self.reported_frames: int = 0
+        self.silent_chunks: int = 0
+        self.in_silence: bool = False
+        # Silence as the bot fills it in, `processed` of silent chunks is a part of it
+        self.zeros: bytes = b""
+
+    def reset(self):
+        super().reset()
+        self.inner.reset()
+        self.pending_frames = self.silent_frames = self.reported_frames = 0
+        self.in_silence = False
+
+    @property
+    def held(self) -> int:
+        # Silence waiting for its silence packet and a partial frame
+        return self.pending_frames * FRAME_SIZE + len(self.remainder)
+
+    def set_resampler(self, resampler: Optional['Resampler']):
+        self.inner.set_resampler(resampler)
+        self.sample_rate = self.inner.sample_rate
+
+    def set_dsp(self, dsp: Optional['DspStage']):
+        self.inner.set_dsp(dsp)
+        self.channels = self.inner.channels
+
+    def set_channels(self, channels: int):
+        self.inner.set_channels(channels)
+        self.channels = channels
+
+    @property
+    def version(self) -> int:
+        return STREAM_VERSION_FLAGS
+
+    def header(self, bitrate: int, version: Optional[int] = None, flags: int = 0) -> bytes:
+        return self.inner.header(bitrate, self.version if version is None else version, flags | DTX_ACCEPTED)
+
+    def flush(self) -> bytes:
+        # Silence packet for the silence since the last one, empty if there was none
+        if not self.pending_frames:
+            return b""
+        self.silent_frames += self.pending_frames
+        self.pending_frames = 0
+        total = self.silent_frames * self.sample_rate // SAMPLE_RATE
+        frames, self.reported_frames = total - self.reported_frames, total
+        return PACKET_HEADER.pack(SILENCE_FLAG | frames)
+
+    def encode(self, pcm) -> bytes:
+        self.processed = b""
+        data = self._take(pcm, FRAME_SIZE)
+        if not data:
+            return b""
+        if self.detector.is_silent(data):
+            self.silent_chunks += 1
+            self.in_silence = True
+            size = len(data) // FRAME_SIZE * self.sample_rate // SAMPLE_RATE * self.frame_size
+            if len(self.zeros) < size:
+                self.zeros = bytes(size)
+            self.processed = memoryview(self.zeros)[:size]
+            self.pending_frames += len(data) // FRAME_SIZE
+            return self.flush() if self.pending_frames >= self.max_silence_frames else b""
+        if self.in_silence:
+            self.in_silence = False
+            self.inner.reset_processing()
+        packets = self.flush() + self.inner.encode(data)
+        self.processed = self.inner.processed
+        return packets
+
+
+def stream_format(encoder: Optional[Encoder]) -> Tuple[int, int]:
+    # (sample rate, channels) of the PCM sent with an encoder, None sends librespot's
+    return (encoder.sample_rate, encoder.channels) if encoder is not None else (SAMPLE_RATE, CHANNELS)
+
+
+def create_encoder(codec: str, bitrate: int, silence_threshold_db: Optional[float] = None,
+                   resample_quality: Optional[str] = None, dsp: Optional['DspStage'] = None) -> Optional[Encoder]:
+    # With a silence threshold, the encoder offers discontinuous transmission, with a resampling quality it offers
+    # Discord's 48 kHz, and a DSP stage that downmixes offers mono. Plain PCM needs no encoder, unless it has to be
+    # negotiated for those or go through the DSP stage.
+    if codec == PCM:
+        if silence_threshold_db is None and resample_quality is None and dsp is None:
+            return None
+        encoder = PcmEncoder()
+    elif codec == LOSSLESS:
+        encoder = LosslessEncoder()
+    elif codec == OPUS:
+        encoder = OpusEncoder(bitrate, resample_quality)
+    else:
+        raise ValueError(f"Unknown codec: '{codec}'")
+    if dsp is not None:
+        encoder.set_dsp(dsp)
+    if resample_quality is not None and codec != OPUS:
+        from resampler import Resampler
+        encoder.set_resampler(Resampler(SAMPLE_RATE, DISCORD_SAMPLE_RATE, resample_quality))
+    if silence_threshold_db is not None:
+        from silence import SilenceDetector
+        encoder = DtxEncoder(encoder, SilenceDetector(silence_threshold_db))
+    return encoder
+
+
+def parse_packet_header(data: bytes) -> Tuple[bool, int]:
+    # (is a silence packet, payload length or silent frames)
+    value, = PACKET_HEADER.unpack(data)
+    return bool(value & SILENCE_FLAG), value & ~SILENCE_FLAG
+
+
+def decode_lossless(payload: bytes, frame_size: int = FRAME_SIZE) -> bytes:
+    planes = zlib.decompress(payload)
+    plane_size = len(planes) // frame_size
+    pcm = bytearray(len(planes))
+    for i in range(frame_size):
+        pcm[i::frame_size] = planes[i * plane_size:(i + 1) * plane_size]
+    return bytes(pcm)
+
+
+async def negotiate(sock: socket.socket, encoder: Encoder, bitrate: int,
+                    timeout: float = NEGOTIATE_TIMEOUT) -> Optional[Encoder]:
+    # Offer the encoder's codec to the bot, returns the encoder to use (None if the bot wants plain PCM)
+    loop = asyncio.get_running_loop()
+    await loop.sock_sendall(sock, encoder.header(bitrate))
+    try:
+        answer = await asyncio.wait_for(loop.sock_recv(sock, 1), timeout)
+    except asyncio.TimeoutError:
+        raise ConnectionError("Bot did not answer the stream header, it may not support encoded streams.")
+    if not answer:
+        raise ConnectionResetError("Bot closed the connection during codec negotiation.")
+    codec_id = answer[0] & CODEC_ID_MASK
+    if isinstance(encoder, DtxEncoder) and not answer[0] & DTX_ACCEPTED:
+        print("Bot does not support silence packets, sending silence as audio")
+        encoder = encoder.inner
+    base = encoder.inner if isinstance(encoder, DtxEncoder) else encoder
+    if base.resampler is not None and base.codec != OPUS and not answer[0] & RATE_ACCEPTED:
+        print(f"Bot does not accept {base.sample_rate} Hz, sending {SAMPLE_RATE} Hz")
+        encoder.set_resampler(None)
+    if base.channels != CHANNELS and not answer[0] & CHANNELS_ACCEPTED:
+        print("Bot does not accept mono, sending stereo")
+        encoder.set_channels(CHANNELS)
+    if codec_id == CODEC_IDS[encoder.codec]:
+        if isinstance(base, PcmEncoder):
+            # Only silence packets need framing, without anything else left to do it is the plain stream again
+            base.framed = encoder is not base
+            if not encoder.negotiated and base.dsp is None:
+                return None
+        return encoder
+    if codec_id == CODEC_IDS[PCM]:
+        print(f"Bot does not support {encoder.codec}, streaming PCM instead")
+        if base.dsp is None:
+            return None
+        # Still through the DSP stage, in librespot's format
+        fallback = PcmEncoder()
+        fallback.set_dsp(base.dsp)
+        fallback.set_channels(CHANNELS)
+        return fallback
+    raise ConnectionError(f"Bot answered with unknown codec id {codec_id}.")
@@ -0,0 +1,236 @@
+import itertools
+import socket
+import sys
+import time
+import weakref
+from threading import Lock
+from typing import Optional, List
+
+from metrics import LatencyHistogram, RateMeter
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    # Windows, backlog and send queue sizes are not available
+    fcntl = termios = None
+
+# Bytes queued in a pipe (FIONREAD) and not yet sent from a socket's send buffer (SIOCOUTQ, same as TIOCOUTQ)
+FIONREAD = getattr(termios, "FIONREAD", None)
+SIOCOUTQ = getattr(termios, "TIOCOUTQ", None) if sys.platform == "linux" else None
+
+# Send latencies are much shorter than API latencies
+SEND_LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# The DSP stage should not take more than this share of the audio's duration per chunk
+DSP_BUDGET = 0.05
+
+# Time it took to stop sessions, for all sessions together since they are gone afterwards
+SHUTDOWN_LATENCY = LatencyHistogram()
+
+# Every StreamMetrics that is still alive, for the metrics endpoint
+REGISTRY: 'weakref.WeakSet[StreamMetrics]' = weakref.WeakSet()
+# Sets every StreamMetrics apart in the metrics, a user can have several sessions (other link codes or bitrates)
+STREAM_IDS = itertools.count(1)
+
+
+def _queued_bytes(fd: int, request: Optional[int]) -> Optional[int]:
+    if fcntl is None or request is None or fd < 0:
+        return None
+    try:
+        buf = bytearray(4)
+        fcntl.ioctl(fd, request, buf)
+        return int.from_bytes(buf, sys.byteorder, signed=True)
+    except OSError:
+        return None
+
+
+class StreamMetrics:
+    """
+    Metrics of the audio streams of one SpotifyController.
+
+    Counters are updated by the relay on the engine loop, the backlog and send queue are sampled when the metrics
+    are read, so reading them costs the send path nothing.
+    """
+
+    def __init__(self, session: str, target_rate: int):
+        self.session: str = session
+        self.stream_id: int = next(STREAM_IDS)
+        self.target_rate: int = target_rate
+        self.rate: RateMeter = RateMeter()
+        # What actually went over the network, smaller than the audio when the stream is encoded
+        self.wire_rate: RateMeter = RateMeter()
+        self.wire_bytes_sent: int = 0
+        self.send_latency: LatencyHistogram = LatencyHistogram(SEND_LATENCY_BUCKETS)
+        # Time from losing the bot to sending it audio again
+        self.recovery: LatencyHistogram = LatencyHistogram()
+        self.last_recovery: Optional[float] = None
+        self.bytes_sent: int = 0
+        self.chunks_sent: int = 0
+        self.connects: int = 0
+        self.reconnects: int = 0
+        self.disconnects: int = 0
+        self.pipe_fd: Optional[int] = None
+        self.sock: Optional[socket.socket] = None
+        # Jitter buffer of the current stream, if any, for its underruns and depth
+        self.jitter_buffer = None
+        self.underruns: int = 0
+        # Processing time of the DSP stage per chunk, the share of the chunk's duration it took last, and the
+        # chunks that went over DSP_BUDGET
+        self.dsp_time: LatencyHistogram = LatencyHistogram(SEND_LATENCY_BUCKETS)
+        self.dsp_load: Optional[float] = None
+        self.dsp_over_budget: int = 0
+        self.lock: Lock = Lock()
+        REGISTRY.add(self)
+
+    def record_send(self, amount: int, latency: float, wire: Optional[int] = None):
+        wire = amount if wire is None else wire
+        with self.lock:
+            self.bytes_sent += amount
+            self.wire_bytes_sent += wire
+            self.chunks_sent += 1
+        self.rate.add(amount)
+        self.wire_rate.add(wire)
+        self.send_latency.observe(latency)
+
+    def record_dsp(self, seconds: float, audio_seconds: float):
+        self.dsp_time.observe(seconds)
+        self.dsp_load = seconds / max(audio_seconds, 1e-9)
+        if self.dsp_load > DSP_BUDGET:
+            with self.lock:
+                self.dsp_over_budget += 1
+
+    def record_connect(self, sock: socket.socket, reconnect: bool = False):
+        with self.lock:
+            self.sock = sock
+            self.connects += 1
+            if reconnect:
+                self.reconnects += 1
+
+    def record_recovery(self, seconds: float):
+        self.last_recovery = seconds
+        self.recovery.observe(seconds)
+
+    def record_disconnect(self):
+        with self.lock:
+            self.sock = None
+            self.disconnects += 1
+
+    def attach_jitter_buffer(self, jitter_buffer):
+        # Keep the underruns of the previous buffer when a stream is set up again
+        with self.lock:
+            if self.jitter_buffer is not None:
+                self.underruns += self.jitter_buffer.underruns
+            self.jitter_buffer = jitter_buffer
+
+    @property
+    def total_underruns(self) -> int:
+        jitter_buffer = self.jitter_buffer
+        return self.underruns + (jitter_buffer.underruns if jitter_buffer is not None else 0)
+
+    @property
+    def pipe_backlog(self) -> Optional[int]:
+        return _queued_bytes(self.pipe_fd, FIONREAD) if self.pipe_fd is not None else None
+
+    @property
+    def socket_queue(self) -> Optional[int]:
+        sock = self.sock
+        return _queued_bytes(sock.fileno(), SIOCOUTQ) if sock is not None else None
+
+    def summary(self) -> str:
+        # Single line for the status window
+        rate = self.rate.rate()
+        parts = [f"{rate / 1000:.1f} of {self.target_rate / 1000:.1f} kB/s ({rate / self.target_rate * 100:.0f}%)",
+                 f"send p50 {self.send_latency.percentile(50) * 1000:.1f} ms, "
+                 f"p99 {self.send_latency.percentile(99) * 1000:.1f} ms"]
+        if self.wire_bytes_sent != self.bytes_sent:
+            parts.insert(1, f"{self.wire_rate.rate() / 1000:.1f} kB/s encoded")
+        if (backlog := self.pipe_backlog) is not None:
+            parts.append(f"backlog {backlog / 1000:.1f} kB")
+        if (queued := self.socket_queue) is not None:
+            parts.append(f"unsent {queued / 1000:.1f} kB")
+        if self.jitter_buffer is not None:
+            parts.append(f"{self.total_underruns} underruns")
+        if self.dsp_time.count:
+            parts.append(f"dsp p99 {self.dsp_time.percentile(99) * 1000:.1f} ms, {self.dsp_over_budget} over budget")
+        parts.append(f"{self.reconnects} reconnects")
+        if self.last_recovery is not None:
+            parts.append(f"last recovery {self.last_recovery:.1f} s")
+        return ", ".join(parts)
+
+    @property
+    def labels(self) -> str:
+        return f'session="{_label(self.session)}",stream="{self.stream_id}"'
+
+
+def _gauge(lines: List[str], name: str, help_text: str, kind: str, values):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in values:
+        if value is not None:
+            lines.append(f"{name}{labels} {value}")
+
+
+def _histogram(lines: List[str], name: str, help_text: str, histograms):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    # None as the labels for histograms that are not per session
+    for label, histogram in histograms:
+        label = label or ""
+        labels = f"{{{label}}}" if label else ""
+        buckets, counts, count, total = histogram.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{{label + "," if label else ""}le="{le}"}} {cumulative}')
+        lines.append(f'{name}_sum{labels} {total}')
+        lines.append(f'{name}_count{labels} {count}')
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus(streams: Optional[List[StreamMetrics]] = None) -> str:
+    # Prometheus text exposition format for all streams
+    streams = list(REGISTRY) if streams is None else streams
+    now = time.monotonic()
+    labeled = [(f"{{{m.labels}}}", m) for m in streams]
+    lines: List[str] = []
+    _gauge(lines, "spoofy_stream_bytes_sent_total", "Audio bytes handed to the bot socket.", "counter",
+           [(labels, m.bytes_sent) for labels, m in labeled])
+    _gauge(lines, "spoofy_stream_wire_bytes_sent_total", "Bytes handed to the bot socket after encoding.", "counter",
+           [(labels, m.wire_bytes_sent) for labels, m in labeled])
+    _gauge(lines, "spoofy_stream_throughput_bytes_per_second", "Audio throughput over the last 5 seconds.", "gauge",
+           [(labels, f"{m.rate.rate(now):.1f}") for labels, m in labeled])
+    _gauge(lines, "spoofy_stream_target_bytes_per_second", "Real time audio rate.", "gauge",
+           [(labels, m.target_rate) for labels, m in labeled])
+    _gauge(lines, "spoofy_stream_pipe_backlog_bytes", "Audio waiting in the librespot pipe.", "gauge",
+           [(labels, m.pipe_backlog) for labels, m in labeled])
+    _gauge(lines, "spoofy_stream_socket_unsent_bytes", "Audio in the socket send buffer, not yet sent.", "gauge",
+           [(labels, m.socket_queue) for labels, m in labeled])
+    _gauge(lines, "spoofy_stream_underruns_total", "Times the jitter buffer ran dry.", "counter",
+           [(labels, m.total_underruns) for labels, m in labeled])
+    _gauge(lines, "spoofy_stream_jitter_buffer_depth_seconds", "Audio in the jitter buffer.", "gauge",
+           [(labels, None if m.jitter_buffer is None else f"{m.jitter_buffer.depth_ms / 1000:.3f}")
+            for labels, m in labeled])
+    _gauge(lines, "spoofy_stream_dsp_load_ratio", "Share of the last chunk's duration the DSP stage took.", "gauge",
+           [(labels, None if m.dsp_load is None else f"{m.dsp_load:.4f}") for labels, m in labeled])
+    _gauge(lines, "spoofy_stream_dsp_over_budget_total", f"Chunks the DSP stage took over {DSP_BUDGET:.0%} of.",
+           "counter", [(labels, m.dsp_over_budget) for labels, m in labeled])
+    _gauge(lines, "spoofy_stream_connects_total", "Connections made to the bot.", "counter",
+           [(labels, m.connects) for labels, m in labeled])
+    _gauge(lines, "spoofy_stream_reconnects_total", "Automatic reconnections to the bot.", "counter",
+           [(labels, m.reconnects) for labels, m in labeled])
+    _gauge(lines, "spoofy_stream_disconnects_total", "Connections to the bot that were lost.", "counter",
+           [(labels, m.disconnects) for labels, m in labeled])
+
+    _histogram(lines, "spoofy_stream_send_latency_seconds", "Time to hand one chunk of audio to the bot socket.",
+               [(m.labels, m.send_latency) for m in streams])
+    _histogram(lines, "spoofy_stream_dsp_seconds", "Time the DSP stage took for one chunk of audio.",
+               [(m.labels, m.dsp_time) for m in streams])
+    _histogram(lines, "spoofy_stream_recovery_seconds", "Time from losing the bot to sending it audio again.",
+               [(m.labels, m.recovery) for m in streams])
+    _histogram(lines, "spoofy_shutdown_seconds", "Time to stop a librespot session.", [(None, SHUTDOWN_LATENCY)])
+    return "\n".join(lines) + "\n"
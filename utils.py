@@ -1,3 +1,4 @@
+import hashlib
 import os
 import re
 import sys
@@ -9,6 +10,11 @@ def resource_path(relative):
         relative
     )
 
+def hash_password(password: str, salt: bytes) -> bytes:
+    # Passwords are never stored, only enough to tell whether the same one was given again
+    return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, 10000)
+
+
 def strip_html(message):
     if "<body" in message and "</body>" in message:
         body = message.split("<body", maxsplit=1)[1]